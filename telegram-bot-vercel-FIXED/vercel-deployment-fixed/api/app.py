@@ -63,6 +63,7 @@ try:
     from src.routes.bot_routes import bot_bp
     from src.routes.bot_control import bot_control_bp
     from src.routes.file_routes import file_bp
+    from src.startup import initialize_app
     
     # Initialize database
     db.init_app(app)
@@ -73,10 +74,9 @@ try:
     app.register_blueprint(bot_control_bp, url_prefix='/api')
     app.register_blueprint(file_bp, url_prefix='/api')
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        
+    # Create database tables, search indexes and command line tools
+    initialize_app(app)
+    
 except Exception as e:
     print(f"Warning: Could not load full application: {e}")
     # Continue with basic app
@@ -0,0 +1,31 @@
+import click
+from flask.cli import AppGroup
+
+search_index_cli = AppGroup('search-index', help='Export and import search snapshots of keyword-search bots.')
+
+
+@search_index_cli.command('export')
+@click.argument('bot_id', type=int)
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export_search_index(bot_id, path):
+    """Write a bot's search snapshot to a compressed, checksummed archive"""
+    from src.services.corpus_snapshot import corpus_snapshots
+    
+    with open(path, 'wb') as f:
+        summary = corpus_snapshots.export(bot_id, f)
+    click.echo(f"Exported {summary['chunks']} chunks in {summary['segments']} segments of bot {bot_id} to {path}")
+
+
+@search_index_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--bot-id', type=int, default=None, help='Bot to install the snapshot for (default: the exporting bot).')
+def import_search_index(path, bot_id):
+    """Install a search snapshot archive as a bot's stored index"""
+    from src.services.corpus_snapshot import corpus_snapshots
+    
+    with open(path, 'rb') as f:
+        summary = corpus_snapshots.import_archive(f, bot_id)
+    if summary['adopted']:
+        click.echo(f"Imported {summary['chunks']} chunks in {summary['segments']} segments for bot {summary['bot_id']}")
+    else:
+        click.echo(f"Imported the snapshot of bot {summary['bot_id']}, but the index changed too much since; rebuilding")
@@ -1,19 +1,21 @@
 import os
 import sys
 
-# Ensure the src directory is in the Python path
+# Ensure the src directory and its parent (for the src. package imports) are in the Python path
 current_dir = os.path.dirname(os.path.abspath(__file__))
-if current_dir not in sys.path:
-    sys.path.insert(0, current_dir)
+for path in (current_dir, os.path.dirname(current_dir)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from models.user import db
+from src.models.user import db
 # Import all models to ensure they are registered with SQLAlchemy
-from models.user import User
-from models.bot import Bot, KnowledgeBase, Document, TextChunk, Conversation
-from routes.user import user_bp
-from routes.bot_routes import bot_bp
+from src.models.user import User
+from src.models.bot import Bot, KnowledgeBase, Document, TextChunk, Conversation
+from src.routes.user import user_bp
+from src.routes.bot_routes import bot_bp
+from src.startup import initialize_app
 
 app = Flask(__name__, static_folder=os.path.join(current_dir, 'static'))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
@@ -41,16 +43,15 @@ app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(bot_bp, url_prefix='/api')
 
 # Import and register bot control routes
-from routes.bot_control import bot_control_bp
+from src.routes.bot_control import bot_control_bp
 app.register_blueprint(bot_control_bp, url_prefix='/api')
 
 # Import and register file routes
-from routes.file_routes import file_bp
+from src.routes.file_routes import file_bp
 app.register_blueprint(file_bp, url_prefix='/api')
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+# Create database tables, search indexes and command line tools
+initialize_app(app)
 
 # Serve static files
 @app.route('/')
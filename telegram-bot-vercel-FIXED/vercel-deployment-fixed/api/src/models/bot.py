@@ -1,6 +1,7 @@
-from models.user import db
+from src.models.user import db
 from datetime import datetime
 from cryptography.fernet import Fernet
+import json
 import os
 
 class Bot(db.Model):
@@ -10,6 +11,8 @@ class Bot(db.Model):
     username = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=False)
+    search_backend = db.Column(db.String(20), nullable=False, default='keyword')  # Retrieval backend
+    answer_filter = db.Column(db.Text)  # JSON search filter applied to Telegram answers
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -39,6 +42,8 @@ class Bot(db.Model):
             'username': self.username,
             'description': self.description,
             'is_active': self.is_active,
+            'search_backend': self.search_backend,
+            'answer_filter': json.loads(self.answer_filter) if self.answer_filter else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'knowledge_bases_count': len(self.knowledge_bases)
@@ -50,11 +55,15 @@ class KnowledgeBase(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
+    indexed_chunks = db.Column(db.Integer, nullable=False, default=0)  # BM25 collection size
+    indexed_tokens = db.Column(db.Integer, nullable=False, default=0)  # BM25 total chunk length
+    index_generation = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every index change
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     documents = db.relationship('Document', backref='knowledge_base', lazy=True, cascade='all, delete-orphan')
+    term_statistics = db.relationship('TermStatistic', backref='knowledge_base', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<KnowledgeBase {self.name}>'
@@ -106,9 +115,15 @@ class TextChunk(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     chunk_index = db.Column(db.Integer, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False, default=0)  # Indexed keywords in the chunk
+    keywords = db.Column(db.Text)  # Analysed keywords in text order, space separated
+    embedding = db.Column(db.LargeBinary)  # int8-quantised vector for the vector search backend
     document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Relationships
+    postings = db.relationship('TermPosting', backref='chunk', lazy=True, cascade='all, delete-orphan')
+    
     def __repr__(self):
         return f'<TextChunk {self.id}>'
     
@@ -122,12 +137,45 @@ class TextChunk(db.Model):
         }
 
 
+class TermPosting(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(100), nullable=False)
+    term_frequency = db.Column(db.Integer, nullable=False, default=1)
+    positions = db.Column(db.LargeBinary)  # Keyword offsets in the chunk, delta + varint encoded
+    chunk_id = db.Column(db.Integer, db.ForeignKey('text_chunk.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False, index=True)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False)
+    
+    # Term lookups are always scoped to a set of knowledge bases
+    __table_args__ = (
+        db.Index('ix_term_posting_kb_term', 'knowledge_base_id', 'term'),
+    )
+    
+    def __repr__(self):
+        return f'<TermPosting {self.term} -> {self.chunk_id}>'
+
+
+class TermStatistic(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(100), nullable=False)
+    document_frequency = db.Column(db.Integer, nullable=False, default=0)  # Chunks containing the term
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('knowledge_base_id', 'term', name='uq_term_statistic_kb_term'),
+    )
+    
+    def __repr__(self):
+        return f'<TermStatistic {self.term} df={self.document_frequency}>'
+
+
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     telegram_user_id = db.Column(db.String(50), nullable=False)
     telegram_username = db.Column(db.String(100))
     message = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text)
+    reusable = db.Column(db.Boolean, nullable=False, default=False)  # A complete search answer near duplicates may reuse
     bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
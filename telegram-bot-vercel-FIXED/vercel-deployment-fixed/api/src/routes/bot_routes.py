@@ -1,6 +1,12 @@
 from flask import Blueprint, request, jsonify
 from src.models.bot import db, Bot, KnowledgeBase, Document, TextChunk, Conversation
+from src.services.knowledge_base_service import SEARCH_BACKENDS
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.search_filters import SearchFilter
+from src.services.suggestions import suggestion_index
+from src.services.search_index import SearchIndex
 from datetime import datetime
+import json
 import os
 
 bot_bp = Blueprint('bot', __name__)
@@ -32,6 +38,13 @@ def create_bot():
                 'error': 'Name, token, and username are required'
             }), 400
         
+        search_backend = data.get('search_backend', 'keyword')
+        if search_backend not in SEARCH_BACKENDS:
+            return jsonify({
+                'success': False,
+                'error': f"search_backend must be one of: {', '.join(SEARCH_BACKENDS)}"
+            }), 400
+        
         # Check if username already exists
         existing_bot = Bot.query.filter_by(username=data['username']).first()
         if existing_bot:
@@ -43,7 +56,8 @@ def create_bot():
         bot = Bot(
             name=data['name'],
             username=data['username'],
-            description=data.get('description', '')
+            description=data.get('description', ''),
+            search_backend=search_backend
         )
         bot.encrypt_token(data['token'])
         
@@ -92,10 +106,36 @@ def update_bot(bot_id):
             bot.encrypt_token(data['token'])
         if 'is_active' in data:
             bot.is_active = data['is_active']
+        if data.get('search_backend'):
+            if data['search_backend'] not in SEARCH_BACKENDS:
+                return jsonify({
+                    'success': False,
+                    'error': f"search_backend must be one of: {', '.join(SEARCH_BACKENDS)}"
+                }), 400
+            bot.search_backend = data['search_backend']
+        if 'answer_filter' in data:
+            # Restricts Telegram answers to some knowledge bases, file types or upload dates; null clears it
+            try:
+                answer_filter = SearchFilter.from_dict(data['answer_filter'])
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': f'answer_filter: {e}'
+                }), 400
+            kb_ids = {kb.id for kb in bot.knowledge_bases}
+            if answer_filter is not None and answer_filter.kb_ids and not answer_filter.kb_ids <= kb_ids:
+                return jsonify({
+                    'success': False,
+                    'error': 'answer_filter kb_ids must be knowledge bases of this bot'
+                }), 400
+            bot.answer_filter = json.dumps(answer_filter.to_dict()) if answer_filter else None
         
         bot.updated_at = datetime.utcnow()
         db.session.commit()
         
+        # The search backend or answer filter may have changed
+        corpus_snapshots.invalidate(bot_id)
+        
         return jsonify({
             'success': True,
             'data': bot.to_dict()
@@ -113,9 +153,15 @@ def delete_bot(bot_id):
     """Delete a bot"""
     try:
         bot = Bot.query.get_or_404(bot_id)
+        kb_ids = [kb.id for kb in bot.knowledge_bases]
         db.session.delete(bot)
         db.session.commit()
         
+        corpus_snapshots.invalidate(bot_id)
+        for kb_id in kb_ids:
+            suggestion_index.invalidate(kb_id)
+            SearchIndex().forget_knowledge_base(kb_id)
+        
         return jsonify({
             'success': True,
             'message': 'Bot deleted successfully'
@@ -184,9 +230,17 @@ def delete_knowledge_base(kb_id):
     """Delete a knowledge base"""
     try:
         kb = KnowledgeBase.query.get_or_404(kb_id)
+        bot_id = kb.bot_id
         db.session.delete(kb)
+        
+        # Marks the bot's corpus as changed for answer reuse from the conversation log
+        kb.bot.updated_at = datetime.utcnow()
         db.session.commit()
         
+        corpus_snapshots.invalidate(bot_id)
+        suggestion_index.invalidate(kb_id)
+        SearchIndex().forget_knowledge_base(kb_id)
+        
         return jsonify({
             'success': True,
             'message': 'Knowledge base deleted successfully'
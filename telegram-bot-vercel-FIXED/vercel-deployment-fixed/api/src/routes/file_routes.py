@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, current_app
-from src.models.bot import db, KnowledgeBase, Document
+from flask import Blueprint, Response, request, jsonify, current_app, send_file, stream_with_context
+from src.models.bot import db, Bot, KnowledgeBase, Document
 from src.services.file_processor import FileProcessor
+from contextlib import nullcontext
 import threading
+import tempfile
+import json
 import os
 
 file_bp = Blueprint('file', __name__)
@@ -11,6 +14,18 @@ def get_file_processor():
     upload_folder = current_app.config['UPLOAD_FOLDER']
     return FileProcessor(upload_folder)
 
+def search_result(chunk):
+    """Serialize a matching chunk with its document"""
+    document = chunk.document
+    return {
+        'chunk': chunk.to_dict(),
+        'document': {
+            'id': document.id,
+            'filename': document.original_filename,
+            'file_type': document.file_type
+        }
+    }
+
 @file_bp.route('/knowledge-bases/<int:kb_id>/upload', methods=['POST'])
 def upload_file(kb_id):
     """Upload a file to a knowledge base"""
@@ -85,6 +100,51 @@ def get_documents(kb_id):
             'error': str(e)
         }), 500
 
+@file_bp.route('/knowledge-bases/<int:kb_id>/documents/search', methods=['GET'])
+def search_documents(kb_id):
+    """Find documents whose names contain ?q=, best matches first, a page at a time"""
+    try:
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({
+                'success': False,
+                'error': 'Query is required'
+            }), 400
+        
+        from src.services.knowledge_base_service import (
+            KnowledgeBaseService, DOCUMENT_SEARCH_PAGE_SIZE, DOCUMENT_SEARCH_MAX_PAGE_SIZE
+        )
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', DOCUMENT_SEARCH_PAGE_SIZE, type=int),
+                              DOCUMENT_SEARCH_MAX_PAGE_SIZE))
+        
+        # Served by a trigram index over document names where the database has one
+        found = KnowledgeBaseService().search_documents(kb_id, query, page, per_page)
+        if found is None:
+            return jsonify({
+                'success': False,
+                'error': 'Knowledge base not found'
+            }), 404
+        documents, total = found
+        
+        return jsonify({
+            'success': True,
+            'data': [doc.to_dict() for doc in documents],
+            'query': query,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': -(-total // per_page)
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @file_bp.route('/documents/<int:doc_id>', methods=['GET'])
 def get_document(doc_id):
     """Get detailed information about a document"""
@@ -196,29 +256,286 @@ def search_knowledge_base(kb_id):
         
         query = data['query']
         max_results = data.get('max_results', 5)
+        explain = bool(data.get('explain')) or request.args.get('explain') == 'true'
         
         from src.services.knowledge_base_service import KnowledgeBaseService
+        from src.services.search_filters import SearchFilter
+        from src.services.search_profile import SearchProfile, stage
         kb_service = KnowledgeBaseService()
         
-        # Search in this specific knowledge base
-        relevant_chunks = kb_service._search_chunks([kb_id], query, max_results)
-        
-        results = []
-        for chunk in relevant_chunks:
-            document = Document.query.get(chunk.document_id)
-            results.append({
-                'chunk': chunk.to_dict(),
-                'document': {
-                    'id': document.id,
-                    'filename': document.original_filename,
-                    'file_type': document.file_type
-                }
-            })
+        # Optional file type and upload date filters
+        search_filter = SearchFilter.from_dict(data.get('filters'))
         
-        return jsonify({
+        # Explain mode profiles the search: stage timings, SQL counts and per-term score breakdowns
+        profile = SearchProfile() if explain else None
+        with profile or nullcontext():
+            # Search in this specific knowledge base with the bot's configured backend
+            relevant_chunks = kb_service.search_chunks([kb_id], query, max_results, kb.bot.search_backend,
+                                                       search_filter=search_filter)
+            
+            with stage('serialize'):
+                results = [search_result(chunk) for chunk in relevant_chunks]
+        
+        response = {
             'success': True,
             'data': results,
             'query': query
+        }
+        if profile is not None:
+            response['explain'] = profile.to_dict()
+        return jsonify(response)
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def suggestions_response(kb_ids, text):
+    """Complete the last word of typed text from the knowledge bases' vocabulary, or None if none exist"""
+    from src.services.suggestions import MAX_SUGGESTIONS, suggestion_index
+    limit = request.args.get('limit', MAX_SUGGESTIONS, type=int)
+    result = suggestion_index.suggest(kb_ids, text, limit)
+    if result is None:
+        return None
+    
+    word, suggestions = result
+    return jsonify({
+        'success': True,
+        'data': {
+            'word': word,
+            'suggestions': [
+                {'term': term, 'frequency': frequency, 'text': completed}
+                for term, frequency, completed in suggestions
+            ]
+        }
+    })
+
+@file_bp.route('/knowledge-bases/<int:kb_id>/suggest', methods=['GET'])
+def suggest_knowledge_base_terms(kb_id):
+    """As-you-type completions of ?q= from a knowledge base's vocabulary, most frequent first"""
+    try:
+        # Answered from an in-memory trie; the database is only read to build or re-check it
+        response = suggestions_response([kb_id], request.args.get('q', ''))
+        if response is None:
+            return jsonify({
+                'success': False,
+                'error': 'Knowledge base not found'
+            }), 404
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/bots/<int:bot_id>/suggest', methods=['GET'])
+def suggest_bot_terms(bot_id):
+    """As-you-type completions of ?q= from all of a bot's knowledge bases"""
+    try:
+        from src.services.corpus_snapshot import corpus_snapshots
+        snapshot = corpus_snapshots.get(bot_id)
+        if snapshot is not None:
+            kb_ids = snapshot.kb_ids
+        else:
+            kb_ids = [kb_id for kb_id, in db.session.query(KnowledgeBase.id).filter_by(bot_id=bot_id)]
+        
+        response = suggestions_response(kb_ids, request.args.get('q', '')) if kb_ids else None
+        if response is None:
+            if not Bot.query.get(bot_id):
+                return jsonify({
+                    'success': False,
+                    'error': 'Bot not found'
+                }), 404
+            return jsonify({
+                'success': True,
+                'data': {'word': '', 'suggestions': []}
+            })
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/knowledge-bases/search/batch', methods=['POST'])
+def batch_search_knowledge_bases():
+    """Search many queries within knowledge bases, streaming one NDJSON line per query"""
+    try:
+        data = request.get_json()
+        
+        from src.services.knowledge_base_service import KnowledgeBaseService, BATCH_MAX_QUERIES
+        from src.services.search_filters import SearchFilter
+        
+        if not data or not data.get('kb_ids') or not data.get('queries'):
+            return jsonify({
+                'success': False,
+                'error': 'kb_ids and queries are required'
+            }), 400
+        
+        kb_ids = [int(kb_id) for kb_id in data['kb_ids']]
+        queries = [str(query) for query in data['queries']]
+        max_results = data.get('max_results', 5)
+        search_filter = SearchFilter.from_dict(data.get('filters'))
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {BATCH_MAX_QUERIES} queries are allowed per batch'
+            }), 400
+        
+        knowledge_bases = KnowledgeBase.query.filter(KnowledgeBase.id.in_(kb_ids)).all()
+        missing = set(kb_ids) - {kb.id for kb in knowledge_bases}
+        if missing:
+            return jsonify({
+                'success': False,
+                'error': f'Knowledge bases not found: {sorted(missing)}'
+            }), 404
+        
+        # The bots' shared backend, or keyword search when knowledge bases of differently configured bots are mixed
+        backends = {kb.bot.search_backend for kb in knowledge_bases}
+        backend = backends.pop() if len(backends) == 1 else 'keyword'
+        
+        kb_service = KnowledgeBaseService()
+        
+        def generate():
+            try:
+                results = kb_service.search_batch(kb_ids, queries, max_results, backend, search_filter)
+                for index, (query, chunks) in enumerate(zip(queries, results)):
+                    yield json.dumps({
+                        'index': index,
+                        'query': query,
+                        'data': [search_result(chunk) for chunk in chunks]
+                    }) + '\n'
+            except Exception as e:
+                # Headers are already sent, so a failure ends the stream with an error line
+                yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/knowledge-bases/<int:kb_id>/reindex', methods=['POST'])
+def reindex_knowledge_base(kb_id):
+    """Rebuild the search index for a knowledge base"""
+    try:
+        kb = KnowledgeBase.query.get_or_404(kb_id)
+        
+        from src.services.search_index import SearchIndex
+        from src.services.corpus_snapshot import corpus_snapshots
+        from src.services.suggestions import suggestion_index
+        result = SearchIndex().reindex_knowledge_base(kb_id)
+        corpus_snapshots.invalidate(kb.bot_id)
+        suggestion_index.refresh(kb_id)
+        
+        return jsonify({
+            'success': True,
+            'data': result,
+            'message': f'Knowledge base {kb.name} reindexed successfully'
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/bots/<int:bot_id>/search-snapshot', methods=['GET'])
+def export_search_snapshot(bot_id):
+    """Download the bot's search snapshot as a compressed, checksummed archive"""
+    try:
+        bot = Bot.query.get_or_404(bot_id)
+        
+        from src.services.corpus_snapshot import corpus_snapshots
+        from src.services.snapshot_archive import archive_name
+        archive = tempfile.TemporaryFile()
+        corpus_snapshots.export(bot_id, archive)
+        archive.seek(0)
+        
+        return send_file(archive, mimetype='application/gzip', as_attachment=True,
+                         download_name=archive_name(bot_id))
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/bots/<int:bot_id>/search-snapshot', methods=['PUT'])
+def import_search_snapshot(bot_id):
+    """Install an uploaded search snapshot archive (file field or raw body) as the bot's index"""
+    try:
+        bot = Bot.query.get_or_404(bot_id)
+        
+        from src.services.corpus_snapshot import corpus_snapshots
+        archive = request.files['file'].stream if 'file' in request.files else request.stream
+        summary = corpus_snapshots.import_archive(archive, bot_id)
+        
+        return jsonify({
+            'success': True,
+            'data': summary
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/search/cache', methods=['GET'])
+def get_search_cache_stats():
+    """Get hit/miss counters and size of the search result cache"""
+    try:
+        from src.services.search_cache import search_cache
+        
+        return jsonify({
+            'success': True,
+            'data': search_cache.stats()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@file_bp.route('/search/metrics', methods=['GET'])
+def get_search_metrics():
+    """Get search counts, partial (over budget) searches and latency percentiles"""
+    try:
+        from src.services.search_budget import search_metrics
+        from src.services.question_index import question_index
+        
+        data = search_metrics.stats()
+        data['question_reuse'] = question_index.stats()
+        return jsonify({
+            'success': True,
+            'data': data
         })
         
     except Exception as e:
@@ -0,0 +1,158 @@
+from array import array
+from bisect import bisect_left
+
+# Each container holds the values sharing their high 16 bits
+CONTAINER_BITS = 16
+CONTAINER_MASK = (1 << CONTAINER_BITS) - 1
+
+# Containers up to this many values are sorted arrays, fuller ones are bitsets (the roaring threshold)
+ARRAY_MAX_VALUES = 4096
+
+# Bytes of a bitset container
+BITSET_BYTES = (1 << CONTAINER_BITS) // 8
+
+
+def _to_bitset(values):
+    """Bitset container holding the low 16-bit values"""
+    bits = bytearray(BITSET_BYTES)
+    for value in values:
+        bits[value >> 3] |= 1 << (value & 7)
+    return bytes(bits)
+
+
+def _bitset_values(bits):
+    """Set values of a bitset container in ascending order"""
+    number = int.from_bytes(bits, 'little')
+    values = array('H')
+    while number:
+        low = number & -number
+        values.append(low.bit_length() - 1)
+        number ^= low
+    return values
+
+
+def _compact(container):
+    """Store a container in its smaller form, or None when it is empty"""
+    if isinstance(container, bytes):
+        count = int.from_bytes(container, 'little').bit_count()
+        if count > ARRAY_MAX_VALUES:
+            return container
+        container = _bitset_values(container)
+    elif len(container) > ARRAY_MAX_VALUES:
+        return _to_bitset(container)
+    return container if len(container) else None
+
+
+def _cardinality(container):
+    """Number of values in a container"""
+    if isinstance(container, bytes):
+        return int.from_bytes(container, 'little').bit_count()
+    return len(container)
+
+
+def _intersect(first, second):
+    """Intersection of two containers"""
+    if isinstance(first, bytes) and isinstance(second, bytes):
+        number = int.from_bytes(first, 'little') & int.from_bytes(second, 'little')
+        return _compact(number.to_bytes(BITSET_BYTES, 'little'))
+    if isinstance(first, bytes):
+        first, second = second, first
+    if isinstance(second, bytes):
+        return _compact(array('H', (value for value in first if second[value >> 3] >> (value & 7) & 1)))
+    return _compact(array('H', sorted(set(first).intersection(second))))
+
+
+def _union(first, second):
+    """Union of two containers"""
+    if isinstance(first, bytes) or isinstance(second, bytes):
+        numbers = [
+            int.from_bytes(container if isinstance(container, bytes) else _to_bitset(container), 'little')
+            for container in (first, second)
+        ]
+        return _compact((numbers[0] | numbers[1]).to_bytes(BITSET_BYTES, 'little'))
+    return _compact(array('H', sorted(set(first).union(second))))
+
+
+class Bitmap:
+    """Roaring-style compressed set of non-negative integers, such as the chunk positions of an index segment"""
+    
+    __slots__ = ('containers', 'count')
+    
+    def __init__(self, values=()):
+        groups = {}
+        for value in values:
+            groups.setdefault(value >> CONTAINER_BITS, []).append(value & CONTAINER_MASK)
+        self.containers = {}  # high 16 bits -> sorted array('H') or bitset bytes
+        for key, low_values in sorted(groups.items()):
+            container = _compact(array('H', sorted(set(low_values))))
+            if container is not None:
+                self.containers[key] = container
+        self.count = sum(_cardinality(container) for container in self.containers.values())
+    
+    @classmethod
+    def _from_containers(cls, containers: dict):
+        bitmap = cls.__new__(cls)
+        bitmap.containers = containers
+        bitmap.count = sum(_cardinality(container) for container in containers.values())
+        return bitmap
+    
+    @classmethod
+    def union_all(cls, bitmaps):
+        """Union of any number of bitmaps"""
+        containers = {}
+        for bitmap in bitmaps:
+            for key, container in bitmap.containers.items():
+                containers[key] = _union(containers[key], container) if key in containers else container
+        return cls._from_containers(dict(sorted(containers.items())))
+    
+    def __len__(self):
+        return self.count
+    
+    def __bool__(self):
+        return self.count > 0
+    
+    def __contains__(self, value):
+        container = self.containers.get(value >> CONTAINER_BITS)
+        if container is None:
+            return False
+        low = value & CONTAINER_MASK
+        if isinstance(container, bytes):
+            return bool(container[low >> 3] >> (low & 7) & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+    
+    def __iter__(self):
+        for key, container in self.containers.items():
+            base = key << CONTAINER_BITS
+            for low in (_bitset_values(container) if isinstance(container, bytes) else container):
+                yield base | low
+    
+    def __and__(self, other):
+        containers = {}
+        for key, container in self.containers.items():
+            if key in other.containers:
+                intersection = _intersect(container, other.containers[key])
+                if intersection is not None:
+                    containers[key] = intersection
+        return Bitmap._from_containers(containers)
+    
+    def __or__(self, other):
+        return Bitmap.union_all((self, other))
+    
+    def __repr__(self):
+        return f'<Bitmap {self.count} values in {len(self.containers)} containers>'
+    
+    def select(self, values):
+        """Return the indexes of the sorted values that are in the bitmap"""
+        # A small bitmap seeks through the values; otherwise each value is looked up
+        if self.count * 8 < len(values):
+            selected = []
+            i = 0
+            for member in self:
+                i = bisect_left(values, member, i)
+                if i == len(values):
+                    break
+                if values[i] == member:
+                    selected.append(i)
+            return selected
+        return [i for i, value in enumerate(values) if value in self]
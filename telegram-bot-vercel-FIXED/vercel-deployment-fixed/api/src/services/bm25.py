@@ -0,0 +1,38 @@
+import math
+
+
+class CollectionStats:
+    """Collection statistics for one search: chunk count, average length and term IDFs"""
+    
+    def __init__(self, total_chunks, total_tokens, idf):
+        self.total_chunks = total_chunks
+        self.average_length = total_tokens / total_chunks if total_chunks else 0
+        self.idf = idf
+
+
+class BM25Scorer:
+    """Okapi BM25 ranking over statistics maintained at ingest time"""
+    
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+    
+    def idf(self, document_frequency, total_chunks):
+        """Inverse document frequency (never negative, even for very common terms)"""
+        return math.log(1 + (total_chunks - document_frequency + 0.5) / (document_frequency + 0.5))
+    
+    def collection_stats(self, total_chunks, total_tokens, document_frequencies: dict):
+        """Turn stored counters into the statistics used for scoring"""
+        idf = {
+            term: self.idf(frequency, total_chunks)
+            for term, frequency in document_frequencies.items()
+        }
+        return CollectionStats(total_chunks, total_tokens, idf)
+    
+    def term_score(self, term_frequency, chunk_length, idf, average_length):
+        """Score a single term occurrence count within a chunk"""
+        if average_length:
+            length_norm = 1 - self.b + self.b * chunk_length / average_length
+        else:
+            length_norm = 1
+        return idf * term_frequency * (self.k1 + 1) / (term_frequency + self.k1 * length_norm)
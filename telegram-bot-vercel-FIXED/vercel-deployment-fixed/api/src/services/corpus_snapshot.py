@@ -0,0 +1,646 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from flask import current_app, has_app_context
+from src.models.bot import db, Bot, KnowledgeBase, Document, TextChunk, TermPosting
+from src.services.index_files import index_store
+from src.services.index_segments import IndexSegment, MAX_SEGMENT_CHUNKS, merge_segments, plan_merge
+from src.services.search_cache import search_cache
+from src.services.snapshot_archive import SNAPSHOT_SOURCE, export_snapshot, import_snapshot, pull_snapshot
+from src.services.question_index import question_index
+
+logger = logging.getLogger(__name__)
+
+# How often a snapshot is re-checked against index changes made by other instances
+RECHECK_SECONDS = int(os.environ.get('SNAPSHOT_RECHECK_SECONDS', 30))
+
+# Lightweight stand-in for TextChunk returned by snapshot searches
+SnapshotChunk = namedtuple('SnapshotChunk', 'id document_id chunk_index content')
+
+
+class CorpusSnapshot:
+    """Immutable view of one bot's searchable corpus: index segments minus tombstoned documents"""
+    
+    def __init__(self, bot_id, generation, db_generations, segments, tombstones=frozenset(), next_position=None):
+        self.bot_id = bot_id
+        self.generation = generation
+        self.db_generations = db_generations  # {kb id: KnowledgeBase.index_generation}
+        self.kb_ids = list(db_generations)
+        self.verified_at = time.monotonic()
+        
+        # Segments cover ascending, disjoint ranges of global chunk positions; new ones start past the last
+        self.segments = list(segments)
+        self.starts = [segment.start for segment in self.segments]
+        if next_position is None:
+            next_position = self.segments[-1].start + self.segments[-1].size if self.segments else 0
+        self.next_position = next_position
+        
+        # Tombstones are kept until a merge drops the last chunks of their documents
+        self.tombstones = frozenset(
+            document_id for document_id in tombstones
+            if any(document_id in segment.document_positions for segment in self.segments)
+        )
+        self.dead = [segment.positions_of(self.tombstones) for segment in self.segments]
+        
+        self.filenames = {}
+        self.kb_stats = {kb_id: [0, 0] for kb_id in self.kb_ids}  # {kb id: [live chunks, live tokens]}
+        for segment, dead in zip(self.segments, self.dead):
+            self.filenames.update(segment.filenames)
+            for kb_id, (chunks, tokens) in segment.kb_stats.items():
+                stats = self.kb_stats.setdefault(kb_id, [0, 0])
+                stats[0] += chunks
+                stats[1] += tokens
+            for position in dead:
+                stats = self.kb_stats[segment.kb_of_chunk[position]]
+                stats[0] -= 1
+                stats[1] -= segment.lengths[position]
+        self.chunk_count = sum(chunks for chunks, _ in self.kb_stats.values())
+    
+    def segment_views(self):
+        """Return (segment, tombstoned local positions) pairs, the unit a query fans out to"""
+        return list(zip(self.segments, self.dead))
+    
+    def live_documents(self):
+        """Return {document id: knowledge base id} of the documents that are not tombstoned"""
+        documents = {}
+        for segment in self.segments:
+            for document_id in segment.document_positions:
+                if document_id not in self.tombstones:
+                    documents[document_id] = segment.kb_of_chunk[segment.document_positions[document_id][0]]
+        return documents
+    
+    def contains_document(self, document_id: int):
+        """Check whether a live document is part of the snapshot"""
+        return document_id not in self.tombstones and any(
+            document_id in segment.document_positions for segment in self.segments
+        )
+    
+    def with_segment(self, segment, db_generations):
+        """Return a snapshot with a new segment appended (the registry assigns its generation)"""
+        return CorpusSnapshot(self.bot_id, self.generation, db_generations, self.segments + [segment],
+                              self.tombstones, segment.start + segment.size)
+    
+    def with_tombstone(self, document_id: int, db_generations):
+        """Return a snapshot in which a document is deleted (the registry assigns its generation)"""
+        return CorpusSnapshot(self.bot_id, self.generation, db_generations, self.segments,
+                              self.tombstones | {document_id}, self.next_position)
+    
+    def with_merged(self, merging: list, merged):
+        """Return a snapshot with a run of segments replaced by their merge, or None if the run is gone"""
+        ids = [segment.segment_id for segment in self.segments]
+        merging_ids = [segment.segment_id for segment in merging]
+        if merging_ids[0] not in ids:
+            return None
+        i = ids.index(merging_ids[0])
+        if ids[i:i + len(merging_ids)] != merging_ids:
+            return None
+        
+        segments = self.segments[:i] + ([merged] if merged.size else []) + self.segments[i + len(merging):]
+        return CorpusSnapshot(self.bot_id, self.generation, self.db_generations, segments,
+                              self.tombstones, self.next_position)
+    
+    def plan_merge(self):
+        """Return the run of segments to merge next, or None"""
+        run = plan_merge([segment.size for segment in self.segments], [len(dead) for dead in self.dead])
+        return self.segments[run[0]:run[1]] if run else None
+    
+    def find_partial_terms(self, kb_ids: list, word: str):
+        """Find vocabulary terms that contain the word or are contained in it"""
+        matches = set()
+        for segment, dead in zip(self.segments, self.dead):
+            for kb_id in kb_ids:
+                if kb_id in segment.vocabulary_indexes:
+                    terms = segment.vocabulary_indexes[kb_id].partial_matches(word)
+                    if dead:
+                        terms = {term for term in terms if self._live_frequency(segment, dead, term, {kb_id})}
+                    matches |= terms
+        return matches
+    
+    def correct_term(self, kb_ids: list, word: str):
+        """Return the word if it is indexed, else the closest indexed term within a few edits, else None"""
+        kb_filter = None if set(kb_ids) >= set(self.kb_ids) else set(kb_ids)
+        matches = []
+        for segment, dead in zip(self.segments, self.dead):
+            # Terms left only in tombstoned chunks or in other knowledge bases are not part of the searched vocabulary
+            frequency = None
+            if dead or kb_filter is not None:
+                frequency = lambda term, segment=segment, dead=dead: self._live_frequency(segment, dead, term, kb_filter)
+            match = segment.spelling.lookup(word, frequency)
+            if match is not None:
+                matches.append(match)
+        if not matches:
+            return None
+        
+        # Segment dictionaries only know their own frequencies, so the closest terms are ranked bot-wide
+        distance = min(match[0] for match in matches)
+        candidates = set().union(*(terms for match_distance, terms in matches if match_distance == distance))
+        return min(candidates, key=lambda term: (
+            -sum(self._live_frequency(segment, dead, term, kb_filter) for segment, dead in zip(self.segments, self.dead)),
+            term
+        ))
+    
+    def _live_frequency(self, segment, dead, term, kb_filter=None):
+        """Number of the segment's live chunks containing the term, optionally within some knowledge bases"""
+        if not dead and kb_filter is None:
+            return segment.spelling.frequencies.get(term, 0)
+        if term not in segment.postings:
+            return 0
+        return sum(
+            1 for position in segment.postings[term][0]
+            if position not in dead and (kb_filter is None or segment.kb_of_chunk[position] in kb_filter)
+        )
+    
+    def find_postings(self, kb_ids: list, terms, search_filter=None):
+        """Return (chunk position, term, term frequency, chunk length) rows for the given terms"""
+        kb_filter = None if set(kb_ids) >= set(self.kb_ids) else set(kb_ids)
+        rows = []
+        for segment, dead in zip(self.segments, self.dead):
+            # Filtered searches only visit the postings of allowed positions
+            allowed = segment.filter_bitmaps().allowed(kb_ids, search_filter) if search_filter is not None else None
+            for term in terms:
+                if term not in segment.postings:
+                    continue
+                positions, frequencies, _ = segment.postings[term]
+                if allowed is not None:
+                    selected = allowed.select(positions)
+                    positions = [positions[i] for i in selected]
+                    frequencies = [frequencies[i] for i in selected]
+                for position, term_frequency in zip(positions, frequencies):
+                    if position in dead or (allowed is None and kb_filter is not None
+                                            and segment.kb_of_chunk[position] not in kb_filter):
+                        continue
+                    rows.append((segment.start + position, term, term_frequency, segment.lengths[position]))
+        return rows
+    
+    def get_positions(self, chunk_positions: list, terms):
+        """Return {chunk position: {term: keyword positions}} for postings that recorded positions"""
+        found = {}
+        for segment, local_positions in self._by_segment(chunk_positions):
+            for position, term_positions in segment.get_positions(local_positions, terms).items():
+                found[segment.start + position] = term_positions
+        return found
+    
+    def get_term_frequencies(self, chunk_positions: list, terms):
+        """Return {chunk position: ({term: term frequency}, chunk length)} for the given terms"""
+        found = {}
+        for segment, local_positions in self._by_segment(chunk_positions):
+            for position in local_positions:
+                term_frequencies = {}
+                for term in terms:
+                    if term not in segment.postings:
+                        continue
+                    positions, frequencies, _ = segment.postings[term]
+                    i = bisect_left(positions, position)
+                    if i < len(positions) and positions[i] == position:
+                        term_frequencies[term] = frequencies[i]
+                found[segment.start + position] = (term_frequencies, segment.lengths[position])
+        return found
+    
+    def get_collection_stats(self, kb_ids: list, terms):
+        """Return (total chunks, total tokens, document frequencies) across knowledge bases, net of tombstones"""
+        kb_filter = set(kb_ids)
+        total_chunks = sum(self.kb_stats[kb_id][0] for kb_id in kb_filter if kb_id in self.kb_stats)
+        total_tokens = sum(self.kb_stats[kb_id][1] for kb_id in kb_filter if kb_id in self.kb_stats)
+        
+        document_frequencies = Counter()
+        for segment, dead in zip(self.segments, self.dead):
+            for kb_id in kb_filter:
+                frequencies = segment.document_frequencies.get(kb_id)
+                if not frequencies:
+                    continue
+                for term in terms:
+                    if term in frequencies:
+                        document_frequencies[term] += frequencies[term]
+            
+            # The segment still counts its tombstoned chunks
+            if dead:
+                for term in terms:
+                    if term in segment.postings:
+                        positions = segment.postings[term][0]
+                        removed = sum(
+                            1 for position in positions
+                            if position in dead and segment.kb_of_chunk[position] in kb_filter
+                        )
+                        document_frequencies[term] -= removed
+        
+        return total_chunks, total_tokens, {
+            term: frequency for term, frequency in document_frequencies.items() if frequency > 0
+        }
+    
+    def chunk_id(self, position: int):
+        """Return the id of the chunk at a position"""
+        segment, local_position = self._locate(position)
+        return segment.chunk_ids[local_position]
+    
+    def load_chunks(self, positions: list):
+        """Return SnapshotChunk records for chunk positions, preserving order"""
+        chunks = []
+        for position in positions:
+            segment, local_position = self._locate(position)
+            chunks.append(SnapshotChunk(
+                segment.chunk_ids[local_position], segment.document_ids[local_position],
+                segment.chunk_indexes[local_position], segment.contents[local_position]
+            ))
+        return chunks
+    
+    def _locate(self, position: int):
+        """Return the segment holding a position and the local position within it"""
+        i = bisect_right(self.starts, position) - 1
+        return self.segments[i], position - self.starts[i]
+    
+    def _by_segment(self, positions: list):
+        """Group positions into (segment, local positions) pairs"""
+        groups = {}
+        for position in positions:
+            i = bisect_right(self.starts, position) - 1
+            groups.setdefault(i, []).append(position - self.starts[i])
+        return [(self.segments[i], local_positions) for i, local_positions in groups.items()]
+
+
+def load_corpus_rows(kb_ids: list = None, document_ids: list = None):
+    """Load the chunk and posting rows of processed documents, by knowledge base or by document"""
+    if kb_ids is not None:
+        document_filter = Document.knowledge_base_id.in_(kb_ids)
+        posting_filter = TermPosting.knowledge_base_id.in_(kb_ids)
+    else:
+        document_filter = Document.id.in_(document_ids)
+        posting_filter = TermPosting.document_id.in_(document_ids)
+    
+    chunk_rows = db.session.query(
+        TextChunk.id,
+        TextChunk.document_id,
+        TextChunk.chunk_index,
+        TextChunk.content,
+        TextChunk.token_count,
+        Document.knowledge_base_id,
+        Document.original_filename,
+        Document.file_type,
+        Document.created_at
+    ).join(Document, Document.id == TextChunk.document_id).filter(
+        document_filter,
+        Document.processed == True
+    ).order_by(TextChunk.id).all()
+    
+    posting_rows = db.session.query(
+        TermPosting.chunk_id,
+        TermPosting.term,
+        TermPosting.term_frequency,
+        TermPosting.positions
+    ).filter(posting_filter).all()
+    
+    return chunk_rows, posting_rows
+
+
+def build_snapshot(bot_id: int, generation: int):
+    """Load a bot's corpus from the database into a new snapshot of full-size segments"""
+    knowledge_bases = KnowledgeBase.query.filter_by(bot_id=bot_id).all()
+    kb_ids = [kb.id for kb in knowledge_bases]
+    db_generations = {kb.id: kb.index_generation or 0 for kb in knowledge_bases}
+    
+    chunk_rows, posting_rows = load_corpus_rows(kb_ids=kb_ids) if kb_ids else ([], [])
+    
+    # Split into runs of at most MAX_SEGMENT_CHUNKS chunks
+    segment_of_chunk = {row[0]: i // MAX_SEGMENT_CHUNKS for i, row in enumerate(chunk_rows)}
+    segment_postings = [[] for _ in range(0, len(chunk_rows), MAX_SEGMENT_CHUNKS)]
+    for row in posting_rows:
+        segment = segment_of_chunk.get(row[0])
+        if segment is not None:
+            segment_postings[segment].append(row)
+    
+    segments = [
+        IndexSegment(start, chunk_rows[start:start + MAX_SEGMENT_CHUNKS], segment_postings[i])
+        for i, start in enumerate(range(0, len(chunk_rows), MAX_SEGMENT_CHUNKS))
+    ]
+    return CorpusSnapshot(bot_id, generation, db_generations, segments)
+
+
+class SnapshotRegistry:
+    """Per-bot corpus snapshots with generation counters, incremental segments and background merging"""
+    
+    def __init__(self):
+        self._snapshots = {}
+        self._generations = {}
+        self._building = set()
+        self._pulled = set()  # Bots whose snapshot was already pulled from the snapshot source
+        self._lock = threading.Lock()
+    
+    def generation(self, bot_id: int):
+        """Current corpus generation of a bot in this process"""
+        with self._lock:
+            return self._generations.get(bot_id, 0)
+    
+    def get(self, bot_id: int):
+        """Return the bot's snapshot if it is current, otherwise None (never touches the database)"""
+        with self._lock:
+            snapshot = self._snapshots.get(bot_id)
+            if snapshot is None or snapshot.generation != self._generations.get(bot_id, 0):
+                return None
+        
+        # Periodically confirm that no other instance changed the index
+        if time.monotonic() - snapshot.verified_at > RECHECK_SECONDS:
+            snapshot.verified_at = time.monotonic()
+            self._start(bot_id, self._verify)
+        return snapshot
+    
+    def open_stored(self, bot_id: int):
+        """Adopt the bot's stored index files as its snapshot if they are current, so a cold process skips the rebuild"""
+        if not index_store.has(bot_id):
+            return None
+        bot = Bot.query.get(bot_id)
+        if not bot or bot.search_backend != 'keyword':
+            return None
+        
+        generation = self.generation(bot_id)
+        snapshot = self._load_stored(bot_id, generation)
+        if snapshot is None:
+            return None
+        
+        with self._lock:
+            if generation != self._generations.get(bot_id, 0):
+                return None
+            current = self._snapshots.get(bot_id)
+            if current is not None and current.generation == generation:
+                return current
+            self._snapshots[bot_id] = snapshot
+        
+        # Stores any segment indexed while catching up
+        self._save(bot_id, snapshot)
+        return snapshot
+    
+    def warm_start(self):
+        """Pull the snapshots of keyword-search bots from the snapshot source in the background at boot"""
+        if not SNAPSHOT_SOURCE:
+            return
+        for bot_id, in db.session.query(Bot.id).filter(Bot.search_backend == 'keyword').all():
+            self.request_build(bot_id)
+    
+    def export(self, bot_id: int, fileobj):
+        """Write the bot's snapshot as a portable archive, building it first if needed"""
+        snapshot = self._current(bot_id)
+        if snapshot is None:
+            self._rebuild(bot_id)
+            snapshot = self._current(bot_id)
+        if snapshot is None:
+            raise ValueError('Only bots using the keyword search backend have a search snapshot')
+        return export_snapshot(snapshot, fileobj)
+    
+    def import_archive(self, fileobj, bot_id: int = None):
+        """Install a snapshot archive as the bot's index and adopt it, catching up with changes made since"""
+        metadata = import_snapshot(fileobj, bot_id)
+        bot_id = metadata['bot_id']
+        
+        # Knowledge base ids must refer to this bot, e.g. when importing into another database
+        kb_ids = {int(kb_id) for kb_id in metadata['db_generations']}
+        if not kb_ids <= set(self._stored_generations(bot_id)):
+            index_store.discard(bot_id)
+            raise ValueError(f'Snapshot covers knowledge bases that do not belong to bot {bot_id}')
+        
+        self._bump(bot_id, discard_stored=False)
+        snapshot = self.open_stored(bot_id)
+        if snapshot is None:
+            self.request_build(bot_id)
+        return {
+            'bot_id': bot_id,
+            'segments': len(metadata['segments']),
+            'chunks': snapshot.chunk_count if snapshot is not None else None,
+            'adopted': snapshot is not None
+        }
+    
+    def request_build(self, bot_id: int):
+        """Build the bot's snapshot in the background unless a build is already running"""
+        self._start(bot_id, self._rebuild)
+    
+    def invalidate(self, bot_id: int):
+        """Record a corpus change: bump the generation, drop cached and reusable answers and rebuild"""
+        if self._bump(bot_id):
+            self.request_build(bot_id)
+    
+    def add_document(self, bot_id: int, kb_id: int, document_id: int):
+        """Publish a newly processed document as a small segment instead of rebuilding the snapshot"""
+        snapshot = self._current(bot_id)
+        db_generations = self._advanced_generations(bot_id, snapshot, kb_id, 1)
+        if db_generations is None:
+            self.invalidate(bot_id)
+            return
+        
+        segment = IndexSegment(snapshot.next_position, *load_corpus_rows(document_ids=[document_id]))
+        self._publish(bot_id, snapshot.generation, lambda current: current.with_segment(segment, db_generations))
+    
+    def remove_document(self, bot_id: int, kb_id: int, document_id: int):
+        """Tombstone a deleted document instead of rebuilding the snapshot"""
+        snapshot = self._current(bot_id)
+        indexed = snapshot is not None and snapshot.contains_document(document_id)
+        db_generations = self._advanced_generations(bot_id, snapshot, kb_id, 1 if indexed else 0)
+        if db_generations is None:
+            self.invalidate(bot_id)
+            return
+        
+        self._publish(bot_id, snapshot.generation, lambda current: current.with_tombstone(document_id, db_generations))
+    
+    def _current(self, bot_id):
+        """Return the bot's snapshot if it is current, without scheduling a recheck"""
+        with self._lock:
+            snapshot = self._snapshots.get(bot_id)
+            if snapshot is None or snapshot.generation != self._generations.get(bot_id, 0):
+                return None
+            return snapshot
+    
+    def _advanced_generations(self, bot_id, snapshot, kb_id, delta):
+        """Return the stored index generations if only this change happened since the snapshot, else None"""
+        if snapshot is None or kb_id not in snapshot.db_generations:
+            return None
+        
+        expected = dict(snapshot.db_generations)
+        expected[kb_id] += delta
+        stored = self._stored_generations(bot_id)
+        
+        # Another instance (or a concurrent change) touched the index; only a full rebuild is safe
+        return stored if stored == expected else None
+    
+    def _stored_generations(self, bot_id):
+        """Return {kb id: index generation} of the bot's knowledge bases as stored in the database"""
+        rows = db.session.query(KnowledgeBase.id, KnowledgeBase.index_generation).filter_by(bot_id=bot_id).all()
+        return {kb_id: generation or 0 for kb_id, generation in rows}
+    
+    def _load_stored(self, bot_id, generation):
+        """Open the bot's stored index as a snapshot brought up to date with the database, else None"""
+        stored = index_store.load(bot_id)
+        if stored is None:
+            return None
+        
+        db_generations, segments, tombstones, next_position = stored
+        snapshot = CorpusSnapshot(bot_id, generation, db_generations, segments, tombstones, next_position)
+        current = self._stored_generations(bot_id)
+        if db_generations != current:
+            snapshot = self._catch_up(bot_id, snapshot, current)
+            if snapshot is None:
+                index_store.discard(bot_id)
+        return snapshot
+    
+    def _catch_up(self, bot_id, snapshot, db_generations):
+        """Index only the documents added and deleted since a stored snapshot, or None if anything else changed"""
+        if not set(snapshot.db_generations) <= set(db_generations):
+            return None
+        
+        rows = db.session.query(Document.id, Document.knowledge_base_id).filter(
+            Document.knowledge_base_id.in_(list(db_generations)),
+            Document.processed == True
+        ).all()
+        documents = dict(rows)
+        indexed = snapshot.live_documents()
+        added = [document_id for document_id in documents if document_id not in indexed]
+        removed = [document_id for document_id in indexed if document_id not in documents]
+        
+        # Processing or deleting a document advances its knowledge base's generation by one; a reindex does more
+        expected = {kb_id: snapshot.db_generations.get(kb_id, 0) for kb_id in db_generations}
+        for document_id in added:
+            expected[documents[document_id]] += 1
+        for document_id in removed:
+            expected[indexed[document_id]] += 1
+        if expected != db_generations:
+            return None
+        
+        segments = snapshot.segments
+        next_position = snapshot.next_position
+        if added:
+            segment = IndexSegment(next_position, *load_corpus_rows(document_ids=added))
+            segments = segments + [segment]
+            next_position += segment.size
+        
+        logger.info(f"Caught up stored snapshot of bot {bot_id}: {len(added)} documents added, {len(removed)} deleted")
+        return CorpusSnapshot(bot_id, snapshot.generation, db_generations, segments,
+                              snapshot.tombstones | set(removed), next_position)
+    
+    def _save(self, bot_id, snapshot):
+        """Write the snapshot to the index store so that later cold starts can open it"""
+        try:
+            index_store.save(bot_id, snapshot, lambda: self._current(bot_id) is snapshot)
+        except OSError as e:
+            logger.warning(f"Could not store the index of bot {bot_id}: {e}")
+    
+    def _publish(self, bot_id, generation, change):
+        """Apply a change to the bot's snapshot as a new generation, or invalidate if it moved on meanwhile"""
+        with self._lock:
+            snapshot = self._snapshots.get(bot_id)
+            published = snapshot is not None and snapshot.generation == generation == self._generations.get(bot_id, 0)
+            if published:
+                # Built under the lock so a concurrent merge cannot be lost; segments are shared, not copied
+                updated = change(snapshot)
+                updated.generation = self._generations[bot_id] = generation + 1
+                self._snapshots[bot_id] = updated
+        
+        if not published:
+            self.invalidate(bot_id)
+            return
+        
+        search_cache.invalidate_bot(bot_id)
+        question_index.invalidate_bot(bot_id)
+        self._save(bot_id, updated)
+        if updated.plan_merge() is not None:
+            self._start(bot_id, self._merge)
+    
+    def _bump(self, bot_id, discard_stored=True):
+        """Advance the bot's generation; returns whether a snapshot was dropped"""
+        with self._lock:
+            self._generations[bot_id] = self._generations.get(bot_id, 0) + 1
+            had_snapshot = self._snapshots.pop(bot_id, None) is not None
+        search_cache.invalidate_bot(bot_id)
+        question_index.invalidate_bot(bot_id)
+        if discard_stored:
+            index_store.discard(bot_id)
+        return had_snapshot
+    
+    def _start(self, bot_id, target):
+        """Run a snapshot task for a bot in a daemon thread with an app context"""
+        if not has_app_context():
+            return
+        
+        with self._lock:
+            if bot_id in self._building:
+                return
+            self._building.add(bot_id)
+        
+        app = current_app._get_current_object()
+        
+        def run():
+            try:
+                with app.app_context():
+                    target(bot_id)
+            except Exception as e:
+                logger.error(f"Snapshot task failed for bot {bot_id}: {e}")
+            finally:
+                with self._lock:
+                    self._building.discard(bot_id)
+        
+        threading.Thread(target=run, daemon=True).start()
+    
+    def _rebuild(self, bot_id):
+        """Open the stored index, or build a fresh snapshot and store it, for keyword-search bots"""
+        bot = Bot.query.get(bot_id)
+        if not bot or bot.search_backend != 'keyword':
+            return
+        
+        generation = self.generation(bot_id)
+        started = time.monotonic()
+        
+        # A new instance first pulls the snapshot another one exported
+        if not index_store.has(bot_id) and bot_id not in self._pulled:
+            self._pulled.add(bot_id)
+            pull_snapshot(bot_id)
+        
+        snapshot = self._load_stored(bot_id, generation)
+        stored = snapshot is not None
+        if not stored:
+            snapshot = build_snapshot(bot_id, generation)
+        
+        with self._lock:
+            # A newer change arrived during the build; it scheduled its own rebuild
+            if generation != self._generations.get(bot_id, 0):
+                return
+            self._snapshots[bot_id] = snapshot
+        
+        self._save(bot_id, snapshot)
+        logger.info(f"{'Opened' if stored else 'Built'} corpus snapshot for bot {bot_id}: {snapshot.chunk_count} chunks "
+                    f"in {len(snapshot.segments)} segments, {time.monotonic() - started:.2f}s")
+    
+    def _merge(self, bot_id):
+        """Compact segments by size tier until the merge policy is satisfied"""
+        while True:
+            snapshot = self._current(bot_id)
+            merging = snapshot.plan_merge() if snapshot is not None else None
+            if not merging:
+                return
+            
+            started = time.monotonic()
+            merged = merge_segments(merging, snapshot.tombstones)
+            
+            # Merges change no results, so they keep the generation; changes published meanwhile are kept
+            with self._lock:
+                current = self._snapshots.get(bot_id)
+                updated = current.with_merged(merging, merged) if current is not None else None
+                if updated is None:
+                    return
+                updated.generation = current.generation
+                self._snapshots[bot_id] = updated
+            
+            self._save(bot_id, updated)
+            logger.info(f"Merged {len(merging)} segments of bot {bot_id} into {merged.size} chunks "
+                        f"in {time.monotonic() - started:.2f}s ({len(updated.segments)} segments left)")
+    
+    def _verify(self, bot_id):
+        """Invalidate the snapshot if the stored index generations moved on"""
+        with self._lock:
+            snapshot = self._snapshots.get(bot_id)
+        if snapshot is None:
+            return
+        
+        if self._stored_generations(bot_id) != snapshot.db_generations:
+            self._bump(bot_id)
+            self._rebuild(bot_id)
+
+
+# Shared by every KnowledgeBaseService in the process
+corpus_snapshots = SnapshotRegistry()
@@ -3,6 +3,10 @@ import uuid
 import re
 from werkzeug.utils import secure_filename
 from src.models.bot import db, Document, TextChunk
+from src.services.search_index import SearchIndex
+from src.services.text_analysis import extract_keywords
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.suggestions import suggestion_index
 import PyPDF2
 import docx
 import markdown
@@ -14,6 +18,7 @@ class FileProcessor:
         self.allowed_extensions = {'txt', 'pdf', 'docx', 'md'}
         self.chunk_size = 1000  # Characters per chunk
         self.chunk_overlap = 200  # Overlap between chunks
+        self.search_index = SearchIndex()
     
     def is_allowed_file(self, filename):
         """Check if file extension is allowed"""
@@ -76,19 +81,31 @@ class FileProcessor:
             # Create text chunks
             chunks = self._create_chunks(text_content)
             
-            # Save chunks to database
+            # Save chunks to database, analysed once so searches never re-tokenise stored content
+            chunk_records = []
             for i, chunk_text in enumerate(chunks):
                 chunk = TextChunk(
                     content=chunk_text,
                     chunk_index=i,
+                    keywords=' '.join(extract_keywords(chunk_text)),
                     document_id=document.id
                 )
                 db.session.add(chunk)
+                chunk_records.append(chunk)
+            
+            # Flush to assign chunk ids, then write the inverted index postings
+            db.session.flush()
+            self.search_index.index_chunks(document, chunk_records)
             
             # Mark document as processed
             document.processed = True
             db.session.commit()
             
+            # Cached answers are dropped and the document joins the corpus snapshot as a new segment
+            corpus_snapshots.add_document(document.knowledge_base.bot_id, document.knowledge_base_id, document.id)
+            suggestion_index.refresh(document.knowledge_base_id)
+            self.search_index.refresh_vocabulary(document.knowledge_base_id)
+            
             return True
             
         except Exception as e:
@@ -227,10 +244,20 @@ class FileProcessor:
             if os.path.exists(document.file_path):
                 os.remove(document.file_path)
             
+            # Drop index postings in bulk before the chunk cascade runs
+            self.search_index.remove_document(document.id)
+            
             # Delete from database (chunks will be deleted due to cascade)
+            bot_id = document.knowledge_base.bot_id
+            kb_id = document.knowledge_base_id
             db.session.delete(document)
             db.session.commit()
             
+            # The corpus snapshot tombstones the document until a merge drops its chunks
+            corpus_snapshots.remove_document(bot_id, kb_id, document_id)
+            suggestion_index.refresh(kb_id)
+            self.search_index.refresh_vocabulary(kb_id)
+            
             return True
             
         except Exception as e:
@@ -0,0 +1,152 @@
+import logging
+from sqlalchemy import text, func, or_
+from src.models.bot import db, Document
+
+logger = logging.getLogger(__name__)
+
+# Trigram indexes only match queries of at least this many characters
+MIN_TRIGRAM_QUERY = 3
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS document_name_fts
+       USING fts5(original_filename, filename, content='document', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS document_name_fts_insert AFTER INSERT ON document BEGIN
+           INSERT INTO document_name_fts(rowid, original_filename, filename)
+           VALUES (new.id, new.original_filename, new.filename);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS document_name_fts_delete AFTER DELETE ON document BEGIN
+           INSERT INTO document_name_fts(document_name_fts, rowid, original_filename, filename)
+           VALUES ('delete', old.id, old.original_filename, old.filename);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS document_name_fts_update AFTER UPDATE OF original_filename, filename ON document BEGIN
+           INSERT INTO document_name_fts(document_name_fts, rowid, original_filename, filename)
+           VALUES ('delete', old.id, old.original_filename, old.filename);
+           INSERT INTO document_name_fts(rowid, original_filename, filename)
+           VALUES (new.id, new.original_filename, new.filename);
+       END""",
+]
+
+POSTGRES_SETUP = [
+    """CREATE EXTENSION IF NOT EXISTS pg_trgm""",
+    """CREATE INDEX IF NOT EXISTS ix_document_original_filename_trgm
+       ON document USING GIN (lower(original_filename) gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_document_filename_trgm ON document USING GIN (lower(filename) gin_trgm_ops)""",
+]
+
+# bm25() cannot be evaluated next to the window count, so the matches are ranked in a subquery
+SQLITE_SEARCH = text("""
+    SELECT id, count(*) OVER () AS total
+    FROM (
+        SELECT document.id, bm25(document_name_fts) AS rank, length(document.original_filename) AS name_length
+        FROM document_name_fts
+        JOIN document ON document.id = document_name_fts.rowid
+        WHERE document_name_fts MATCH :match
+          AND document.knowledge_base_id = :kb_id
+    )
+    ORDER BY rank, name_length, id
+    LIMIT :limit OFFSET :offset
+""")
+
+# LIKE on the lowercased names is answered from the trigram indexes; similarity ranks the matches
+POSTGRES_SEARCH = text("""
+    SELECT document.id, count(*) OVER () AS total
+    FROM document
+    WHERE document.knowledge_base_id = :kb_id
+      AND (lower(document.original_filename) LIKE :pattern OR lower(document.filename) LIKE :pattern)
+    ORDER BY greatest(similarity(lower(document.original_filename), :query),
+                      similarity(lower(document.filename), :query)) DESC,
+             document.id
+    LIMIT :limit OFFSET :offset
+""")
+
+# Dialects whose trigram structures were installed by this process
+_installed = set()
+
+
+def install_filename_search(engine):
+    """Create the trigram index over document names (safe to run on every start)"""
+    dialect = engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return False
+    
+    with engine.begin() as connection:
+        if dialect == 'sqlite':
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_name_fts'"
+            )).first()
+            for statement in SQLITE_SETUP:
+                connection.execute(text(statement))
+            # Index documents that were stored before the FTS table existed
+            if not exists:
+                connection.execute(text("INSERT INTO document_name_fts(document_name_fts) VALUES ('rebuild')"))
+        else:
+            for statement in POSTGRES_SETUP:
+                connection.execute(text(statement))
+    
+    _installed.add(dialect)
+    logger.info(f"Trigram filename search installed for {dialect}")
+    return True
+
+
+def _like_pattern(query: str):
+    """LIKE pattern matching the query anywhere, with its wildcards escaped"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class FilenameSearch:
+    """Ranked, paginated substring search over document names, served by a trigram index where installed"""
+    
+    def search(self, kb_id: int, query: str, page: int, per_page: int):
+        """Return (documents of the page, total matches) for names containing the query"""
+        query = query.strip().lower()
+        if not query:
+            return [], 0
+        
+        dialect = db.engine.dialect.name
+        if dialect not in _installed or len(query) < MIN_TRIGRAM_QUERY:
+            return self._search_like(kb_id, query, page, per_page)
+        
+        parameters = {'kb_id': kb_id, 'limit': per_page, 'offset': (page - 1) * per_page}
+        if dialect == 'sqlite':
+            # A quoted FTS5 trigram string matches as a case-insensitive substring
+            statement = SQLITE_SEARCH
+            parameters['match'] = '"{}"'.format(query.replace('"', '""'))
+        else:
+            statement = POSTGRES_SEARCH
+            parameters['pattern'] = _like_pattern(query)
+            parameters['query'] = query
+        rows = db.session.execute(statement, parameters).all()
+        
+        # Past the last page there are no rows to carry the total
+        if not rows:
+            return [], self._count_like(kb_id, query) if page > 1 else 0
+        return self._load([row[0] for row in rows]), rows[0][1]
+    
+    def _search_like(self, kb_id: int, query: str, page: int, per_page: int):
+        """Scan the knowledge base's documents (short queries, or no trigram index)"""
+        matches = self._like_query(kb_id, query)
+        total = matches.count()
+        documents = matches.order_by(func.length(Document.original_filename), Document.id).offset(
+            (page - 1) * per_page
+        ).limit(per_page).all()
+        return documents, total
+    
+    def _count_like(self, kb_id: int, query: str):
+        """Number of the knowledge base's documents whose names contain the query"""
+        return self._like_query(kb_id, query).count()
+    
+    def _like_query(self, kb_id: int, query: str):
+        pattern = _like_pattern(query)
+        return Document.query.filter(
+            Document.knowledge_base_id == kb_id,
+            or_(
+                func.lower(Document.original_filename).like(pattern, escape='\\'),
+                func.lower(Document.filename).like(pattern, escape='\\')
+            )
+        )
+    
+    def _load(self, document_ids: list):
+        """Load documents by id, preserving the ranking order"""
+        documents = {document.id: document for document in Document.query.filter(Document.id.in_(document_ids))}
+        return [documents[document_id] for document_id in document_ids if document_id in documents]
@@ -0,0 +1,106 @@
+import logging
+from sqlalchemy import text, bindparam
+from src.models.bot import db
+
+logger = logging.getLogger(__name__)
+
+# Databases whose own full-text engine can serve chunk search
+SUPPORTED_DIALECTS = ('sqlite', 'postgresql')
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS text_chunk_fts
+       USING fts5(content, content='text_chunk', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS text_chunk_fts_insert AFTER INSERT ON text_chunk BEGIN
+           INSERT INTO text_chunk_fts(rowid, content) VALUES (new.id, new.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS text_chunk_fts_delete AFTER DELETE ON text_chunk BEGIN
+           INSERT INTO text_chunk_fts(text_chunk_fts, rowid, content) VALUES ('delete', old.id, old.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS text_chunk_fts_update AFTER UPDATE OF content ON text_chunk BEGIN
+           INSERT INTO text_chunk_fts(text_chunk_fts, rowid, content) VALUES ('delete', old.id, old.content);
+           INSERT INTO text_chunk_fts(rowid, content) VALUES (new.id, new.content);
+       END""",
+]
+
+POSTGRES_SETUP = [
+    """ALTER TABLE text_chunk ADD COLUMN IF NOT EXISTS content_tsv tsvector
+       GENERATED ALWAYS AS (to_tsvector('english', content)) STORED""",
+    """CREATE INDEX IF NOT EXISTS ix_text_chunk_content_tsv ON text_chunk USING GIN (content_tsv)""",
+]
+
+SQLITE_SEARCH = text("""
+    SELECT text_chunk.id
+    FROM text_chunk_fts
+    JOIN text_chunk ON text_chunk.id = text_chunk_fts.rowid
+    JOIN document ON document.id = text_chunk.document_id
+    WHERE text_chunk_fts MATCH :match
+      AND document.knowledge_base_id IN :kb_ids
+      AND document.processed = :processed
+    ORDER BY bm25(text_chunk_fts)
+    LIMIT :limit
+""").bindparams(bindparam('kb_ids', expanding=True))
+
+POSTGRES_SEARCH = text("""
+    SELECT text_chunk.id
+    FROM text_chunk
+    JOIN document ON document.id = text_chunk.document_id,
+         to_tsquery('english', :match) AS query
+    WHERE text_chunk.content_tsv @@ query
+      AND document.knowledge_base_id IN :kb_ids
+      AND document.processed = :processed
+    ORDER BY ts_rank(text_chunk.content_tsv, query) DESC
+    LIMIT :limit
+""").bindparams(bindparam('kb_ids', expanding=True))
+
+
+def install_fulltext_search(engine):
+    """Create the database full-text structures for chunk search (safe to run on every start)"""
+    dialect = engine.dialect.name
+    if dialect not in SUPPORTED_DIALECTS:
+        return False
+    
+    with engine.begin() as connection:
+        if dialect == 'sqlite':
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'text_chunk_fts'"
+            )).first()
+            for statement in SQLITE_SETUP:
+                connection.execute(text(statement))
+            # Index chunks that were stored before the FTS table existed
+            if not exists:
+                connection.execute(text("INSERT INTO text_chunk_fts(text_chunk_fts) VALUES ('rebuild')"))
+        else:
+            for statement in POSTGRES_SETUP:
+                connection.execute(text(statement))
+    
+    logger.info(f"Full-text chunk search installed for {dialect}")
+    return True
+
+
+class FullTextSearchBackend:
+    """Search backend that pushes matching and top-k ranking down to the database"""
+    
+    def is_available(self):
+        """Check whether the configured database has a supported full-text engine"""
+        return db.engine.dialect.name in SUPPORTED_DIALECTS
+    
+    def search(self, kb_ids: list, query_words: list, max_results: int):
+        """Return the ids of the best matching chunks, ranked by the database"""
+        terms = sorted(set(query_words))
+        if not terms:
+            return []
+        
+        if db.engine.dialect.name == 'sqlite':
+            statement = SQLITE_SEARCH
+            match = ' OR '.join(f'"{term}"' for term in terms)
+        else:
+            statement = POSTGRES_SEARCH
+            match = ' | '.join(terms)
+        
+        rows = db.session.execute(statement, {
+            'match': match,
+            'kb_ids': list(kb_ids),
+            'processed': True,
+            'limit': max_results
+        }).all()
+        return [row[0] for row in rows]
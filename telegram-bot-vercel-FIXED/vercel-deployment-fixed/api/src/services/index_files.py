@@ -0,0 +1,557 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from src.services.index_segments import IndexSegment, new_segment_id
+from src.services.search_index import NgramIndex
+from src.services.spelling import SymSpellDictionary
+from src.services.text_analysis import ngrams
+
+logger = logging.getLogger(__name__)
+
+# Directory of per-bot index files that later cold starts open instead of rebuilding ('' disables)
+INDEX_DIR = os.environ.get('SEARCH_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'search-index'))
+
+# Layout version of segment files and manifests; files of another version are rebuilt
+FORMAT_VERSION = 2
+
+MAGIC = b'KBINDEX\0'
+
+# Magic, format version and length of the JSON section table that follows
+HEADER = struct.Struct('<8sII')
+
+# Sections start on this boundary so their typed views are aligned
+ALIGNMENT = 8
+
+
+def _aligned(offset: int):
+    """Round an offset up to the section alignment"""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _utf8(text: str):
+    """Encode text the way strings are stored and sorted in index files"""
+    return text.encode('utf-8')
+
+
+class PackedBytes:
+    """Sequence of byte strings stored as an offsets column and one blob"""
+    
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class PackedStrings(PackedBytes):
+    """UTF-8 strings stored as an offsets column and one blob; find() needs them sorted by their bytes"""
+    
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+    
+    def find(self, key: str):
+        """Binary search for a string; returns its index or -1"""
+        encoded = _utf8(key)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.blob[self.offsets[middle]:self.offsets[middle + 1]]) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and PackedBytes.__getitem__(self, low) == encoded:
+            return low
+        return -1
+    
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+
+class PackedKeywordPositions(PackedBytes):
+    """Encoded keyword positions of a posting list; empty entries are postings without positions"""
+    
+    def __getitem__(self, i):
+        return PackedBytes.__getitem__(self, i) or None
+
+
+class SortedIntegers:
+    """Sorted integer column with binary search"""
+    
+    def __init__(self, values):
+        self.values = values
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def __getitem__(self, i):
+        return self.values[i]
+    
+    def __iter__(self):
+        return iter(self.values)
+    
+    def find(self, key: int):
+        """Binary search for a value; returns its index or -1"""
+        i = bisect_left(self.values, key)
+        return i if i < len(self.values) and self.values[i] == key else -1
+
+
+class PackedLists:
+    """Integer lists stored as an offsets column and one values column, optionally resolved through a sequence"""
+    
+    def __init__(self, offsets, values, resolve=None):
+        self.offsets = offsets
+        self.values = values
+        self.resolve = resolve
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i):
+        values = self.values[self.offsets[i]:self.offsets[i + 1]]
+        return values if self.resolve is None else [self.resolve[value] for value in values]
+
+
+class SortedTable:
+    """Read-only mapping from sorted keys (anything with find()) to the values at the same index"""
+    
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def __iter__(self):
+        return iter(self.keys)
+    
+    def __contains__(self, key):
+        return self.keys.find(key) >= 0
+    
+    def __getitem__(self, key):
+        i = self.keys.find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.values[i]
+    
+    def get(self, key, default=None):
+        i = self.keys.find(key)
+        return self.values[i] if i >= 0 else default
+    
+    def items(self):
+        return ((self.keys[i], self.values[i]) for i in range(len(self.keys)))
+
+
+class TermFrequencies:
+    """Chunk frequencies of the terms in one knowledge base (or all of them), read from a term x kb matrix"""
+    
+    def __init__(self, terms, matrix, columns, column=None):
+        self.terms = terms
+        self.matrix = matrix
+        self.columns = columns
+        self.column = column
+    
+    def __getitem__(self, term):
+        term_id = self.terms.find(term)
+        if term_id < 0:
+            return 0
+        row = term_id * self.columns
+        if self.column is not None:
+            return self.matrix[row + self.column]
+        return sum(self.matrix[row:row + self.columns])
+    
+    def __contains__(self, term):
+        return self[term] > 0
+    
+    def get(self, term, default=None):
+        frequency = self[term]
+        return frequency if frequency > 0 else default
+
+
+class KnowledgeBaseVocabulary:
+    """Partial-term lookups in a segment-wide n-gram index, limited to the terms of one knowledge base"""
+    
+    def __init__(self, vocabulary_index, frequencies):
+        self.vocabulary_index = vocabulary_index
+        self.frequencies = frequencies
+    
+    def partial_matches(self, word: str):
+        """Terms of the knowledge base that contain the word or are contained in it"""
+        return {term for term in self.vocabulary_index.partial_matches(word) if term in self.frequencies}
+
+
+class _Postings:
+    """Posting lists by term id: (local positions, term frequencies, encoded keyword positions)"""
+    
+    def __init__(self, offsets, positions, frequencies, keyword_offsets, keyword_positions):
+        self.offsets = offsets
+        self.positions = positions
+        self.frequencies = frequencies
+        self.keyword_offsets = keyword_offsets
+        self.keyword_positions = keyword_positions
+    
+    def __getitem__(self, term_id):
+        low, high = self.offsets[term_id], self.offsets[term_id + 1]
+        return (
+            self.positions[low:high],
+            self.frequencies[low:high],
+            PackedKeywordPositions(self.keyword_offsets[low:high + 1], self.keyword_positions)
+        )
+
+
+def _pack_bytes(sections: dict, name: str, values):
+    """Add byte strings to the sections as an offsets column and a blob"""
+    offsets = array('q', [0])
+    blob = bytearray()
+    for value in values:
+        blob += value
+        offsets.append(len(blob))
+    sections[name + '_offsets'] = offsets
+    sections[name] = blob
+
+
+def _pack_lists(sections: dict, name: str, lists):
+    """Add integer lists to the sections as an offsets column and a values column"""
+    offsets = array('q', [0])
+    values = array('i')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    sections[name + '_offsets'] = offsets
+    sections[name] = values
+
+
+def write_segment(segment, path: str):
+    """Write an index segment as a file that MappedSegment opens in place (atomically replacing the path)"""
+    terms = sorted(segment.postings, key=_utf8)
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    kb_ids = sorted(segment.kb_stats)
+    documents = sorted(segment.document_positions)
+    
+    # Chunk metadata columns, addressed by local position
+    sections = {
+        'chunk_ids': array('q', segment.chunk_ids),
+        'document_ids': array('q', segment.document_ids),
+        'chunk_indexes': array('i', segment.chunk_indexes),
+        'kb_of_chunk': array('q', segment.kb_of_chunk),
+        'lengths': array('i', segment.lengths)
+    }
+    _pack_bytes(sections, 'contents', (_utf8(content) for content in segment.contents))
+    
+    # Term dictionary sorted by UTF-8 bytes, with each term's posting range and score bounds
+    _pack_bytes(sections, 'terms', (_utf8(term) for term in terms))
+    posting_offsets = array('q', [0])
+    positions = array('i')
+    frequencies = array('i')
+    max_frequencies = array('i')
+    min_lengths = array('i')
+    keyword_positions = []
+    for term in terms:
+        term_positions, term_frequencies, max_frequency, min_length = segment.posting_list(term)
+        positions.extend(term_positions)
+        frequencies.extend(term_frequencies)
+        keyword_positions.extend(segment.postings[term][2])
+        posting_offsets.append(len(positions))
+        max_frequencies.append(max_frequency)
+        min_lengths.append(min_length)
+    sections.update({
+        'posting_offsets': posting_offsets,
+        'positions': positions,
+        'frequencies': frequencies,
+        'max_frequencies': max_frequencies,
+        'min_lengths': min_lengths
+    })
+    _pack_bytes(sections, 'keyword_positions', (encoded or b'' for encoded in keyword_positions))
+    
+    # Chunk frequencies as a term x knowledge base matrix
+    sections['kb_frequencies'] = array('i', (
+        segment.document_frequencies[kb_id].get(term, 0) for term in terms for kb_id in kb_ids
+    ))
+    
+    # Documents: their chunk positions (for tombstones), filenames, and file types and upload days (for filters)
+    sections['documents'] = array('q', documents)
+    _pack_lists(sections, 'document_positions', (segment.document_positions[document_id] for document_id in documents))
+    _pack_bytes(sections, 'filenames', (_utf8(segment.filenames.get(document_id) or '') for document_id in documents))
+    _pack_bytes(sections, 'file_types', (_utf8(segment.file_types.get(document_id) or '') for document_id in documents))
+    sections['upload_days'] = array('i', (segment.upload_days.get(document_id, 0) for document_id in documents))
+    
+    # Vocabulary lookups by term id: character n-grams and spelling deletions
+    grams = {}
+    for term_id, term in enumerate(terms):
+        for gram in ngrams(term):
+            grams.setdefault(gram, []).append(term_id)
+    gram_keys = sorted(grams, key=_utf8)
+    _pack_bytes(sections, 'grams', (_utf8(gram) for gram in gram_keys))
+    _pack_lists(sections, 'gram_terms', (grams[gram] for gram in gram_keys))
+    
+    deletes = segment.spelling.deletes
+    deletion_keys = sorted(deletes, key=_utf8)
+    _pack_bytes(sections, 'deletions', (_utf8(deletion) for deletion in deletion_keys))
+    _pack_lists(sections, 'deletion_terms', ([term_ids[term] for term in deletes[deletion]] for deletion in deletion_keys))
+    
+    # Section table: offsets relative to the aligned end of the table itself
+    table = {}
+    offset = 0
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else 'B'
+        table[name] = [offset, typecode, len(data)]
+        offset = _aligned(offset + len(data) * (data.itemsize if isinstance(data, array) else 1))
+    meta = json.dumps({
+        'byteorder': sys.byteorder,
+        'start': segment.start,
+        'kb_ids': kb_ids,
+        'kb_stats': [segment.kb_stats[kb_id] for kb_id in kb_ids],
+        'sections': table
+    }).encode('utf-8')
+    data_start = _aligned(HEADER.size + len(meta))
+    
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)))
+            f.write(meta)
+            for name, data in sections.items():
+                f.seek(data_start + table[name][0])
+                f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class MappedSegment(IndexSegment):
+    """An index segment used in place from a memory-mapped file; pages are only read as queries touch them"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.segment_id = new_segment_id()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, meta_length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} index file')
+        meta = json.loads(self._map[HEADER.size:HEADER.size + meta_length])
+        if meta['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was written with {meta["byteorder"]}-endian numbers')
+        
+        # Typed views straight into the mapping; nothing is copied
+        data_start = _aligned(HEADER.size + meta_length)
+        view = memoryview(self._map)
+        sections = {}
+        for name, (offset, typecode, count) in meta['sections'].items():
+            start = data_start + offset
+            end = start + count * array(typecode).itemsize
+            if end > len(self._map):
+                raise ValueError(f'{path} is truncated')
+            sections[name] = view[start:end] if typecode == 'B' else view[start:end].cast(typecode)
+        
+        self.start = meta['start']
+        self.chunk_ids = sections['chunk_ids']
+        self.document_ids = sections['document_ids']
+        self.chunk_indexes = sections['chunk_indexes']
+        self.kb_of_chunk = sections['kb_of_chunk']
+        self.lengths = sections['lengths']
+        self.contents = PackedStrings(sections['contents_offsets'], sections['contents'])
+        
+        self.terms = PackedStrings(sections['terms_offsets'], sections['terms'])
+        self._posting_offsets = sections['posting_offsets']
+        self._max_frequencies = sections['max_frequencies']
+        self._min_lengths = sections['min_lengths']
+        self.postings = SortedTable(self.terms, _Postings(
+            sections['posting_offsets'], sections['positions'], sections['frequencies'],
+            sections['keyword_positions_offsets'], sections['keyword_positions']
+        ))
+        
+        kb_ids = meta['kb_ids']
+        self.kb_stats = {kb_id: list(stats) for kb_id, stats in zip(kb_ids, meta['kb_stats'])}
+        self.document_frequencies = {
+            kb_id: TermFrequencies(self.terms, sections['kb_frequencies'], len(kb_ids), column)
+            for column, kb_id in enumerate(kb_ids)
+        }
+        
+        documents = SortedIntegers(sections['documents'])
+        self.document_positions = SortedTable(documents, PackedLists(
+            sections['document_positions_offsets'], sections['document_positions']
+        ))
+        filenames = PackedStrings(sections['filenames_offsets'], sections['filenames'])
+        self.filenames = dict(zip(documents, filenames))
+        self.file_types = dict(zip(documents, PackedStrings(sections['file_types_offsets'], sections['file_types'])))
+        self.upload_days = dict(zip(documents, sections['upload_days']))
+        
+        vocabulary_index = NgramIndex(
+            self.terms,
+            postings=SortedTable(
+                PackedStrings(sections['grams_offsets'], sections['grams']),
+                PackedLists(sections['gram_terms_offsets'], sections['gram_terms'])
+            ),
+            vocabulary=self.terms
+        )
+        self.vocabulary_indexes = {
+            kb_id: KnowledgeBaseVocabulary(vocabulary_index, frequencies)
+            for kb_id, frequencies in self.document_frequencies.items()
+        }
+        self.spelling = SymSpellDictionary(
+            TermFrequencies(self.terms, sections['kb_frequencies'], len(kb_ids)),
+            deletes=SortedTable(
+                PackedStrings(sections['deletions_offsets'], sections['deletions']),
+                PackedLists(sections['deletion_terms_offsets'], sections['deletion_terms'], resolve=self.terms)
+            )
+        )
+    
+    def posting_list(self, term: str):
+        """Return (positions, term frequencies, max term frequency, min chunk length) or None"""
+        term_id = self.terms.find(term)
+        if term_id < 0:
+            return None
+        positions, frequencies, _ = self.postings.values[term_id]
+        return positions, frequencies, self._max_frequencies[term_id], self._min_lengths[term_id]
+    
+    def shard_payload(self):
+        """Search workers map the file themselves instead of receiving a copy"""
+        return self.path
+
+
+class IndexStore:
+    """Index files of each bot's snapshot: one file per segment and a manifest naming the live ones"""
+    
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        self._files = {}  # segment id -> file name, for segments already on disk
+        self._listed = {}  # bot id -> file names in its manifest
+        self._lock = threading.RLock()
+    
+    def has(self, bot_id: int):
+        """Check whether a manifest is stored for the bot"""
+        return bool(self.directory) and os.path.exists(self._manifest_path(bot_id))
+    
+    def load(self, bot_id: int):
+        """Open the stored segments of a bot: (db generations, segments, tombstones, next position), or None"""
+        if not self.has(bot_id):
+            return None
+        
+        try:
+            with open(self._manifest_path(bot_id)) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != FORMAT_VERSION:
+                return None
+            segments = [
+                MappedSegment(os.path.join(self._bot_directory(bot_id), name))
+                for name in manifest['segments']
+            ]
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.warning(f"Ignoring stored index of bot {bot_id}: {e}")
+            return None
+        
+        with self._lock:
+            for segment, name in zip(segments, manifest['segments']):
+                self._files[segment.segment_id] = name
+            self._listed[bot_id] = set(manifest['segments'])
+        
+        db_generations = {int(kb_id): generation for kb_id, generation in manifest['db_generations'].items()}
+        return db_generations, segments, frozenset(manifest['tombstones']), manifest['next_position']
+    
+    def save(self, bot_id: int, snapshot, is_current):
+        """Write the snapshot's new segments and, if it is still the bot's current snapshot, its manifest"""
+        if not self.directory:
+            return
+        
+        names = []
+        for segment in snapshot.segments:
+            with self._lock:
+                name = self._files.get(segment.segment_id)
+            if name is None:
+                name, path = self.new_segment_path(bot_id)
+                write_segment(segment, path)
+                with self._lock:
+                    self._files[segment.segment_id] = name
+            names.append(name)
+        
+        manifest = {
+            'format': FORMAT_VERSION,
+            'db_generations': snapshot.db_generations,
+            'segments': names,
+            'tombstones': sorted(snapshot.tombstones),
+            'next_position': snapshot.next_position
+        }
+        with self._lock:
+            # A newer snapshot was published meanwhile and writes its own manifest
+            if not is_current():
+                return
+            self.install(bot_id, manifest)
+    
+    def install(self, bot_id: int, manifest: dict):
+        """Make a manifest naming already written segment files the bot's stored index"""
+        with self._lock:
+            self._write_manifest(bot_id, manifest)
+            
+            # Segments dropped since the previous manifest never come back (merged away or replaced)
+            self._remove(bot_id, self._listed.get(bot_id, set()) - set(manifest['segments']))
+            self._listed[bot_id] = set(manifest['segments'])
+    
+    def new_segment_path(self, bot_id: int):
+        """Return (file name, path) for a new segment file of the bot"""
+        directory = self._bot_directory(bot_id)
+        os.makedirs(directory, exist_ok=True)
+        name = f'{uuid.uuid4().hex}.seg'
+        return name, os.path.join(directory, name)
+    
+    def discard(self, bot_id: int):
+        """Remove the bot's stored index, e.g. before a full rebuild"""
+        if not self.directory:
+            return
+        with self._lock:
+            if os.path.exists(self._manifest_path(bot_id)):
+                os.remove(self._manifest_path(bot_id))
+            self._remove(bot_id, self._listed.pop(bot_id, set()))
+    
+    def _remove(self, bot_id, names):
+        """Delete segment files; processes that mapped them keep their pages until they unmap"""
+        for segment_id, name in list(self._files.items()):
+            if name in names:
+                del self._files[segment_id]
+        for name in names:
+            path = os.path.join(self._bot_directory(bot_id), name)
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _write_manifest(self, bot_id, manifest):
+        """Replace the bot's manifest atomically"""
+        # A snapshot without segments (a new bot, or all documents deleted) has no segment file to create it
+        os.makedirs(self._bot_directory(bot_id), exist_ok=True)
+        path = self._manifest_path(bot_id)
+        # Instances sharing the directory write manifests concurrently, each through its own file
+        temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+    
+    def _bot_directory(self, bot_id):
+        return os.path.join(self.directory, f'bot-{bot_id}')
+    
+    def _manifest_path(self, bot_id):
+        return os.path.join(self._bot_directory(bot_id), 'manifest.json')
+
+
+# Shared by every KnowledgeBaseService in the process
+index_store = IndexStore()
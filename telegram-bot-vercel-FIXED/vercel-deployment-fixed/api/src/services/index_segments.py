@@ -0,0 +1,219 @@
+import itertools
+import math
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import date
+from src.services.search_filters import SegmentBitmaps, upload_day
+from src.services.search_index import NgramIndex
+from src.services.spelling import SymSpellDictionary
+from src.services.text_analysis import decode_positions
+
+# Adjacent segments of one size tier that are merged together
+MERGE_FACTOR = int(os.environ.get('INDEX_MERGE_FACTOR', 4))
+
+# Segments up to this many chunks form the lowest size tier
+MIN_SEGMENT_CHUNKS = 64
+
+# Largest segment built or merged, so big corpora stay split across search workers
+MAX_SEGMENT_CHUNKS = int(os.environ.get('INDEX_MAX_SEGMENT_CHUNKS', 50000))
+
+# Most segments a query fans out to; beyond this the smallest neighbours are merged regardless of tier
+MAX_SEGMENTS = 16
+
+# Segments with at least this share of tombstoned chunks are rewritten without them
+MAX_DELETED_RATIO = 0.3
+
+# Segment ids are unique within the process, so worker caches can keep segments across snapshots
+_segment_ids = itertools.count(1)
+
+
+def new_segment_id():
+    """Allocate a process-wide segment id"""
+    return next(_segment_ids)
+
+
+class IndexSegment:
+    """Immutable keyword index over a run of chunks, addressed by local position from a global start"""
+    
+    _bitmaps = None
+    
+    def __init__(self, start, chunk_rows, posting_rows):
+        self.segment_id = new_segment_id()
+        self.start = start
+        
+        # Chunks are addressed by their local position in these parallel lists
+        self.chunk_ids = []
+        self.document_ids = []
+        self.chunk_indexes = []
+        self.kb_of_chunk = []
+        self.lengths = []
+        self.contents = []
+        self.filenames = {}
+        self.file_types = {}
+        self.upload_days = {}  # document id -> upload day ordinal, the date bucket of search filters
+        self.document_positions = {}  # document id -> local positions, for tombstones
+        self.kb_stats = {}  # kb id -> [chunks, tokens]
+        positions = {}
+        for chunk_id, document_id, chunk_index, content, token_count, kb_id, filename, file_type, uploaded_at in chunk_rows:
+            position = positions[chunk_id] = len(self.chunk_ids)
+            self.chunk_ids.append(chunk_id)
+            self.document_ids.append(document_id)
+            self.chunk_indexes.append(chunk_index)
+            self.kb_of_chunk.append(kb_id)
+            self.lengths.append(token_count or 0)
+            self.contents.append(content)
+            self.filenames[document_id] = filename
+            self.file_types[document_id] = (file_type or '').lower()
+            self.upload_days[document_id] = upload_day(uploaded_at)
+            self.document_positions.setdefault(document_id, []).append(position)
+            stats = self.kb_stats.setdefault(kb_id, [0, 0])
+            stats[0] += 1
+            stats[1] += token_count or 0
+        
+        # Chunk frequencies per knowledge base
+        term_postings = {}
+        self.document_frequencies = {kb_id: Counter() for kb_id in self.kb_stats}
+        for chunk_id, term, term_frequency, encoded_positions in posting_rows:
+            position = positions.get(chunk_id)
+            if position is None:
+                continue
+            term_postings.setdefault(term, []).append((position, term_frequency, encoded_positions))
+            self.document_frequencies[self.kb_of_chunk[position]][term] += 1
+        
+        # term -> (local positions, term frequencies, encoded keyword offsets) sorted by position,
+        # plus (max tf, min length) for score bounds
+        self.postings = {}
+        self.term_bounds = {}
+        for term, rows in term_postings.items():
+            rows.sort(key=lambda row: row[0])
+            self.postings[term] = (
+                array('i', (row[0] for row in rows)),
+                array('i', (row[1] for row in rows)),
+                [row[2] for row in rows]
+            )
+            self.term_bounds[term] = (
+                max(row[1] for row in rows),
+                min(self.lengths[row[0]] for row in rows)
+            )
+        
+        self.vocabulary_indexes = {
+            kb_id: NgramIndex(frequencies)
+            for kb_id, frequencies in self.document_frequencies.items()
+        }
+        self.spelling = SymSpellDictionary(sum(self.document_frequencies.values(), Counter()))
+    
+    @property
+    def size(self):
+        """Number of chunks stored in the segment, tombstoned or not"""
+        return len(self.chunk_ids)
+    
+    def posting_list(self, term: str):
+        """Return (positions, term frequencies, max term frequency, min chunk length) or None"""
+        if term not in self.postings:
+            return None
+        positions, frequencies, _ = self.postings[term]
+        max_frequency, min_length = self.term_bounds[term]
+        return positions, frequencies, max_frequency, min_length
+    
+    def get_positions(self, chunk_positions: list, terms):
+        """Return {local position: {term: keyword positions}} for postings that recorded positions"""
+        return lookup_positions(self.postings, chunk_positions, terms)
+    
+    def filter_bitmaps(self):
+        """Bitmaps of local positions per knowledge base, file type and upload day, built on first use"""
+        if self._bitmaps is None:
+            self._bitmaps = SegmentBitmaps(self)
+        return self._bitmaps
+    
+    def positions_of(self, document_ids):
+        """Local positions of the chunks of the given documents"""
+        return frozenset(
+            position
+            for document_id in document_ids
+            for position in self.document_positions.get(document_id, ())
+        )
+    
+    def chunk_rows(self, skip_documents=frozenset()):
+        """Chunk rows in the shape the constructor takes, without the skipped documents"""
+        rows = []
+        for position in range(self.size):
+            document_id = self.document_ids[position]
+            if document_id in skip_documents:
+                continue
+            day = self.upload_days.get(document_id, 0)
+            rows.append((
+                self.chunk_ids[position], document_id, self.chunk_indexes[position], self.contents[position],
+                self.lengths[position], self.kb_of_chunk[position], self.filenames[document_id],
+                self.file_types.get(document_id, ''), date.fromordinal(day) if day else None
+            ))
+        return rows
+    
+    def posting_rows(self, skip_documents=frozenset()):
+        """Posting rows in the shape the constructor takes, without the skipped documents"""
+        return [
+            (self.chunk_ids[position], term, term_frequency, encoded)
+            for term, (positions, frequencies, encoded_positions) in self.postings.items()
+            for position, term_frequency, encoded in zip(positions, frequencies, encoded_positions)
+            if self.document_ids[position] not in skip_documents
+        ]
+    
+    def shard_payload(self):
+        """Return the picklable search data of the segment for a SearchShard"""
+        return self.start, self.lengths, self.kb_of_chunk, self.postings
+
+
+def lookup_positions(postings: dict, chunk_positions: list, terms):
+    """Decode keyword positions from position-sorted posting lists"""
+    found = {}
+    for term in terms:
+        if term not in postings:
+            continue
+        positions, _, encoded = postings[term]
+        for chunk_position in chunk_positions:
+            i = bisect_left(positions, chunk_position)
+            if i < len(positions) and positions[i] == chunk_position and encoded[i] is not None:
+                found.setdefault(chunk_position, {})[term] = decode_positions(encoded[i])
+    return found
+
+
+def merge_segments(segments: list, tombstones=frozenset()):
+    """Merge adjacent segments into one, dropping the chunks of tombstoned documents"""
+    chunk_rows = []
+    posting_rows = []
+    for segment in segments:
+        chunk_rows.extend(segment.chunk_rows(tombstones))
+        posting_rows.extend(segment.posting_rows(tombstones))
+    return IndexSegment(segments[0].start, chunk_rows, posting_rows)
+
+
+def size_tier(live_chunks: int):
+    """Size tier of a segment: 0 up to MIN_SEGMENT_CHUNKS, then one tier per MERGE_FACTOR times larger"""
+    if live_chunks <= MIN_SEGMENT_CHUNKS:
+        return 0
+    return int(math.log(live_chunks / MIN_SEGMENT_CHUNKS, MERGE_FACTOR)) + 1
+
+
+def plan_merge(sizes: list, deleted: list):
+    """Pick the run [i, j) of adjacent segments to merge next, given their sizes and tombstoned counts, or None"""
+    live = [size - dead for size, dead in zip(sizes, deleted)]
+    
+    # Rewrite segments that are mostly tombstones
+    for i, (size, dead) in enumerate(zip(sizes, deleted)):
+        if size and dead / size >= MAX_DELETED_RATIO:
+            return i, i + 1
+    
+    # Merge MERGE_FACTOR neighbours of the same tier, unless the result would be too large
+    tiers = [size_tier(chunks) for chunks in live]
+    for i in range(len(sizes) - MERGE_FACTOR + 1):
+        run = range(i, i + MERGE_FACTOR)
+        if len({tiers[j] for j in run}) == 1 and sum(live[j] for j in run) <= MAX_SEGMENT_CHUNKS:
+            return i, i + MERGE_FACTOR
+    
+    # Bound the query fan-out by merging the smallest pair of neighbours
+    if len(sizes) > MAX_SEGMENTS:
+        i = min(range(len(sizes) - 1), key=lambda j: live[j] + live[j + 1])
+        return i, i + 2
+    
+    return None
@@ -1,133 +1,662 @@
+import heapq
+import html
+import os
 import re
+import logging
+from collections import Counter
+from contextlib import nullcontext
 from src.models.bot import db, Bot, KnowledgeBase, Document, TextChunk
+from src.services.search_index import SearchIndex, PinnedVocabulary
+from src.services.text_analysis import extract_keywords, parse_phrases, phrase_matches, min_distance
+from src.services.bm25 import BM25Scorer
+from src.services.sparse_search import SparseSearchBackend
+from src.services.vector_search import VectorSearchBackend
+from src.services.fulltext_search import FullTextSearchBackend
+from src.services.filename_search import FilenameSearch
+from src.services.search_cache import search_cache
+from src.services.corpus_snapshot import CorpusSnapshot, corpus_snapshots
+from src.services.top_k import PostingCursor, max_score_top_k
+from src.services.sharded_search import sharded_search
+from src.services.snippets import collapse_neighbours, match_pattern, make_snippet
+from src.services.search_budget import CHECK_INTERVAL, SearchDeadline, search_metrics
+from src.services.search_filters import SearchFilter, filter_postings
+from src.services.search_profile import SearchProfile, active_profile, stage, count
 from sqlalchemy import or_, and_
 
+logger = logging.getLogger(__name__)
+
+# Retrieval backends a bot can be configured to use
+SEARCH_BACKENDS = ('keyword', 'sparse', 'vector', 'fulltext')
+
+# Set SEARCH_DYNAMIC_PRUNING=false to score every candidate chunk (for comparing results)
+DYNAMIC_PRUNING = os.environ.get('SEARCH_DYNAMIC_PRUNING', 'true').lower() == 'true'
+
+# Score bonus per adjacent pair of query words, scaled by their IDF and divided by their distance
+PROXIMITY_WEIGHT = 0.5
+
+# Top candidates re-ranked by proximity, per requested result
+PROXIMITY_DEPTH = 4
+
+# Most queries accepted by one batch search request
+BATCH_MAX_QUERIES = int(os.environ.get('SEARCH_BATCH_MAX_QUERIES', 10000))
+
+# Queries of a batch search scored and hydrated together before their results are streamed
+BATCH_BLOCK_SIZE = 64
+
+# Chunks fetched per reply result, so that merging neighbouring chunks still leaves enough distinct results
+COLLAPSE_OVERFETCH = 2
+
+# Document name search: results per page by default, and at most
+DOCUMENT_SEARCH_PAGE_SIZE = 20
+DOCUMENT_SEARCH_MAX_PAGE_SIZE = 100
+
+
 class KnowledgeBaseService:
     def __init__(self):
         self.max_results = 5
         self.min_score_threshold = 0.1
+        self.dynamic_pruning = DYNAMIC_PRUNING
+        self.sharded_search = sharded_search
+        self.search_index = SearchIndex()
+        self.scorer = BM25Scorer()
+        self.sparse_backend = SparseSearchBackend(self.search_index, self.scorer)
+        self.vector_backend = VectorSearchBackend(self.search_index)
+        self.fulltext_backend = FullTextSearchBackend()
+        self.filename_search = FilenameSearch()
     
-    def search_knowledge_base(self, bot_id: int, query: str, max_results: int = None):
-        """Search the knowledge base for relevant information"""
+    def search_knowledge_base(self, bot_id: int, query: str, max_results: int = None, time_budget: float = None,
+                              deadline: SearchDeadline = None, profile: SearchProfile = None,
+                              search_filter: SearchFilter = None):
+        """Search the knowledge base for relevant information, within an optional time budget in seconds"""
         if max_results is None:
             max_results = self.max_results
         
-        # Get all knowledge bases for the bot
-        knowledge_bases = KnowledgeBase.query.filter_by(bot_id=bot_id).all()
-        if not knowledge_bases:
-            return None
+        # Callers pass their own deadline to learn whether the results were partial
+        if deadline is None:
+            deadline = SearchDeadline(time_budget)
+        
+        # A profile collects stage timings, SQL counts and score breakdowns of this search
+        with profile or nullcontext():
+            response = self._search_knowledge_base(bot_id, query, max_results, deadline, search_filter)
+        
+        search_metrics.record(deadline.elapsed(), deadline.partial)
+        if deadline.partial:
+            budget = deadline.expires_at - deadline.started
+            logger.warning(f"Search for bot {bot_id} exceeded its {budget * 1000:.0f}ms budget; "
+                           f"returned partial results after {deadline.elapsed() * 1000:.0f}ms")
+        return response
+    
+    def _search_knowledge_base(self, bot_id: int, query: str, max_results: int, deadline, search_filter=None):
+        """Search a bot's knowledge bases, using the result cache and corpus snapshot when possible"""
+        # Repeated questions are answered from the cache until the corpus changes; profiled searches do the work
+        scope = search_filter.cache_key() if search_filter is not None else None
+        if active_profile() is None:
+            found, cached_response = search_cache.get(bot_id, query, max_results, scope)
+            if found:
+                return cached_response
+        cache_version = search_cache.version(bot_id)
+        
+        # A current in-memory snapshot (or one opened from stored index files) answers keyword searches
+        snapshot = corpus_snapshots.get(bot_id) or corpus_snapshots.open_stored(bot_id)
+        if snapshot is not None:
+            kb_ids = search_filter.narrow(snapshot.kb_ids) if search_filter is not None else snapshot.kb_ids
+            if not kb_ids:
+                return None
+            matched_terms = set()
+            relevant_chunks = self._search_chunks(kb_ids, query, max_results * COLLAPSE_OVERFETCH, source=snapshot,
+                                                  deadline=deadline, search_filter=search_filter,
+                                                  matched_terms=matched_terms)
+            relevant_chunks = self._collapse_neighbours(relevant_chunks, max_results)
+            with stage('format'):
+                response = self._format_response(
+                    relevant_chunks, query, snapshot.filenames, matched_terms
+                ) if relevant_chunks else None
+            if not deadline.partial:
+                search_cache.set(bot_id, query, max_results, response, version=cache_version, scope=scope)
+            return response
+        
+        with stage('load_bot'):
+            bot = Bot.query.get(bot_id)
+            if not bot:
+                return None
+            
+            # Get all knowledge bases for the bot
+            knowledge_bases = KnowledgeBase.query.filter_by(bot_id=bot_id).all()
+            if not knowledge_bases:
+                return None
         
         kb_ids = [kb.id for kb in knowledge_bases]
+        if search_filter is not None:
+            kb_ids = search_filter.narrow(kb_ids)
+            if not kb_ids:
+                return None
         
-        # Search for relevant text chunks
-        relevant_chunks = self._search_chunks(kb_ids, query, max_results)
+        # Search for relevant text chunks, collecting the (corrected) terms they were matched on
+        matched_terms = set()
+        relevant_chunks = self.search_chunks(kb_ids, query, max_results * COLLAPSE_OVERFETCH, bot.search_backend,
+                                             deadline, search_filter, matched_terms)
+        relevant_chunks = self._collapse_neighbours(relevant_chunks, max_results)
+        if bot.search_backend == 'keyword':
+            corpus_snapshots.request_build(bot_id)
         
-        if not relevant_chunks:
+        # Format the response; partial results are not cached
+        with stage('format'):
+            response = self._format_response(relevant_chunks, query, terms=matched_terms) if relevant_chunks else None
+        if not deadline.partial:
+            search_cache.set(bot_id, query, max_results, response, version=cache_version, scope=scope)
+        return response
+    
+    def _collapse_neighbours(self, chunks: list, max_results: int):
+        """Merge overlapping neighbouring chunks of a document into one span, so each reply result is distinct"""
+        with stage('collapse'):
+            return collapse_neighbours(chunks)[:max_results]
+    
+    def search_chunks(self, kb_ids: list, query: str, max_results: int, backend: str = 'keyword', deadline=None,
+                      search_filter: SearchFilter = None, matched_terms: set = None):
+        """Search for relevant text chunks with the selected backend; matched_terms collects the searched terms"""
+        if search_filter is not None:
+            kb_ids = search_filter.narrow(kb_ids)
+            if not kb_ids:
+                return []
+            
+            # Only the keyword index can filter by file type and upload date
+            if search_filter.restricts_documents():
+                backend = 'keyword'
+        
+        # The matrix, ANN and database backends run as single calls and ignore the deadline
+        if backend == 'sparse':
+            if self.sparse_backend.is_available():
+                with stage('query_plan'):
+                    query_plan, search_terms = self._build_query_plan(kb_ids, query)
+                if not query_plan:
+                    return []
+                if matched_terms is not None:
+                    matched_terms.update(search_terms)
+                
+                # As on the keyword path, phrases are checked before the cut and close query words boosted after it
+                phrases = parse_phrases(query)
+                depth = None if phrases else max_results * PROXIMITY_DEPTH
+                with stage('sparse_scoring'):
+                    ranked = self.sparse_backend.search_many(kb_ids, [query_plan], depth, self.min_score_threshold)[0]
+                if phrases:
+                    with stage('phrase_filter'):
+                        ranked = self._filter_ranked_phrases(kb_ids, ranked, phrases)
+                with stage('collection_stats'):
+                    total_chunks, total_tokens, document_frequencies = self.search_index.get_collection_stats(
+                        kb_ids, search_terms
+                    )
+                    stats = self.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
+                with stage('proximity'):
+                    ranked = self._rerank_by_proximity(self.search_index, ranked, query_plan, stats, max_results)
+                with stage('load_chunks'):
+                    chunks = self._load_chunks([chunk_id for chunk_id, _ in ranked])
+                self._explain_results(self.search_index, ranked, query_plan, stats)
+                return chunks
+            logger.warning("Sparse search backend requires numpy and scipy; using keyword search")
+        
+        if backend == 'vector':
+            if self.vector_backend.is_available():
+                with stage('vector_search'):
+                    chunk_ids = self.vector_backend.search(kb_ids, query, max_results)
+                with stage('load_chunks'):
+                    return self._load_chunks(chunk_ids)
+            logger.warning("Vector search backend requires numpy; using keyword search")
+        
+        if backend == 'fulltext':
+            if self.fulltext_backend.is_available():
+                try:
+                    query_words = self._extract_keywords(query.lower())
+                    with stage('fulltext_search'):
+                        chunk_ids = self.fulltext_backend.search(kb_ids, query_words, max_results)
+                    with stage('load_chunks'):
+                        return self._load_chunks(chunk_ids)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Full-text search failed, using keyword search: {e}")
+            else:
+                logger.warning("Full-text search backend requires SQLite or PostgreSQL; using keyword search")
+        
+        return self._search_chunks(kb_ids, query, max_results, deadline=deadline, search_filter=search_filter,
+                                   matched_terms=matched_terms)
+    
+    def search_batch(self, kb_ids: list, queries: list, max_results: int, backend: str = 'keyword',
+                     search_filter: SearchFilter = None):
+        """Search many queries over the same knowledge bases, yielding each query's chunks in order"""
+        if search_filter is not None:
+            kb_ids = search_filter.narrow(kb_ids)
+            if search_filter.restricts_documents():
+                backend = 'keyword'
+        if not kb_ids:
+            for _ in queries:
+                yield []
+            return
+        
+        for start in range(0, len(queries), BATCH_BLOCK_SIZE):
+            ranked_ids = self._rank_batch(kb_ids, queries[start:start + BATCH_BLOCK_SIZE], max_results, backend,
+                                          search_filter)
+            
+            # One query hydrates the results of the whole block
+            chunks = {chunk.id: chunk for chunk in self._load_chunks(list({i for ids in ranked_ids for i in ids}))}
+            for ids in ranked_ids:
+                yield [chunks[chunk_id] for chunk_id in ids if chunk_id in chunks]
+    
+    def _rank_batch(self, kb_ids: list, queries: list, max_results: int, backend: str, search_filter=None):
+        """Return the ranked chunk ids of each query in a block"""
+        # The term matrix covers whole knowledge bases, so document filters take the single-query path
+        filtered = search_filter is not None and search_filter.restricts_documents()
+        if backend in ('keyword', 'sparse') and self.sparse_backend.is_available() and not filtered:
+            return self._rank_batch_sparse(kb_ids, queries, max_results, backend)
+        
+        # Without the term matrix each query is searched alone, from the bot's snapshot when it has one
+        source = self._batch_source(kb_ids) if backend == 'keyword' else None
+        ranked_ids = []
+        for query in queries:
+            if source is not None:
+                chunks = self._search_chunks(kb_ids, query, max_results, source=source, search_filter=search_filter)
+            else:
+                chunks = self.search_chunks(kb_ids, query, max_results, backend, search_filter=search_filter)
+            ranked_ids.append([chunk.id for chunk in chunks])
+        return ranked_ids
+    
+    def _rank_batch_sparse(self, kb_ids: list, queries: list, max_results: int, backend: str):
+        """Score a block of queries together against the cached sparse term matrix"""
+        vocabulary = PinnedVocabulary(self.search_index, kb_ids)
+        query_plans = [self._build_query_plan(kb_ids, query, vocabulary)[0] for query in queries]
+        
+        # Results match single searches: proximity re-ranking needs a deeper candidate list
+        depth = max_results * PROXIMITY_DEPTH
+        ranked_lists = self.sparse_backend.search_many(kb_ids, query_plans, depth, self.min_score_threshold)
+        
+        words = {word for query_plan in query_plans for word, _ in query_plan}
+        total_chunks, total_tokens, document_frequencies = self.search_index.get_collection_stats(kb_ids, words)
+        stats = self.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
+        
+        # Keyword positions of every candidate in the block are fetched in one query
+        candidates = {chunk_id for ranked in ranked_lists for chunk_id, _ in ranked}
+        positions = self.search_index.get_positions(list(candidates), words)
+        
+        ranked_ids = []
+        for query, query_plan, ranked in zip(queries, query_plans, ranked_lists):
+            # Phrase queries filter every candidate before the cut, so they take the single-query path
+            if parse_phrases(query):
+                ranked_ids.append([chunk.id for chunk in self.search_chunks(kb_ids, query, max_results, backend)])
+                continue
+            ranked = self._rerank_by_proximity(self.search_index, ranked, query_plan, stats, max_results, positions)
+            ranked_ids.append([chunk_id for chunk_id, _ in ranked])
+        return ranked_ids
+    
+    def _batch_source(self, kb_ids: list):
+        """Return the current snapshot covering the knowledge bases, if they belong to one bot that has one"""
+        bot_ids = {bot_id for bot_id, in db.session.query(KnowledgeBase.bot_id).filter(KnowledgeBase.id.in_(kb_ids))}
+        if len(bot_ids) != 1:
+            return None
+        snapshot = corpus_snapshots.get(bot_ids.pop())
+        if snapshot is None or not set(kb_ids) <= set(snapshot.kb_ids):
             return None
+        return snapshot
+    
+    def _build_query_plan(self, kb_ids: list, query: str, source=None):
+        """Pair each query keyword with its partial-match terms and collect all search terms"""
+        source = source or self.search_index
         
-        # Format the response
-        response = self._format_response(relevant_chunks, query)
-        return response
+        # Clean and prepare query, correcting misspelt keywords to indexed terms
+        query_words = self._correct_keywords(kb_ids, self._extract_keywords(query.lower()), source)
+        
+        # Each query word scores fully on an exact match, or half on a partial match
+        partial_terms = {}
+        for word in set(query_words):
+            partial_terms[word] = source.find_partial_terms(kb_ids, word) if len(word) > 3 else set()
+        query_plan = [(word, partial_terms[word]) for word in query_words]
+        
+        search_terms = set(query_words)
+        for terms in partial_terms.values():
+            search_terms |= terms
+        
+        return query_plan, search_terms
+    
+    def _correct_keywords(self, kb_ids: list, query_words: list, source):
+        """Replace keywords missing from the index with their closest indexed term"""
+        corrections = {}
+        for word in set(query_words):
+            correction = source.correct_term(kb_ids, word)
+            if correction and correction != word:
+                corrections[word] = correction
+        
+        if corrections:
+            logger.debug(f"Corrected query keywords: {corrections}")
+        return [corrections.get(word, word) for word in query_words]
     
-    def _search_chunks(self, kb_ids: list, query: str, max_results: int):
-        """Search for relevant text chunks using simple text matching"""
-        # Clean and prepare query
-        query_words = self._extract_keywords(query.lower())
+    def _load_chunks(self, chunk_ids: list):
+        """Load chunks by id, preserving the ranking order"""
+        return self.search_index.load_chunks(chunk_ids)
+    
+    def _search_chunks(self, kb_ids: list, query: str, max_results: int, source=None, deadline=None, search_filter=None,
+                       matched_terms: set = None):
+        """Search for relevant text chunks using the inverted index and BM25 ranking"""
+        # The source is the database-backed index or an in-memory corpus snapshot
+        source = source or self.search_index
+        with stage('query_plan'):
+            query_plan, search_terms = self._build_query_plan(kb_ids, query, source)
+        
+        # Corrected words and partial-match terms are what the results matched, so snippets highlight them
+        if matched_terms is not None:
+            matched_terms.update(search_terms)
+        count('query_words', len(query_plan))
+        count('search_terms', len(search_terms))
         
-        if not query_words:
+        if not query_plan:
             return []
         
-        # Get all documents from the knowledge bases
-        documents = Document.query.filter(
-            Document.knowledge_base_id.in_(kb_ids),
-            Document.processed == True
-        ).all()
+        # Quoted phrases must occur as consecutive keywords (stop words are skipped)
+        phrases = parse_phrases(query)
+        
+        # Snapshot posting lists are position sorted, so top-k can skip chunks that cannot qualify
+        if self.dynamic_pruning and isinstance(source, CorpusSnapshot):
+            return self._search_top_k(source, kb_ids, query_plan, search_terms, max_results, deadline, phrases,
+                                      search_filter)
         
-        if not documents:
+        # Only chunks with at least one matching posting (and passing the filter) can score above zero
+        with stage('postings'):
+            postings = source.find_postings(kb_ids, search_terms, search_filter)
+        if not postings:
             return []
         
-        doc_ids = [doc.id for doc in documents]
+        candidates = {}
+        for chunk_id, term, term_frequency, token_count in postings:
+            term_frequencies, _ = candidates.setdefault(chunk_id, ({}, token_count))
+            term_frequencies[term] = term_frequency
+        count('postings', len(postings))
+        count('candidates', len(candidates))
         
-        # Get all text chunks from these documents
-        chunks = TextChunk.query.filter(
-            TextChunk.document_id.in_(doc_ids)
-        ).all()
+        if phrases:
+            with stage('phrase_filter'):
+                candidates = self._filter_phrases(source, candidates, phrases)
         
-        # Score chunks based on keyword matching
-        scored_chunks = []
-        for chunk in chunks:
-            score = self._calculate_relevance_score(chunk.content.lower(), query_words)
-            if score > self.min_score_threshold:
-                scored_chunks.append((chunk, score))
+        with stage('collection_stats'):
+            total_chunks, total_tokens, document_frequencies = source.get_collection_stats(kb_ids, search_terms)
+            stats = self.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
         
-        # Sort by score and return top results
-        scored_chunks.sort(key=lambda x: x[1], reverse=True)
-        return [chunk for chunk, score in scored_chunks[:max_results]]
+        # Score candidate chunks from the stored term frequencies, those matching most terms first,
+        # so the best results found so far can be returned when the deadline passes
+        with stage('scoring'):
+            ordered = candidates.items()
+            if deadline is not None and deadline.expires_at is not None:
+                ordered = sorted(ordered, key=lambda item: -len(item[1][0]))
+            scored_chunks = []
+            for scored, (chunk_id, (term_frequencies, token_count)) in enumerate(ordered, 1):
+                if deadline is not None and scored % CHECK_INTERVAL == 0 and deadline.expired():
+                    break
+                score, coverage = self._calculate_relevance_score(term_frequencies, token_count, query_plan, stats)
+                if coverage > self.min_score_threshold:
+                    scored_chunks.append((chunk_id, score))
+        count('qualifying', len(scored_chunks))
+        
+        # Sort by score (ties in chunk order), boost close query words and load only the top results
+        with stage('sorting'):
+            scored_chunks.sort(key=lambda x: (-x[1], x[0]))
+        with stage('proximity'):
+            ranked = self._rerank_by_proximity(source, scored_chunks, query_plan, stats, max_results)
+        with stage('load_chunks'):
+            chunks = source.load_chunks([chunk_id for chunk_id, score in ranked])
+        self._explain_results(source, ranked, query_plan, stats)
+        return chunks
     
-    def _extract_keywords(self, text: str):
-        """Extract meaningful keywords from text"""
-        # Remove common stop words
-        stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-            'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
-            'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
-            'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their', 'what',
-            'when', 'where', 'why', 'how', 'who', 'which'
+    def _explain_results(self, source, ranked: list, query_plan: list, stats):
+        """Record each (key, score) result's score broken down by query word on the active profile"""
+        profile = active_profile()
+        if profile is None:
+            return
+        
+        with stage('explain'):
+            terms = {term for word, partial_terms in query_plan for term in {word} | partial_terms}
+            frequencies = source.get_term_frequencies([key for key, _ in ranked], terms)
+            for key, score in ranked:
+                term_frequencies, chunk_length = frequencies.get(key, ({}, 0))
+                matches = []
+                for word, partial_terms in query_plan:
+                    # Mirrors _calculate_relevance_score: an exact hit, else half the best partial match
+                    if word in term_frequencies:
+                        term, weight = word, 1.0
+                        term_score = self._term_score(word, term_frequencies[word], chunk_length, stats)
+                    else:
+                        partial_scores = [
+                            (self._term_score(term, term_frequencies[term], chunk_length, stats), term)
+                            for term in sorted(partial_terms) if term in term_frequencies
+                        ]
+                        if not partial_scores:
+                            continue
+                        term_score, term = max(partial_scores)
+                        weight = 0.5
+                    matches.append({
+                        'word': word,
+                        'term': term,
+                        'match': 'exact' if weight == 1.0 else 'partial',
+                        'term_frequency': term_frequencies[term],
+                        'idf': round(stats.idf.get(term, 0), 6),
+                        'score': round(weight * term_score, 6)
+                    })
+                
+                profile.results.append({
+                    'chunk_id': source.chunk_id(key) if isinstance(source, CorpusSnapshot) else key,
+                    'score': round(score, 6),
+                    'chunk_length': chunk_length,
+                    'terms': matches,
+                    'proximity': round(max(score - sum(match['score'] for match in matches), 0), 6)
+                })
+    
+    def _filter_phrases(self, source, candidates: dict, phrases: list):
+        """Keep the candidate chunks that contain every quoted phrase"""
+        phrase_terms = {term for phrase in phrases for term in phrase}
+        keys = [key for key, (term_frequencies, _) in candidates.items() if phrase_terms <= term_frequencies.keys()]
+        positions = source.get_positions(keys, phrase_terms)
+        return {
+            key: candidates[key]
+            for key in keys
+            if self._matches_phrases(positions.get(key, {}), phrase_terms, phrases)
         }
+    
+    def _filter_ranked_phrases(self, kb_ids: list, ranked: list, phrases: list):
+        """Keep the (chunk id, score) results that contain every quoted phrase, checked as on the keyword path"""
+        candidates = {}
+        phrase_terms = {term for phrase in phrases for term in phrase}
+        for chunk_id, term, term_frequency, token_count in self.search_index.find_postings(kb_ids, phrase_terms):
+            term_frequencies, _ = candidates.setdefault(chunk_id, ({}, token_count))
+            term_frequencies[term] = term_frequency
+        matching = self._filter_phrases(self.search_index, candidates, phrases)
+        return [(chunk_id, score) for chunk_id, score in ranked if chunk_id in matching]
+    
+    def _matches_phrases(self, term_positions: dict, phrase_terms: set, phrases: list):
+        """Check the phrases against a chunk's keyword positions"""
+        # Postings indexed before positions were recorded cannot be checked, so they pass
+        if not phrase_terms <= term_positions.keys():
+            return True
+        return all(phrase_matches(term_positions, phrase) for phrase in phrases)
+    
+    def _rerank_by_proximity(self, source, ranked: list, query_plan: list, stats, max_results: int, positions=None):
+        """Boost the top (key, score) results whose query words occur close together"""
+        words = list(dict.fromkeys(word for word, _ in query_plan))
+        if len(words) < 2:
+            return ranked[:max_results]
+        
+        depth = ranked[:max_results * PROXIMITY_DEPTH]
+        if positions is None:
+            positions = source.get_positions([key for key, _ in depth], words)
+        boosted = []
+        for key, score in depth:
+            term_positions = positions.get(key, {})
+            for first, second in zip(words, words[1:]):
+                if first in term_positions and second in term_positions:
+                    idf = min(stats.idf.get(first, 0), stats.idf.get(second, 0))
+                    score += PROXIMITY_WEIGHT * idf / max(min_distance(term_positions[first], term_positions[second]), 1)
+            boosted.append((key, score))
+        
+        boosted.sort(key=lambda x: (-x[1], x[0]))
+        return boosted[:max_results]
+    
+    def _search_top_k(self, snapshot, kb_ids: list, query_plan: list, search_terms: set, max_results: int,
+                      deadline=None, phrases=None, search_filter=None):
+        """Top-k search over snapshot posting lists with MaxScore dynamic pruning"""
+        with stage('collection_stats'):
+            total_chunks, total_tokens, document_frequencies = snapshot.get_collection_stats(kb_ids, search_terms)
+            stats = self.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
         
-        # Extract words (alphanumeric sequences)
-        words = re.findall(r'\b\w+\b', text.lower())
+        # Fetch enough results for the proximity re-ranking
+        depth = max_results * PROXIMITY_DEPTH if len(set(word for word, _ in query_plan)) > 1 else max_results
         
-        # Filter out stop words and short words
-        keywords = [word for word in words if len(word) > 2 and word not in stop_words]
+        # Filters and knowledge base subsets become bitmaps of each segment's allowed positions;
+        # segments without any are skipped
+        segment_views = snapshot.segment_views()
+        allowed = {}
+        if search_filter is not None or not set(kb_ids) >= set(snapshot.kb_ids):
+            with stage('filter_bitmaps'):
+                for segment, _ in segment_views:
+                    allowed[segment.segment_id] = segment.filter_bitmaps().allowed(kb_ids, search_filter)
+                segment_views = [
+                    (segment, dead) for segment, dead in segment_views
+                    if allowed[segment.segment_id] is None or allowed[segment.segment_id]
+                ]
+            count('allowed_chunks', sum(
+                segment.size if allowed[segment.segment_id] is None else len(allowed[segment.segment_id])
+                for segment, _ in segment_views
+            ))
         
-        return keywords
+        # The query fans out to every index segment; large ones are searched in parallel by worker processes
+        remote = self.sharded_search.select(segment_views)
+        ranked = []
+        if remote:
+            with stage('sharded_top_k'):
+                ranked = self.sharded_search.search(remote, kb_ids, query_plan, stats, depth, deadline, phrases, allowed)
+            if ranked is None:
+                remote, ranked = [], []
+        
+        with stage('top_k'):
+            searched = {segment.segment_id for segment, _ in remote}
+            for segment, dead in segment_views:
+                if segment.segment_id in searched:
+                    continue
+                segment_ranked = self._rank_top_k(segment, set(kb_ids), query_plan, stats, depth, deadline, phrases,
+                                                  dead, allowed.get(segment.segment_id))
+                ranked.extend((score, segment.start + position) for score, position in segment_ranked)
+            count('segments', len(segment_views))
+        
+        # Same order as a single-segment search: score, then chunk position
+        ranked = heapq.nsmallest(depth, ranked, key=lambda entry: (-entry[0], entry[1]))
+        
+        with stage('proximity'):
+            ranked = self._rerank_by_proximity(
+                snapshot, [(position, score) for score, position in ranked], query_plan, stats, max_results
+            )
+        with stage('load_chunks'):
+            chunks = snapshot.load_chunks([position for position, _ in ranked])
+        self._explain_results(snapshot, ranked, query_plan, stats)
+        return chunks
     
-    def _calculate_relevance_score(self, content: str, query_words: list):
-        """Calculate relevance score based on keyword matching"""
-        if not query_words:
-            return 0
+    def _rank_top_k(self, index, kb_filter: set, query_plan: list, stats, max_results: int, deadline=None, phrases=None,
+                    dead=frozenset(), allowed=None):
+        """Return the best (score, local position) pairs of an index segment or shard, skipping tombstoned chunks"""
+        # A term's weight bounds its share of a chunk score: full for exact words, half for partial matches
+        word_counts = Counter(word for word, _ in query_plan)
+        term_weights = Counter()
+        for word, partial_terms in dict(query_plan).items():
+            term_weights[word] += word_counts[word]
+            for term in partial_terms:
+                term_weights[term] += 0.5 * word_counts[word]
+        
+        # An allowed-positions bitmap cuts the posting lists down before the cursors walk them,
+        # and also tightens their score bounds
+        cursors = []
+        for term, weight in term_weights.items():
+            posting_list = index.posting_list(term)
+            if posting_list is not None and allowed is not None:
+                posting_list = filter_postings(allowed, posting_list[0], posting_list[1], index.lengths)
+            if posting_list is None:
+                continue
+            positions, frequencies, max_frequency, min_length = posting_list
+            upper_bound = weight * self._term_score(term, max_frequency, min_length, stats)
+            cursors.append(PostingCursor(term, positions, frequencies, upper_bound))
         
-        content_words = self._extract_keywords(content)
-        content_text = ' '.join(content_words)
+        def contribution(term, term_frequency, position):
+            return term_weights[term] * self._term_score(term, term_frequency, index.lengths[position], stats)
+        
+        phrase_terms = {term for phrase in phrases or () for term in phrase}
+        
+        def score(position, term_frequencies):
+            if (allowed is None and index.kb_of_chunk[position] not in kb_filter) or position in dead:
+                return None
+            if phrases:
+                if not phrase_terms <= term_frequencies.keys():
+                    return None
+                term_positions = index.get_positions([position], phrase_terms).get(position, {})
+                if not self._matches_phrases(term_positions, phrase_terms, phrases):
+                    return None
+            value, coverage = self._calculate_relevance_score(term_frequencies, index.lengths[position], query_plan, stats)
+            return value if coverage > self.min_score_threshold else None
+        
+        ranked, scored = max_score_top_k(cursors, max_results, contribution, score, deadline)
+        logger.debug(f"Top-{max_results} search scored {scored} of {len(index.lengths)} chunks")
+        count('postings', sum(len(cursor.positions) for cursor in cursors))
+        count('scored', scored)
+        return ranked
+    
+    def _extract_keywords(self, text: str):
+        """Extract meaningful keywords from text"""
+        return extract_keywords(text)
+    
+    def _calculate_relevance_score(self, term_frequencies: dict, chunk_length: int, query_plan: list, stats):
+        """Calculate the BM25 score and keyword coverage of a chunk"""
+        if not query_plan:
+            return 0, 0
         
         score = 0
-        total_words = len(query_words)
+        coverage = 0
         
-        for word in query_words:
+        for word, partial_terms in query_plan:
             # Exact word match
-            if word in content_words:
-                score += 1.0
-            # Partial match (word contains query word or vice versa)
-            elif any(word in content_word or content_word in word for content_word in content_words if len(word) > 3):
-                score += 0.5
+            if word in term_frequencies:
+                score += self._term_score(word, term_frequencies[word], chunk_length, stats)
+                coverage += 1.0
+                continue
+            
+            # Partial match (an indexed term contains the query word or vice versa)
+            partial_scores = [
+                self._term_score(term, term_frequencies[term], chunk_length, stats)
+                for term in partial_terms if term in term_frequencies
+            ]
+            if partial_scores:
+                score += 0.5 * max(partial_scores)
+                coverage += 0.5
         
-        # Normalize score
-        return score / total_words if total_words > 0 else 0
+        # Coverage keeps the original normalised hit ratio for thresholding
+        return score, coverage / len(query_plan)
     
-    def _format_response(self, chunks: list, query: str):
-        """Format the response from relevant chunks"""
+    def _term_score(self, term: str, term_frequency: int, chunk_length: int, stats):
+        """BM25 contribution of one term using precomputed statistics"""
+        return self.scorer.term_score(term_frequency, chunk_length, stats.idf.get(term, 0), stats.average_length)
+    
+    def _format_response(self, chunks: list, query: str, filenames: dict = None, terms: set = None):
+        """Format the response from relevant chunks, highlighting the searched terms (else the query's keywords)"""
         if not chunks:
             return None
         
-        # Combine relevant information
+        # Combine relevant information (Telegram HTML, so matches can be highlighted)
         response_parts = []
         
         response_parts.append("Based on the information in my knowledge base:\n")
         
+        pattern = match_pattern(terms or self._extract_keywords(query.lower()))
+        
         # Add relevant content from chunks
         for i, chunk in enumerate(chunks[:3], 1):  # Limit to top 3 chunks
-            # Get document info
-            document = Document.query.get(chunk.document_id)
+            # Chunks come with their document loaded, or filenames from the snapshot
+            if filenames is not None:
+                filename = filenames.get(chunk.document_id)
+            else:
+                filename = chunk.document.original_filename
             
-            # Clean and truncate content
-            content = chunk.content.strip()
-            if len(content) > 300:
-                content = content[:300] + "..."
+            # Show the part of the chunk around the matched keywords
+            content = make_snippet(chunk.content, pattern)
             
-            response_parts.append(f"📄 From {document.original_filename}:")
+            response_parts.append(f"📄 From {html.escape(filename or '')}:")
             response_parts.append(content)
             response_parts.append("")  # Empty line for spacing
         
@@ -161,22 +690,13 @@ class KnowledgeBaseService:
             'processing_complete': processed_documents == total_documents
         }
     
-    def search_documents(self, kb_id: int, query: str):
-        """Search for documents by name or content"""
+    def search_documents(self, kb_id: int, query: str, page: int = 1, per_page: int = DOCUMENT_SEARCH_PAGE_SIZE):
+        """Search documents by name: (documents of the page, best matches first; total matches), or None"""
         kb = KnowledgeBase.query.get(kb_id)
         if not kb:
-            return []
-        
-        query_lower = query.lower()
-        
-        # Search by filename
-        documents = Document.query.filter(
-            Document.knowledge_base_id == kb_id,
-            or_(
-                Document.original_filename.ilike(f'%{query}%'),
-                Document.filename.ilike(f'%{query}%')
-            )
-        ).all()
+            return None
         
-        return documents
+        page = max(1, page)
+        per_page = max(1, min(per_page, DOCUMENT_SEARCH_MAX_PAGE_SIZE))
+        return self.filename_search.search(kb_id, query, page, per_page)
 
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import func
+from src.models.bot import db, Bot, KnowledgeBase, Conversation
+from src.services.text_analysis import extract_keywords, parse_phrases
+
+# Recent questions remembered per bot
+MAX_QUESTIONS_PER_BOT = int(os.environ.get('QUESTION_INDEX_SIZE', 500))
+
+# Bots whose question indexes are kept in memory at once
+MAX_BOTS = 256
+
+# How often a bot's remembered answers are checked against corpus changes made by other instances
+RECHECK_SECONDS = int(os.environ.get('QUESTION_RECHECK_SECONDS', 30))
+
+# Questions whose signatures differ in at most this many bits are treated as the same question
+MAX_DISTANCE = 3
+
+# Signature bands; with more bands than MAX_DISTANCE, near duplicates always share one band exactly
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+
+def simhash(text: str):
+    """64-bit SimHash of a question's keywords, or None when it has none"""
+    features = Counter(extract_keywords(text))
+    if not features:
+        return None
+    
+    weights = [0] * 64
+    for feature, weight in features.items():
+        hashed = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            weights[bit] += weight if hashed >> bit & 1 else -weight
+    
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def phrase_key(text: str):
+    """Quoted phrases of a question; only questions with the same phrases share answers"""
+    return tuple(' '.join(phrase) for phrase in parse_phrases(text.lower()))
+
+
+class BotQuestionIndex:
+    """Bounded SimHash index of one bot's recent questions and the responses they got"""
+    
+    def __init__(self, max_questions=MAX_QUESTIONS_PER_BOT, stamp=None):
+        self.max_questions = max_questions
+        self.entries = OrderedDict()  # (signature, phrases) -> response, oldest first
+        self.bands = [{} for _ in range(BANDS)]  # band value -> (signature, phrases) keys
+        self.stamp = stamp  # Corpus state the answers were given for, see QuestionIndex._stamp()
+        self.checked_at = time.monotonic()
+    
+    def add(self, signature: int, response: str, phrases=()):
+        """Remember a response, evicting the oldest questions past the bound"""
+        key = (signature, phrases)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.entries[key] = response
+            return
+        
+        self.entries[key] = response
+        for band, table in zip(self._band_values(signature), self.bands):
+            table.setdefault(band, set()).add(key)
+        
+        while len(self.entries) > self.max_questions:
+            oldest, _ = self.entries.popitem(last=False)
+            for band, table in zip(self._band_values(oldest[0]), self.bands):
+                table[band].discard(oldest)
+                if not table[band]:
+                    del table[band]
+    
+    def find(self, signature: int, phrases=()):
+        """Return the response of the closest stored question with the same phrases within MAX_DISTANCE bits, or None"""
+        best = None
+        for band, table in zip(self._band_values(signature), self.bands):
+            for candidate in table.get(band, ()):
+                if candidate[1] != phrases:
+                    continue
+                distance = bin(signature ^ candidate[0]).count('1')
+                if distance <= MAX_DISTANCE and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+        return self.entries[best[1]] if best else None
+    
+    def _band_values(self, signature: int):
+        """Split a signature into its band values"""
+        mask = (1 << BAND_BITS) - 1
+        return [signature >> (band * BAND_BITS) & mask for band in range(BANDS)]
+
+
+class QuestionIndex:
+    """Per-bot near-duplicate question detection over the Conversation log"""
+    
+    def __init__(self, max_bots=MAX_BOTS, recheck_seconds=RECHECK_SECONDS):
+        self.max_bots = max_bots
+        self.recheck_seconds = recheck_seconds
+        self._bots = OrderedDict()
+        self._versions = {}  # Bumped on invalidation so in-flight searches cannot store stale answers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def lookup(self, bot_id: int, question: str):
+        """Return the stored response of a near-identical recent question, or None"""
+        signature = simhash(question)
+        if signature is None:
+            return None
+        
+        index = self._get_index(bot_id)
+        with self._lock:
+            response = index.find(signature, phrase_key(question))
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return response
+    
+    def version(self, bot_id: int):
+        """Return the bot's invalidation version; pass it to add() to guard against races"""
+        with self._lock:
+            return self._versions.get(bot_id, 0)
+    
+    def add(self, bot_id: int, question: str, response: str, version: int = None):
+        """Remember the response given to a question"""
+        signature = simhash(question)
+        if signature is None or not response:
+            return
+        
+        index = self._get_index(bot_id)
+        with self._lock:
+            # The corpus changed while this answer was being computed
+            if version is not None and version != self._versions.get(bot_id, 0):
+                return
+            index.add(signature, response, phrase_key(question))
+    
+    def invalidate_bot(self, bot_id: int):
+        """Forget a bot's questions (its corpus or settings changed)"""
+        with self._lock:
+            self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+            self._bots.pop(bot_id, None)
+    
+    def stats(self):
+        """Return lookup counters and the number of remembered questions"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'bots': len(self._bots),
+                'questions': sum(len(index.entries) for index in self._bots.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0
+            }
+    
+    def _get_index(self, bot_id: int):
+        """Return the bot's index, seeding it from conversations logged since the last corpus change"""
+        with self._lock:
+            index = self._bots.get(bot_id)
+            if index is not None and time.monotonic() - index.checked_at < self.recheck_seconds:
+                self._bots.move_to_end(bot_id)
+                return index
+        
+        # Other instances change the corpus too: its stored state is checked every recheck interval
+        stamp = self._stamp(bot_id)
+        with self._lock:
+            if index is not None and self._bots.get(bot_id) is index:
+                if index.stamp == stamp:
+                    index.checked_at = time.monotonic()
+                    self._bots.move_to_end(bot_id)
+                    return index
+                self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+                del self._bots[bot_id]
+            version = self._versions.get(bot_id, 0)
+        
+        index = BotQuestionIndex(stamp=stamp)
+        for message, response in reversed(self._recent_conversations(bot_id)):
+            signature = simhash(message)
+            if signature is not None:
+                index.add(signature, response, phrase_key(message))
+        
+        with self._lock:
+            if version != self._versions.get(bot_id, 0):
+                return BotQuestionIndex()
+            index = self._bots.setdefault(bot_id, index)
+            while len(self._bots) > self.max_bots:
+                self._bots.popitem(last=False)
+            return index
+    
+    def _stamp(self, bot_id: int):
+        """Index generations of the bot's knowledge bases and when its settings last changed"""
+        generations = db.session.query(KnowledgeBase.id, KnowledgeBase.index_generation).filter_by(bot_id=bot_id)
+        updated_at = db.session.query(Bot.updated_at).filter_by(id=bot_id).scalar()
+        return {kb_id: generation or 0 for kb_id, generation in generations}, updated_at
+    
+    def _recent_conversations(self, bot_id: int):
+        """Questions and answers logged after the bot's documents and settings last changed"""
+        bot = Bot.query.get(bot_id)
+        if not bot:
+            return []
+        
+        changed_at = db.session.query(func.max(KnowledgeBase.updated_at)).filter_by(bot_id=bot_id).scalar()
+        if bot.updated_at and (changed_at is None or bot.updated_at > changed_at):
+            changed_at = bot.updated_at
+        
+        # Commands, errors, fallbacks and partial answers are logged too but are not answers to reuse
+        query = Conversation.query.filter(
+            Conversation.bot_id == bot_id,
+            Conversation.reusable.is_(True),
+            Conversation.response.isnot(None)
+        )
+        if changed_at is not None:
+            query = query.filter(Conversation.created_at > changed_at)
+        
+        rows = query.order_by(Conversation.created_at.desc()).limit(MAX_QUESTIONS_PER_BOT).all()
+        return [(row.message, row.response) for row in rows]
+
+
+# Shared by every TelegramBotService in the process
+question_index = QuestionIndex()
@@ -0,0 +1,47 @@
+import logging
+from sqlalchemy import inspect, literal, text
+from src.models.bot import db
+
+logger = logging.getLogger(__name__)
+
+
+def _column_definition(column, dialect):
+    """ADD COLUMN clause for a model column, with its scalar default so existing rows get a value"""
+    definition = f'{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}'
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        rendered = literal(default, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        definition += f' DEFAULT {rendered}'
+    if not column.nullable:
+        definition += ' NOT NULL'
+    return definition
+
+
+def upgrade_schema(engine):
+    """Add model columns missing from existing tables (db.create_all() only creates missing tables)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            # New tables are created by db.create_all()
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable and (column.default is None or not column.default.is_scalar):
+                    logger.warning(f"Cannot add required column {table.name}.{column.name} without a default")
+                    continue
+                
+                table_name = engine.dialect.identifier_preparer.quote(table.name)
+                connection.execute(text(
+                    f'ALTER TABLE {table_name} ADD COLUMN {_column_definition(column, engine.dialect)}'
+                ))
+                added.append(f'{table.name}.{column.name}')
+    
+    if added:
+        logger.info(f"Added database columns: {', '.join(added)}")
+    return added
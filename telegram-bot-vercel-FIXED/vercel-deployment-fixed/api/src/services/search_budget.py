@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Default time budget of a chat search in milliseconds (0 disables the deadline)
+SEARCH_TIME_BUDGET_MS = int(os.environ.get('SEARCH_TIME_BUDGET_MS', 2000))
+
+# Scoring loops check the clock once per this many chunks
+CHECK_INTERVAL = 256
+
+# Recent search latencies kept for percentiles
+LATENCY_SAMPLES = 1000
+
+
+class SearchDeadline:
+    """Time budget of one search; records whether any stage stopped early"""
+    
+    def __init__(self, seconds: float = None):
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds if seconds else None
+        self.partial = False
+    
+    def expired(self):
+        """Check the clock, marking the search partial once the budget is spent"""
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.partial = True
+        return self.partial
+    
+    def remaining(self):
+        """Seconds left in the budget (0 once spent), or None without one"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def elapsed(self):
+        """Seconds since the search started"""
+        return time.monotonic() - self.started
+
+
+class SearchMetrics:
+    """Thread-safe counters and latency percentiles of knowledge base searches"""
+    
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self._latencies = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.partial_searches = 0
+    
+    def record(self, seconds: float, partial: bool):
+        """Record one finished search"""
+        with self._lock:
+            self.searches += 1
+            if partial:
+                self.partial_searches += 1
+            self._latencies.append(seconds)
+    
+    def stats(self):
+        """Return search counts and latency percentiles in milliseconds"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            searches = self.searches
+            partial_searches = self.partial_searches
+        
+        def percentile(p):
+            if not latencies:
+                return 0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+        
+        return {
+            'searches': searches,
+            'partial_searches': partial_searches,
+            'partial_rate': partial_searches / searches if searches else 0,
+            'latency_ms': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(latencies[-1] * 1000, 2) if latencies else 0
+            }
+        }
+
+
+# Shared by every KnowledgeBaseService in the process
+search_metrics = SearchMetrics()
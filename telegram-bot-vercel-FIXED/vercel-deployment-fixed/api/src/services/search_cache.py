@@ -0,0 +1,139 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from src.services.text_analysis import parse_phrases
+
+# Rough per-entry bookkeeping overhead used for the memory bound
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_query(query: str):
+    """Normalise a query so trivially different phrasings share a cache entry"""
+    # Quoted phrases change the results, so they stay part of the key
+    words = ' '.join(re.findall(r'\w+', query.lower()))
+    phrases = ''.join(' "{}"'.format(' '.join(phrase)) for phrase in parse_phrases(query.lower()))
+    return words + phrases
+
+
+class SearchCache:
+    """Thread-safe LRU + TTL cache of search responses, bounded by entries and bytes"""
+    
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._keys_by_bot = {}
+        self._versions = {}  # Bumped on invalidation so in-flight searches cannot store stale results
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, bot_id: int, query: str, max_results: int, scope=None):
+        """Return (found, value) for a cached search; the scope tells apart filtered searches"""
+        key = (bot_id, normalize_query(query), max_results, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+    
+    def version(self, bot_id: int):
+        """Return the bot's invalidation version; pass it to set() to guard against races"""
+        with self._lock:
+            return self._versions.get(bot_id, 0)
+    
+    def set(self, bot_id: int, query: str, max_results: int, value, version: int = None, scope=None):
+        """Store a search result, evicting least recently used entries past the bounds"""
+        key = (bot_id, normalize_query(query), max_results, scope)
+        size = ENTRY_OVERHEAD_BYTES + len(key[1]) + (sys.getsizeof(value) if value is not None else 0)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            # The corpus changed while this result was being computed
+            if version is not None and version != self._versions.get(bot_id, 0):
+                return
+            
+            if key in self._entries:
+                self._remove(key)
+            
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._keys_by_bot.setdefault(bot_id, set()).add(key)
+            self._bytes += size
+            
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def invalidate_bot(self, bot_id: int):
+        """Drop every cached search of a bot (its corpus or settings changed)"""
+        with self._lock:
+            self._versions[bot_id] = self._versions.get(bot_id, 0) + 1
+            keys = self._keys_by_bot.pop(bot_id, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        return len(keys)
+    
+    def clear(self):
+        """Drop all cached searches"""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_bot.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        """Return cache counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+    
+    def _remove(self, key):
+        """Remove one entry (the caller holds the lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[1]
+        bot_keys = self._keys_by_bot.get(key[0])
+        if bot_keys is not None:
+            bot_keys.discard(key)
+            if not bot_keys:
+                del self._keys_by_bot[key[0]]
+
+
+# Shared by every KnowledgeBaseService in the process
+search_cache = SearchCache(
+    max_entries=int(os.environ.get('SEARCH_CACHE_ENTRIES', 1024)),
+    max_bytes=int(os.environ.get('SEARCH_CACHE_BYTES', 8 * 1024 * 1024)),
+    ttl_seconds=int(os.environ.get('SEARCH_CACHE_TTL', 600))
+)
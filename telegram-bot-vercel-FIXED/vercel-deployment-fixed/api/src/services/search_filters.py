@@ -0,0 +1,143 @@
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from src.services.bitmaps import Bitmap
+
+
+def upload_day(value):
+    """Date bucket of an upload time: its day ordinal, or 0 when unknown"""
+    return value.toordinal() if value else 0
+
+
+def _parse_date(value, field):
+    """Parse an ISO date (a time part is ignored)"""
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).date()
+    except ValueError:
+        raise ValueError(f'{field} must be an ISO date such as 2024-03-31')
+
+
+class SearchFilter:
+    """Restricts a search to some knowledge bases, file types and a range of upload days"""
+    
+    def __init__(self, kb_ids=None, file_types=None, uploaded_after: date = None, uploaded_before: date = None):
+        self.kb_ids = frozenset(kb_ids) if kb_ids else None
+        self.file_types = frozenset(file_type.lower().lstrip('.') for file_type in file_types) if file_types else None
+        self.uploaded_after = uploaded_after  # Exclusive bounds
+        self.uploaded_before = uploaded_before
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Parse {"kb_ids", "file_types", "uploaded_after", "uploaded_before"}; None or {} means no filter"""
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError('filters must be an object')
+        unknown = set(data) - {'kb_ids', 'file_types', 'uploaded_after', 'uploaded_before'}
+        if unknown:
+            raise ValueError(f'Unknown filters: {", ".join(sorted(unknown))}')
+        
+        try:
+            kb_ids = [int(kb_id) for kb_id in data.get('kb_ids') or []]
+        except (TypeError, ValueError):
+            raise ValueError('kb_ids must be a list of knowledge base ids')
+        file_types = data.get('file_types') or []
+        if isinstance(file_types, str) or not all(isinstance(file_type, str) for file_type in file_types):
+            raise ValueError('file_types must be a list of file extensions')
+        
+        search_filter = cls(kb_ids, file_types, _parse_date(data.get('uploaded_after'), 'uploaded_after'),
+                            _parse_date(data.get('uploaded_before'), 'uploaded_before'))
+        return None if search_filter.is_empty() else search_filter
+    
+    @classmethod
+    def from_json(cls, text):
+        """Parse a filter stored as JSON text, e.g. Bot.answer_filter"""
+        return cls.from_dict(json.loads(text)) if text else None
+    
+    def to_dict(self):
+        return {
+            'kb_ids': sorted(self.kb_ids) if self.kb_ids else None,
+            'file_types': sorted(self.file_types) if self.file_types else None,
+            'uploaded_after': self.uploaded_after.isoformat() if self.uploaded_after else None,
+            'uploaded_before': self.uploaded_before.isoformat() if self.uploaded_before else None
+        }
+    
+    def cache_key(self):
+        """Hashable form of the filter for result caches"""
+        return (tuple(sorted(self.kb_ids or ())), tuple(sorted(self.file_types or ())),
+                self.uploaded_after, self.uploaded_before)
+    
+    def is_empty(self):
+        """Whether the filter allows everything"""
+        return not (self.kb_ids or self.file_types or self.uploaded_after or self.uploaded_before)
+    
+    def restricts_documents(self):
+        """Whether the filter looks beyond knowledge bases"""
+        return bool(self.file_types or self.uploaded_after or self.uploaded_before)
+    
+    def narrow(self, kb_ids: list):
+        """The searched knowledge bases that the filter allows"""
+        return [kb_id for kb_id in kb_ids if self.kb_ids is None or kb_id in self.kb_ids]
+    
+    def day_range(self):
+        """Allowed upload days as an inclusive (first, last) range of day ordinals"""
+        first = self.uploaded_after.toordinal() + 1 if self.uploaded_after else 1
+        last = self.uploaded_before.toordinal() - 1 if self.uploaded_before else date.max.toordinal()
+        return first, last
+
+
+class SegmentBitmaps:
+    """Bitmaps of an index segment's local chunk positions per knowledge base, file type and upload day"""
+    
+    def __init__(self, segment):
+        by_kb = {}
+        by_file_type = {}
+        by_day = {}
+        for document_id, positions in segment.document_positions.items():
+            positions = list(positions)
+            by_kb.setdefault(segment.kb_of_chunk[positions[0]], []).extend(positions)
+            by_file_type.setdefault(segment.file_types.get(document_id, ''), []).extend(positions)
+            by_day.setdefault(segment.upload_days.get(document_id, 0), []).extend(positions)
+        
+        self.by_kb = {kb_id: Bitmap(positions) for kb_id, positions in by_kb.items()}
+        self.by_file_type = {file_type: Bitmap(positions) for file_type, positions in by_file_type.items()}
+        self.days = sorted(by_day)
+        self.by_day = [Bitmap(by_day[day]) for day in self.days]
+    
+    def allowed(self, kb_ids, search_filter=None):
+        """Positions in the knowledge bases that pass the filter, or None when the whole segment qualifies"""
+        parts = []
+        if not set(kb_ids) >= self.by_kb.keys():
+            parts.append(Bitmap.union_all(self.by_kb[kb_id] for kb_id in kb_ids if kb_id in self.by_kb))
+        if search_filter is not None and search_filter.file_types is not None:
+            parts.append(Bitmap.union_all(
+                self.by_file_type[file_type] for file_type in search_filter.file_types if file_type in self.by_file_type
+            ))
+        if search_filter is not None and (search_filter.uploaded_after or search_filter.uploaded_before):
+            first, last = search_filter.day_range()
+            parts.append(Bitmap.union_all(self.by_day[bisect_left(self.days, first):bisect_right(self.days, last)]))
+        if not parts:
+            return None
+        
+        # Intersect the most selective bitmaps first
+        parts.sort(key=len)
+        allowed = parts[0]
+        for part in parts[1:]:
+            if not allowed:
+                break
+            allowed &= part
+        return allowed
+
+
+def filter_postings(allowed: Bitmap, positions, frequencies, lengths):
+    """Restrict a posting list to allowed positions: (positions, term frequencies, max frequency, min length) or None"""
+    selected = allowed.select(positions)
+    if not selected:
+        return None
+    kept_positions = array('i', (positions[i] for i in selected))
+    kept_frequencies = array('i', (frequencies[i] for i in selected))
+    return (kept_positions, kept_frequencies, max(kept_frequencies),
+            min(lengths[position] for position in kept_positions))
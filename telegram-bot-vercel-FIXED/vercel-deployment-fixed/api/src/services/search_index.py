@@ -0,0 +1,446 @@
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, time, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from src.models.bot import db, Bot, KnowledgeBase, Document, TextChunk, TermPosting, TermStatistic
+from src.services.text_analysis import extract_keywords, ngrams, encode_positions, decode_positions
+from src.services.vector_search import get_embedder, encode_vector
+from src.services.spelling import SymSpellDictionary
+
+# Longest term stored in the postings table (matches TermPosting.term)
+MAX_TERM_LENGTH = 100
+
+# Shortest vocabulary term that can take part in a partial match
+MIN_PARTIAL_LENGTH = 3
+
+# Knowledge bases whose vocabulary lookups are kept in memory at once (least recently used are dropped first)
+MAX_CACHED_VOCABULARIES = 256
+
+# Vocabulary n-gram indexes per knowledge base: kb id -> (index generation, index)
+_vocabulary_indexes = OrderedDict()
+_vocabulary_lock = threading.Lock()
+
+# Spelling dictionaries per knowledge base: kb id -> (index generation, dictionary)
+_spelling_dictionaries = OrderedDict()
+
+
+def _cached(cache: OrderedDict, kb_id: int):
+    """Return a knowledge base's cached (generation, lookup), marking it recently used"""
+    with _vocabulary_lock:
+        cached = cache.get(kb_id)
+        if cached is not None:
+            cache.move_to_end(kb_id)
+        return cached
+
+
+def _cache(cache: OrderedDict, kb_id: int, entry: tuple):
+    """Store a (generation, lookup) entry unless a newer one is cached, evicting past the bound"""
+    with _vocabulary_lock:
+        current = cache.get(kb_id)
+        if current is not None and current[0] > entry[0]:
+            return current
+        cache[kb_id] = entry
+        cache.move_to_end(kb_id)
+        while len(cache) > MAX_CACHED_VOCABULARIES:
+            cache.popitem(last=False)
+        return entry
+
+
+class NgramIndex:
+    """Character n-gram index over a vocabulary for substring lookups"""
+    
+    def __init__(self, terms, postings=None, vocabulary=None):
+        # Prebuilt tables (such as memory-mapped ones) are used as they are
+        if postings is not None:
+            self.terms = terms
+            self.vocabulary = vocabulary
+            self.postings = postings
+            return
+        
+        self.terms = list(terms)
+        self.vocabulary = set(self.terms)
+        self.postings = defaultdict(list)
+        for term_id, term in enumerate(self.terms):
+            for gram in ngrams(term):
+                self.postings[gram].append(term_id)
+    
+    def terms_containing(self, word: str):
+        """Vocabulary terms that contain the word as a substring"""
+        grams = ngrams(word)
+        if not grams:
+            return set()
+        
+        # Intersect the n-gram postings, rarest first, then verify the candidates
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set(lists[0])
+        for term_ids in lists[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(term_ids)
+        
+        return {self.terms[term_id] for term_id in candidates if word in self.terms[term_id]}
+    
+    def terms_within(self, word: str):
+        """Vocabulary terms that are substrings of the word"""
+        return {
+            word[start:end]
+            for start in range(len(word))
+            for end in range(start + MIN_PARTIAL_LENGTH, len(word) + 1)
+            if word[start:end] in self.vocabulary
+        }
+    
+    def partial_matches(self, word: str):
+        """Terms that contain the word or are contained in it, excluding the word itself"""
+        matches = self.terms_containing(word) | self.terms_within(word)
+        matches.discard(word)
+        return matches
+
+
+def find_partial_terms(vocabulary_indexes: list, word: str):
+    """Find terms of the vocabularies that contain the word or are contained in it"""
+    matches = set()
+    for vocabulary_index in vocabulary_indexes:
+        matches |= vocabulary_index.partial_matches(word)
+    return matches
+
+
+def closest_term(spelling_dictionaries: list, word: str):
+    """Return the word if a dictionary knows it, else the closest, then most frequent, match, else None"""
+    matches = [dictionary.lookup(word) for dictionary in spelling_dictionaries]
+    matches = [match for match in matches if match is not None]
+    if not matches:
+        return None
+    
+    # Ties are broken by the frequency across all the dictionaries, not within one of them
+    distance = min(match[0] for match in matches)
+    candidates = set().union(*(terms for match_distance, terms in matches if match_distance == distance))
+    return min(candidates, key=lambda term: (
+        -sum(dictionary.frequencies.get(term, 0) for dictionary in spelling_dictionaries),
+        term
+    ))
+
+
+class PinnedVocabulary:
+    """Vocabulary lookups of fixed knowledge bases, loaded once to plan many queries"""
+    
+    def __init__(self, search_index, kb_ids: list):
+        self.vocabulary_indexes = search_index.get_vocabulary_indexes(kb_ids)
+        self.spelling_dictionaries = search_index.get_spelling_dictionaries(kb_ids)
+    
+    def find_partial_terms(self, kb_ids: list, word: str):
+        """Find indexed terms that contain the word or are contained in it"""
+        return find_partial_terms(self.vocabulary_indexes, word)
+    
+    def correct_term(self, kb_ids: list, word: str):
+        """Return the word if it is indexed, else the closest indexed term within a few edits, else None"""
+        return closest_term(self.spelling_dictionaries, word)
+
+
+class SearchIndex:
+    """Inverted index (term -> postings) over the text chunks of each knowledge base"""
+    
+    def index_chunks(self, document, chunks):
+        """Write postings, embeddings and collection statistics for new chunks (the caller commits)"""
+        postings = []
+        chunk_frequencies = Counter()
+        total_tokens = 0
+        
+        # Only vector search reads embeddings; bots switching to it have theirs computed when its index is built
+        embedder = get_embedder() if self.searches_by_vector(document.knowledge_base_id) else None
+        for chunk in chunks:
+            keywords = self.chunk_keywords(chunk)
+            chunk.token_count = len(keywords)
+            if embedder is not None:
+                chunk.embedding = encode_vector(embedder.embed_keywords(chunk.content, keywords))
+            total_tokens += len(keywords)
+            
+            term_positions = defaultdict(list)
+            for position, term in enumerate(keywords):
+                term_positions[term].append(position)
+            
+            for term, positions in term_positions.items():
+                if len(term) > MAX_TERM_LENGTH:
+                    continue
+                chunk_frequencies[term] += 1
+                postings.append(TermPosting(
+                    term=term,
+                    term_frequency=len(positions),
+                    positions=encode_positions(positions),
+                    chunk_id=chunk.id,
+                    document_id=document.id,
+                    knowledge_base_id=document.knowledge_base_id
+                ))
+        
+        db.session.add_all(postings)
+        self._update_statistics(document.knowledge_base_id, chunk_frequencies, len(chunks), total_tokens)
+        return len(postings)
+    
+    def searches_by_vector(self, kb_id: int):
+        """Check whether the knowledge base's bot uses the vector search backend"""
+        backend = db.session.query(Bot.search_backend).join(KnowledgeBase).filter(KnowledgeBase.id == kb_id).scalar()
+        return backend == 'vector'
+    
+    def chunk_keywords(self, chunk):
+        """Return the analysed keywords of a chunk, analysing and storing them for legacy chunks"""
+        if chunk.keywords is None:
+            chunk.keywords = ' '.join(extract_keywords(chunk.content))
+        return chunk.keywords.split()
+    
+    def remove_document(self, document_id):
+        """Delete all postings of a document and its share of the statistics (the caller commits)"""
+        document = Document.query.get(document_id)
+        if not document:
+            return 0
+        
+        # Every posting row is one (term, chunk) pair, so counting rows gives chunk frequencies
+        rows = db.session.query(TermPosting.term, func.count(TermPosting.id)).filter(
+            TermPosting.document_id == document_id
+        ).group_by(TermPosting.term).all()
+        chunk_frequencies = Counter({term: -count for term, count in rows})
+        
+        chunk_count, token_total = db.session.query(
+            func.count(TextChunk.id), func.coalesce(func.sum(TextChunk.token_count), 0)
+        ).filter(TextChunk.document_id == document_id).one()
+        
+        if document.processed:
+            self._update_statistics(document.knowledge_base_id, chunk_frequencies, -chunk_count, -token_total)
+        
+        return TermPosting.query.filter_by(document_id=document_id).delete(synchronize_session=False)
+    
+    def reindex_knowledge_base(self, kb_id):
+        """Rebuild postings and statistics for every processed document in a knowledge base"""
+        kb = KnowledgeBase.query.get(kb_id)
+        documents = Document.query.filter_by(knowledge_base_id=kb_id, processed=True).all()
+        
+        try:
+            TermPosting.query.filter_by(knowledge_base_id=kb_id).delete(synchronize_session=False)
+            TermStatistic.query.filter_by(knowledge_base_id=kb_id).delete(synchronize_session=False)
+            kb.indexed_chunks = 0
+            kb.indexed_tokens = 0
+            
+            total_postings = 0
+            for document in documents:
+                chunks = TextChunk.query.filter_by(document_id=document.id).all()
+                total_postings += self.index_chunks(document, chunks)
+            
+            db.session.commit()
+            self.refresh_vocabulary(kb_id)
+            return {'documents': len(documents), 'postings': total_postings}
+            
+        except Exception as e:
+            db.session.rollback()
+            raise e
+    
+    def _update_statistics(self, kb_id, chunk_frequencies: Counter, chunk_delta, token_delta):
+        """Apply document-frequency and length deltas to the stored statistics"""
+        kb = KnowledgeBase.query.get(kb_id)
+        kb.indexed_chunks = max((kb.indexed_chunks or 0) + chunk_delta, 0)
+        kb.indexed_tokens = max((kb.indexed_tokens or 0) + token_delta, 0)
+        kb.index_generation = (kb.index_generation or 0) + 1
+        
+        if not chunk_frequencies:
+            return
+        
+        existing = {
+            statistic.term: statistic
+            for statistic in TermStatistic.query.filter(
+                TermStatistic.knowledge_base_id == kb_id,
+                TermStatistic.term.in_(list(chunk_frequencies))
+            ).all()
+        }
+        
+        for term, delta in chunk_frequencies.items():
+            statistic = existing.get(term)
+            if statistic is None:
+                if delta > 0:
+                    db.session.add(TermStatistic(term=term, document_frequency=delta, knowledge_base_id=kb_id))
+                continue
+            
+            statistic.document_frequency += delta
+            if statistic.document_frequency <= 0:
+                db.session.delete(statistic)
+    
+    def get_collection_stats(self, kb_ids: list, terms):
+        """Return (total chunks, total tokens, document frequencies) across knowledge bases"""
+        total_chunks, total_tokens = db.session.query(
+            func.coalesce(func.sum(KnowledgeBase.indexed_chunks), 0),
+            func.coalesce(func.sum(KnowledgeBase.indexed_tokens), 0)
+        ).filter(KnowledgeBase.id.in_(kb_ids)).one()
+        
+        document_frequencies = {}
+        if terms:
+            rows = db.session.query(TermStatistic.term, func.sum(TermStatistic.document_frequency)).filter(
+                TermStatistic.knowledge_base_id.in_(kb_ids),
+                TermStatistic.term.in_(list(terms))
+            ).group_by(TermStatistic.term).all()
+            document_frequencies = {term: int(frequency) for term, frequency in rows}
+        
+        return int(total_chunks), int(total_tokens), document_frequencies
+    
+    def get_generations(self, kb_ids: list):
+        """Return {knowledge base id: index generation} for the given knowledge bases"""
+        rows = db.session.query(KnowledgeBase.id, KnowledgeBase.index_generation).filter(
+            KnowledgeBase.id.in_(kb_ids)
+        ).all()
+        return {kb_id: generation or 0 for kb_id, generation in rows}
+    
+    def all_postings(self, kb_ids: list):
+        """Return every (chunk id, term, term frequency, chunk length) row of the knowledge bases"""
+        return db.session.query(
+            TermPosting.chunk_id,
+            TermPosting.term,
+            TermPosting.term_frequency,
+            TextChunk.token_count
+        ).join(TextChunk, TextChunk.id == TermPosting.chunk_id).filter(
+            TermPosting.knowledge_base_id.in_(kb_ids)
+        ).all()
+    
+    def all_document_frequencies(self, kb_ids: list):
+        """Return {term: chunk frequency} summed over the knowledge bases"""
+        rows = db.session.query(TermStatistic.term, func.sum(TermStatistic.document_frequency)).filter(
+            TermStatistic.knowledge_base_id.in_(kb_ids)
+        ).group_by(TermStatistic.term).all()
+        return {term: int(frequency) for term, frequency in rows}
+    
+    def find_postings(self, kb_ids: list, terms, search_filter=None):
+        """Return (chunk id, term, term frequency, chunk length) rows for the given terms"""
+        if not kb_ids or not terms:
+            return []
+        
+        query = db.session.query(
+            TermPosting.chunk_id,
+            TermPosting.term,
+            TermPosting.term_frequency,
+            TextChunk.token_count
+        ).join(TextChunk, TextChunk.id == TermPosting.chunk_id).filter(
+            TermPosting.knowledge_base_id.in_(kb_ids),
+            TermPosting.term.in_(list(terms))
+        )
+        if search_filter is not None and search_filter.restricts_documents():
+            query = query.join(Document, Document.id == TermPosting.document_id).filter(
+                *self._document_conditions(search_filter)
+            )
+        return query.all()
+    
+    def _document_conditions(self, search_filter):
+        """SQL conditions on Document for the file type and upload day parts of a search filter"""
+        conditions = []
+        if search_filter.file_types is not None:
+            conditions.append(Document.file_type.in_(sorted(search_filter.file_types)))
+        # Upload days are whole UTC days, both bounds exclusive
+        if search_filter.uploaded_after:
+            first_day = search_filter.uploaded_after + timedelta(days=1)
+            conditions.append(Document.created_at >= datetime.combine(first_day, time.min))
+        if search_filter.uploaded_before:
+            conditions.append(Document.created_at < datetime.combine(search_filter.uploaded_before, time.min))
+        return conditions
+    
+    def load_chunks(self, chunk_ids: list):
+        """Load chunks and their documents by id in one query, preserving the given order"""
+        if not chunk_ids:
+            return []
+        
+        chunks_by_id = {
+            chunk.id: chunk
+            for chunk in TextChunk.query.options(joinedload(TextChunk.document)).filter(
+                TextChunk.id.in_(chunk_ids)
+            ).all()
+        }
+        return [chunks_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in chunks_by_id]
+    
+    def get_term_frequencies(self, chunk_ids: list, terms):
+        """Return {chunk id: ({term: term frequency}, chunk length)} for the given terms"""
+        if not chunk_ids:
+            return {}
+        
+        found = {
+            chunk_id: ({}, token_count or 0)
+            for chunk_id, token_count in db.session.query(TextChunk.id, TextChunk.token_count).filter(
+                TextChunk.id.in_(list(chunk_ids))
+            )
+        }
+        if terms:
+            rows = db.session.query(TermPosting.chunk_id, TermPosting.term, TermPosting.term_frequency).filter(
+                TermPosting.chunk_id.in_(list(chunk_ids)),
+                TermPosting.term.in_(list(terms))
+            ).all()
+            for chunk_id, term, term_frequency in rows:
+                if chunk_id in found:
+                    found[chunk_id][0][term] = term_frequency
+        return found
+    
+    def get_positions(self, chunk_ids: list, terms):
+        """Return {chunk id: {term: keyword positions}} for postings that recorded positions"""
+        if not chunk_ids or not terms:
+            return {}
+        
+        rows = db.session.query(TermPosting.chunk_id, TermPosting.term, TermPosting.positions).filter(
+            TermPosting.chunk_id.in_(list(chunk_ids)),
+            TermPosting.term.in_(list(terms))
+        ).all()
+        
+        positions = {}
+        for chunk_id, term, encoded in rows:
+            if encoded is not None:
+                positions.setdefault(chunk_id, {})[term] = decode_positions(encoded)
+        return positions
+    
+    def find_partial_terms(self, kb_ids: list, word: str):
+        """Find indexed terms that contain the word or are contained in it"""
+        return find_partial_terms(self.get_vocabulary_indexes(kb_ids), word)
+    
+    def correct_term(self, kb_ids: list, word: str):
+        """Return the word if it is indexed, else the closest indexed term within a few edits, else None"""
+        # Prefer the closest, then most frequent, match across the knowledge bases
+        return closest_term(self.get_spelling_dictionaries(kb_ids), word)
+    
+    def get_spelling_dictionaries(self, kb_ids: list):
+        """Return SymSpell dictionaries over each knowledge base vocabulary, rebuilding stale ones"""
+        dictionaries = []
+        for kb_id, generation in self.get_generations(kb_ids).items():
+            # Normally built when the knowledge base was last indexed; rebuilt here after changes
+            # made by other instances, or once evicted
+            cached = _cached(_spelling_dictionaries, kb_id)
+            if cached is None or cached[0] != generation:
+                cached = self._build_spelling_dictionary(kb_id, generation)
+            dictionaries.append(cached[1])
+        
+        return dictionaries
+    
+    def get_vocabulary_indexes(self, kb_ids: list):
+        """Return n-gram indexes over each knowledge base vocabulary, rebuilding stale ones"""
+        indexes = []
+        for kb_id, generation in self.get_generations(kb_ids).items():
+            cached = _cached(_vocabulary_indexes, kb_id)
+            if cached is None or cached[0] != generation:
+                cached = self._build_vocabulary_index(kb_id, generation)
+            indexes.append(cached[1])
+        
+        return indexes
+    
+    def refresh_vocabulary(self, kb_id: int):
+        """Build a knowledge base's vocabulary lookups after its index changed (the change must be committed)"""
+        generation = self.get_generations([kb_id]).get(kb_id)
+        if generation is None:
+            self.forget_knowledge_base(kb_id)
+            return
+        # Searches then find them current instead of building them on the request path
+        self._build_spelling_dictionary(kb_id, generation)
+        self._build_vocabulary_index(kb_id, generation)
+    
+    def forget_knowledge_base(self, kb_id: int):
+        """Drop a deleted knowledge base's vocabulary lookups"""
+        with _vocabulary_lock:
+            _spelling_dictionaries.pop(kb_id, None)
+            _vocabulary_indexes.pop(kb_id, None)
+    
+    def _build_spelling_dictionary(self, kb_id: int, generation: int):
+        rows = db.session.query(TermStatistic.term, TermStatistic.document_frequency).filter_by(
+            knowledge_base_id=kb_id
+        ).all()
+        return _cache(_spelling_dictionaries, kb_id, (generation, SymSpellDictionary(dict(rows))))
+    
+    def _build_vocabulary_index(self, kb_id: int, generation: int):
+        rows = db.session.query(TermStatistic.term).filter_by(knowledge_base_id=kb_id).all()
+        return _cache(_vocabulary_indexes, kb_id, (generation, NgramIndex(row[0] for row in rows)))
@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The profile collecting measurements in each thread, if any
+_active = threading.local()
+
+
+class SearchProfile:
+    """Per-stage wall/CPU timings, SQL counts, candidate counts and score breakdowns of one search"""
+    
+    def __init__(self):
+        self.stages = {}  # name -> [calls, wall seconds, CPU seconds, SQL queries], in first-seen order
+        self.counts = {}
+        self.results = []
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self._started = None
+        self._cpu_started = None
+        self._wall = 0.0
+        self._cpu = 0.0
+        self._previous = None
+    
+    def __enter__(self):
+        """Collect measurements of searches run by this thread until exit"""
+        self._previous = getattr(_active, 'profile', None)
+        _active.profile = self
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._wall += time.perf_counter() - self._started
+        self._cpu += time.thread_time() - self._cpu_started
+        _active.profile = self._previous
+        return False
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage; repeated stages accumulate"""
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        queries = self.sql_queries
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += time.perf_counter() - wall
+            totals[2] += time.thread_time() - cpu
+            totals[3] += self.sql_queries - queries
+    
+    def count(self, name: str, value):
+        """Record a counter such as the number of candidate chunks"""
+        self.counts[name] = self.counts.get(name, 0) + value
+    
+    def to_dict(self):
+        """Return the measurements in milliseconds"""
+        return {
+            'wall_ms': round(self._wall * 1000, 3),
+            'cpu_ms': round(self._cpu * 1000, 3),
+            'sql_queries': self.sql_queries,
+            'sql_ms': round(self.sql_seconds * 1000, 3),
+            'stages': [
+                {
+                    'name': name,
+                    'calls': calls,
+                    'wall_ms': round(wall * 1000, 3),
+                    'cpu_ms': round(cpu * 1000, 3),
+                    'sql_queries': queries
+                }
+                for name, (calls, wall, cpu, queries) in self.stages.items()
+            ],
+            'counts': self.counts,
+            'results': self.results
+        }
+
+
+def active_profile():
+    """Return the profile collecting this thread's measurements, or None"""
+    return getattr(_active, 'profile', None)
+
+
+def stage(name: str):
+    """Time a stage of the active profile; does nothing when the search is not profiled"""
+    profile = active_profile()
+    return profile.stage(name) if profile is not None else nullcontext()
+
+
+def count(name: str, value):
+    """Record a counter on the active profile, if any"""
+    profile = active_profile()
+    if profile is not None:
+        profile.count(name, value)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if active_profile() is not None:
+        conn.info.setdefault('profile_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = active_profile()
+    started = conn.info.get('profile_query_started')
+    if profile is not None and started:
+        profile.sql_queries += 1
+        profile.sql_seconds += time.perf_counter() - started.pop()
@@ -0,0 +1,217 @@
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from src.services.index_files import MappedSegment
+from src.services.index_segments import lookup_positions
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for sharded snapshot search (0 searches in the request thread)
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', 0))
+
+# Smallest segment worth shipping to another process
+MIN_SHARD_CHUNKS = int(os.environ.get('SEARCH_MIN_SHARD_CHUNKS', 2000))
+
+# Segments each worker keeps in memory (least recently sent are evicted first)
+MAX_WORKER_SHARDS = 32
+
+# Imported once by the fork server, so workers start with the ranking code but no application or database
+WORKER_PRELOAD = ['src.services.knowledge_base_service']
+
+# Worker-side state: cached shards and the service used to rank them
+_shards = {}
+_service = None
+
+
+class SearchShard:
+    """The search data of one index segment, kept inside a worker process"""
+    
+    def __init__(self, start, lengths, kb_of_chunk, postings):
+        self.start = start
+        self.lengths = lengths
+        self.kb_of_chunk = kb_of_chunk
+        self.postings = postings  # term -> (local positions, term frequencies, encoded keyword offsets)
+        self.term_bounds = {
+            term: (max(frequencies), min(lengths[position] for position in positions))
+            for term, (positions, frequencies, _) in postings.items()
+        }
+    
+    def posting_list(self, term: str):
+        """Return (positions, term frequencies, max term frequency, min chunk length) or None"""
+        if term not in self.postings:
+            return None
+        positions, frequencies, _ = self.postings[term]
+        max_frequency, min_length = self.term_bounds[term]
+        return positions, frequencies, max_frequency, min_length
+    
+    def get_positions(self, chunk_positions: list, terms):
+        """Return {local chunk position: {term: keyword positions}}"""
+        return lookup_positions(self.postings, chunk_positions, terms)
+
+
+def search_shard(key, payload, kb_ids, query_plan, stats, max_results, deadline=None, phrases=None, dead=frozenset(),
+                 allowed=None):
+    """Worker entry point: rank one segment, or return None if it is not cached and no payload was sent"""
+    global _service
+    shard = _shards.get(key)
+    if shard is None:
+        if payload is None:
+            return None
+        # Segments stored as index files arrive as a path and are mapped, not copied
+        shard = MappedSegment(payload) if isinstance(payload, str) else SearchShard(*payload)
+        while len(_shards) >= MAX_WORKER_SHARDS:
+            _shards.pop(next(iter(_shards)))
+        _shards[key] = shard
+    
+    if _service is None:
+        from src.services.knowledge_base_service import KnowledgeBaseService
+        _service = KnowledgeBaseService()
+    
+    # The deadline is a copy; its partial flag travels back with the results
+    ranked = _service._rank_top_k(shard, set(kb_ids), query_plan, stats, max_results, deadline, phrases, dead, allowed)
+    partial = deadline is not None and deadline.partial
+    return [(score, position + shard.start) for score, position in ranked], partial
+
+
+class ShardedSearch:
+    """Coordinator spreading the large segments of a snapshot search across worker processes"""
+    
+    def __init__(self, workers=SEARCH_WORKERS, min_shard_chunks=MIN_SHARD_CHUNKS):
+        self.workers = workers
+        self.min_shard_chunks = min_shard_chunks
+        self._executors = []
+        self._loaded = []  # Shard keys each worker is known to hold, in worker eviction order
+        self._lock = threading.Lock()
+    
+    def select(self, segment_views: list):
+        """Return the (segment, tombstones) views worth searching in workers; empty means search in-process"""
+        if self.workers < 2:
+            return []
+        large = [view for view in segment_views if view[0].size >= self.min_shard_chunks]
+        return large if len(large) > 1 else []
+    
+    def search(self, segment_views: list, kb_ids: list, query_plan: list, stats, max_results: int,
+               deadline=None, phrases=None, allowed=None):
+        """Return the merged top (score, position) pairs of the segments, or None if the workers failed"""
+        # Filter bitmaps of allowed positions, by segment id, travel with each request
+        allowed = allowed or {}
+        try:
+            executors = self._get_executors()
+            
+            # Segments are immutable and stick to one worker each, so only that worker ever holds a copy
+            futures = []
+            for segment, dead in segment_views:
+                worker = segment.segment_id % len(executors)
+                with self._lock:
+                    loaded = segment.segment_id in self._loaded[worker]
+                payload = None if loaded else segment.shard_payload()
+                futures.append(executors[worker].submit(
+                    search_shard, segment.segment_id, payload, kb_ids, query_plan, stats, max_results,
+                    deadline, phrases, dead, allowed.get(segment.segment_id)
+                ))
+            
+            partials = []
+            abandoned = set()
+            for (segment, dead), future in zip(segment_views, futures):
+                worker = segment.segment_id % len(executors)
+                # Shards still running once the budget is spent are left out; the finished ones are merged
+                try:
+                    result = future.result(deadline.remaining() if deadline is not None else None)
+                    if result is None:
+                        # The worker evicted or lost the segment
+                        result = executors[worker].submit(
+                            search_shard, segment.segment_id, segment.shard_payload(), kb_ids, query_plan, stats,
+                            max_results, deadline, phrases, dead, allowed.get(segment.segment_id)
+                        ).result(deadline.remaining() if deadline is not None else None)
+                except FutureTimeoutError:
+                    if not future.cancel():
+                        abandoned.add(worker)
+                    deadline.partial = True
+                    logger.warning(f"Shard {segment.segment_id} missed the search deadline")
+                    continue
+                self._remember(worker, segment.segment_id)
+                ranked, partial = result
+                if partial:
+                    deadline.partial = True
+                partials.append(ranked)
+            
+            # Running shard searches cannot be cancelled: their workers are replaced rather than left busy
+            for worker in abandoned:
+                self._recycle(worker)
+                
+        except Exception as e:
+            logger.error(f"Sharded search failed, searching in-process: {e}")
+            self.shutdown()
+            return None
+        
+        # Same order as a single-process search: score, then chunk position
+        return heapq.nsmallest(
+            max_results,
+            (entry for ranked in partials for entry in ranked),
+            key=lambda entry: (-entry[0], entry[1])
+        )
+    
+    def _remember(self, worker, key):
+        """Mirror the worker's shard cache so payloads are only sent when needed"""
+        with self._lock:
+            loaded = self._loaded[worker]
+            if key in loaded:
+                return
+            while len(loaded) >= MAX_WORKER_SHARDS:
+                loaded.pop(next(iter(loaded)))
+            loaded[key] = True
+    
+    def _get_executors(self):
+        """Start one single-process executor per worker on first use"""
+        with self._lock:
+            if not self._executors:
+                self._executors = [_new_executor() for _ in range(self.workers)]
+                self._loaded = [{} for _ in range(self.workers)]
+            return self._executors
+    
+    def _recycle(self, worker: int):
+        """Replace a worker still running an abandoned shard search, so later searches do not queue behind it"""
+        with self._lock:
+            if worker >= len(self._executors):
+                return
+            executor = self._executors[worker]
+            self._executors[worker] = _new_executor()
+            self._loaded[worker] = {}
+        _terminate(executor)
+    
+    def shutdown(self):
+        """Stop the worker processes; they are restarted on the next sharded search"""
+        with self._lock:
+            executors, self._executors = self._executors, []
+            self._loaded = []
+        for executor in executors:
+            _terminate(executor)
+
+
+def _new_executor():
+    """A single-process executor whose worker starts from a fresh interpreter"""
+    # Forked workers would inherit the parent's database connections, locks and threads mid-use
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' in methods:
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(WORKER_PRELOAD)
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=1, mp_context=context)
+
+
+def _terminate(executor):
+    """Shut an executor down without waiting, stopping the search its process may still be running"""
+    # ProcessPoolExecutor has no public way to stop a running call
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+# Shared by every KnowledgeBaseService in the process
+sharded_search = ShardedSearch()
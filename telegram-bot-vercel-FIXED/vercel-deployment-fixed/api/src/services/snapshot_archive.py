@@ -0,0 +1,156 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import time
+import urllib.request
+from src.services.index_files import FORMAT_VERSION, MappedSegment, index_store, write_segment
+
+logger = logging.getLogger(__name__)
+
+# Directory or http(s) URL prefix holding bot-<id>.kbsnap archives that instances pull at boot ('' disables)
+SNAPSHOT_SOURCE = os.environ.get('SEARCH_SNAPSHOT_SOURCE', '')
+
+# Layout version of snapshot archives
+ARCHIVE_VERSION = 1
+
+# Name of the metadata member, always the first in the archive
+METADATA_NAME = 'snapshot.json'
+
+# Chunk size used when hashing and copying segment files
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def archive_name(bot_id: int):
+    """File name of a bot's snapshot archive in a snapshot source"""
+    return f'bot-{bot_id}.kbsnap'
+
+
+def _add_member(archive, name, fileobj, size):
+    """Add a file object to a tar archive under a name"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    archive.addfile(info, fileobj)
+
+
+def export_snapshot(snapshot, fileobj):
+    """Write a snapshot as a gzip-compressed tar of its segment files plus checksummed metadata"""
+    with tempfile.TemporaryDirectory() as directory:
+        # Mapped segments already are files; in-memory ones are written out first
+        paths = []
+        for i, segment in enumerate(snapshot.segments):
+            if isinstance(segment, MappedSegment):
+                paths.append(segment.path)
+            else:
+                path = os.path.join(directory, f'{i}.seg')
+                write_segment(segment, path)
+                paths.append(path)
+        
+        segments = []
+        for i, path in enumerate(paths):
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_CHUNK_BYTES), b''):
+                    digest.update(block)
+            segments.append({'name': f'segments/{i:04d}.seg', 'size': os.path.getsize(path), 'sha256': digest.hexdigest()})
+        
+        metadata = json.dumps({
+            'archive_version': ARCHIVE_VERSION,
+            'format': FORMAT_VERSION,
+            'bot_id': snapshot.bot_id,
+            'db_generations': snapshot.db_generations,
+            'tombstones': sorted(snapshot.tombstones),
+            'next_position': snapshot.next_position,
+            'chunks': snapshot.chunk_count,
+            'segments': segments
+        }).encode('utf-8')
+        
+        with tarfile.open(fileobj=fileobj, mode='w|gz') as archive:
+            _add_member(archive, METADATA_NAME, io.BytesIO(metadata), len(metadata))
+            for path, entry in zip(paths, segments):
+                with open(path, 'rb') as f:
+                    _add_member(archive, entry['name'], f, entry['size'])
+        
+        return {'bot_id': snapshot.bot_id, 'segments': len(segments), 'chunks': snapshot.chunk_count}
+
+
+def import_snapshot(fileobj, bot_id: int = None):
+    """Verify a snapshot archive and install its segments as the bot's stored index; returns its metadata"""
+    if not index_store.directory:
+        raise ValueError('Snapshot import needs SEARCH_INDEX_DIR')
+    
+    written = []
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|gz') as archive:
+            members = iter(archive)
+            member = next(members, None)
+            if member is None or member.name != METADATA_NAME:
+                raise ValueError('Not a search snapshot archive')
+            metadata = json.load(archive.extractfile(member))
+            if metadata.get('archive_version') != ARCHIVE_VERSION or metadata.get('format') != FORMAT_VERSION:
+                raise ValueError('Snapshot archive was written by an incompatible version')
+            bot_id = metadata['bot_id'] if bot_id is None else bot_id
+            
+            # Segment files are copied into the store while their checksums are computed
+            for entry in metadata['segments']:
+                member = next(members, None)
+                if member is None or member.name != entry['name']:
+                    raise ValueError(f"Snapshot archive is missing {entry['name']}")
+                name, path = index_store.new_segment_path(bot_id)
+                written.append(path)
+                digest = hashlib.sha256()
+                source = archive.extractfile(member)
+                with open(path, 'wb') as target:
+                    for block in iter(lambda: source.read(COPY_CHUNK_BYTES), b''):
+                        digest.update(block)
+                        target.write(block)
+                if digest.hexdigest() != entry['sha256']:
+                    raise ValueError(f"Checksum mismatch for {entry['name']}")
+                entry['file'] = name
+        
+        index_store.install(bot_id, {
+            'format': FORMAT_VERSION,
+            'db_generations': metadata['db_generations'],
+            'segments': [entry['file'] for entry in metadata['segments']],
+            'tombstones': metadata['tombstones'],
+            'next_position': metadata['next_position']
+        })
+        
+    except (tarfile.TarError, EOFError, KeyError, json.JSONDecodeError) as e:
+        for path in written:
+            os.remove(path)
+        raise ValueError(f'Invalid snapshot archive: {e}')
+    except BaseException:
+        for path in written:
+            os.remove(path)
+        raise
+    
+    metadata['bot_id'] = bot_id
+    return metadata
+
+
+def pull_snapshot(bot_id: int, source: str = None):
+    """Import the bot's archive from the snapshot source; returns whether one was installed"""
+    source = SNAPSHOT_SOURCE if source is None else source
+    if not source:
+        return False
+    
+    location = source.rstrip('/') + '/' + archive_name(bot_id)
+    try:
+        if location.startswith(('http://', 'https://')):
+            with urllib.request.urlopen(location, timeout=30) as response:
+                import_snapshot(response, bot_id)
+        else:
+            if not os.path.exists(location):
+                return False
+            with open(location, 'rb') as f:
+                import_snapshot(f, bot_id)
+    except Exception as e:
+        logger.warning(f"Could not pull the search snapshot of bot {bot_id} from {location}: {e}")
+        return False
+    
+    return True
@@ -0,0 +1,113 @@
+import html
+import re
+from collections import namedtuple
+
+# Characters of chunk text shown per result
+SNIPPET_LENGTH = 300
+
+# Longest overlap looked for when joining neighbouring chunks (documents are chunked with 200 characters of overlap)
+MAX_CHUNK_OVERLAP = 400
+
+# Shorter common text is a coincidence rather than the overlap of neighbouring chunks
+MIN_CHUNK_OVERLAP = 10
+
+# A run of neighbouring chunks of one document shown as a single result, identified by its best-ranked chunk
+ChunkSpan = namedtuple('ChunkSpan', 'id document_id chunk_index last_chunk_index content document')
+
+
+def match_pattern(query_words):
+    """Compile a pattern matching whole words that contain any query keyword"""
+    words = sorted({word for word in query_words if word}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r'\w*(?:' + '|'.join(re.escape(word) for word in words) + r')\w*', re.IGNORECASE)
+
+
+def make_snippet(content: str, pattern, length: int = SNIPPET_LENGTH):
+    """Return an HTML snippet of the content centred on its matches, with matches in bold"""
+    content = content.strip()
+    matches = [(match.start(), match.end()) for match in pattern.finditer(content)] if pattern else []
+    
+    if not matches:
+        end = _word_end(content, length)
+        return html.escape(content[:end]) + ("..." if end < len(content) else "")
+    
+    # Pick the window holding the most matches, then centre it on them
+    best_first, best_last = 0, 0
+    last = 0
+    for first in range(len(matches)):
+        last = max(last, first)
+        while last + 1 < len(matches) and matches[last + 1][1] - matches[first][0] <= length:
+            last += 1
+        if last - first > best_last - best_first:
+            best_first, best_last = first, last
+    
+    middle = (matches[best_first][0] + matches[best_last][1]) // 2
+    start = max(0, min(middle - length // 2, len(content) - length))
+    if start > 0:
+        # Do not start in the middle of a word
+        space = content.find(' ', start, matches[best_first][0])
+        start = space + 1 if space != -1 else start
+    end = start + _word_end(content[start:], length)
+    
+    parts = ["..." if start > 0 else ""]
+    position = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(html.escape(content[position:match_start]))
+        parts.append(f"<b>{html.escape(content[match_start:match_end])}</b>")
+        position = match_end
+    parts.append(html.escape(content[position:end]))
+    parts.append("..." if end < len(content) else "")
+    return "".join(parts)
+
+
+def _word_end(text: str, length: int):
+    """Offset at most length characters in that does not cut a word"""
+    if len(text) <= length:
+        return len(text)
+    space = text.rfind(' ', 0, length + 1)
+    return space if space > length // 2 else length
+
+
+def join_overlapping(first: str, second: str, max_overlap: int = MAX_CHUNK_OVERLAP):
+    """Concatenate neighbouring chunk texts, dropping the end of the first that the second repeats"""
+    for size in range(min(len(first), len(second), max_overlap), MIN_CHUNK_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + ' ' + second
+
+
+def collapse_neighbours(chunks: list):
+    """Merge ranked chunks that are neighbours in one document into spans, ranked by their best chunk"""
+    ranked = {}
+    for rank, chunk in enumerate(chunks):
+        ranked.setdefault((chunk.document_id, chunk.chunk_index), (rank, chunk))
+    
+    indexes_by_document = {}
+    for document_id, chunk_index in ranked:
+        indexes_by_document.setdefault(document_id, []).append(chunk_index)
+    
+    spans = []
+    for document_id, indexes in indexes_by_document.items():
+        indexes.sort()
+        runs = [[indexes[0]]]
+        for chunk_index in indexes[1:]:
+            if chunk_index == runs[-1][-1] + 1:
+                runs[-1].append(chunk_index)
+            else:
+                runs.append([chunk_index])
+        
+        for run in runs:
+            members = [ranked[(document_id, chunk_index)] for chunk_index in run]
+            content = members[0][1].content
+            for _, chunk in members[1:]:
+                content = join_overlapping(content, chunk.content)
+            rank, best = min(members, key=lambda member: member[0])
+            spans.append((rank, ChunkSpan(
+                best.id, document_id, run[0], run[-1], content, getattr(best, 'document', None)
+            )))
+    
+    spans.sort(key=lambda span: span[0])
+    return [span for _, span in spans]
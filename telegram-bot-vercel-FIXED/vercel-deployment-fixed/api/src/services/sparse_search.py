@@ -0,0 +1,172 @@
+import logging
+import threading
+from collections import Counter
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy/SciPy are optional; bots fall back to the keyword backend
+    np = None
+    sparse = None
+
+logger = logging.getLogger(__name__)
+
+# Most term matrices kept in memory at once (one per set of knowledge bases)
+MAX_CACHED_MATRICES = 16
+
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+
+class SparseTermMatrix:
+    """BM25-weighted chunk x term CSR matrix for a set of knowledge bases"""
+    
+    def __init__(self, postings, stats, scorer):
+        chunk_rows = {}
+        self.columns = {}
+        rows, cols, term_frequencies, lengths = [], [], [], []
+        
+        for chunk_id, term, term_frequency, token_count in postings:
+            row = chunk_rows.get(chunk_id)
+            if row is None:
+                row = chunk_rows[chunk_id] = len(lengths)
+                lengths.append(token_count)
+            rows.append(row)
+            cols.append(self.columns.setdefault(term, len(self.columns)))
+            term_frequencies.append(term_frequency)
+        
+        self.chunk_ids = np.fromiter(chunk_rows, dtype=np.int64, count=len(chunk_rows))
+        shape = (len(chunk_rows), len(self.columns))
+        
+        idf = np.zeros(len(self.columns))
+        for term, col in self.columns.items():
+            idf[col] = stats.idf.get(term, 0)
+        
+        # Precompute every BM25 term weight so a query is a plain dot product
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tf = np.asarray(term_frequencies, dtype=np.float64)
+        chunk_lengths = np.asarray(lengths, dtype=np.float64)[rows]
+        if stats.average_length:
+            length_norm = 1 - scorer.b + scorer.b * chunk_lengths / stats.average_length
+        else:
+            length_norm = np.ones_like(tf)
+        weights = idf[cols] * tf * (scorer.k1 + 1) / (tf + scorer.k1 * length_norm)
+        
+        self.weights = sparse.csr_matrix((weights, (rows, cols)), shape=shape)
+        self.presence = sparse.csr_matrix((np.ones_like(tf), (rows, cols)), shape=shape)
+        
+        # Column-major copies for per-term slicing of the partial-match path
+        self.weights_csc = self.weights.tocsc()
+        self.presence_csc = self.presence.tocsc()
+    
+    def search(self, query_plan: list, max_results: int, min_coverage: float):
+        """Return the ids of the best chunks, highest score first"""
+        return [chunk_id for chunk_id, _ in self.search_many([query_plan], max_results, min_coverage)[0]]
+    
+    def search_many(self, query_plans: list, max_results: int, min_coverage: float):
+        """Return the best (chunk id, score) pairs of each query plan, scoring all exact words in one product"""
+        # One column per query; the products stay sparse, holding only chunks that match a query word
+        rows, cols, counts = [], [], []
+        for query, query_plan in enumerate(query_plans):
+            for word, count in Counter(word for word, _ in query_plan).items():
+                col = self.columns.get(word)
+                if col is not None:
+                    rows.append(col)
+                    cols.append(query)
+                    counts.append(count)
+        query_matrix = sparse.csc_matrix((counts, (rows, cols)), shape=(len(self.columns), len(query_plans)))
+        all_scores = (self.weights @ query_matrix).tocsc()
+        all_coverage = (self.presence @ query_matrix).tocsc()
+        
+        results = []
+        for query, query_plan in enumerate(query_plans):
+            if not query_plan:
+                results.append([])
+                continue
+            scores = all_scores[:, query].toarray().ravel()
+            coverage = all_coverage[:, query].toarray().ravel()
+            self._add_partial_matches(query_plan, scores, coverage)
+            results.append(self._top(scores, coverage / len(query_plan), max_results, min_coverage))
+        return results
+    
+    def _add_partial_matches(self, query_plan: list, scores, coverage):
+        """Add partial matches, which earn half of the best partial term, only without an exact hit"""
+        word_counts = Counter(word for word, _ in query_plan)
+        partial_terms = dict(query_plan)
+        for word, count in word_counts.items():
+            cols = [self.columns[term] for term in partial_terms[word] if term in self.columns]
+            if not cols:
+                continue
+            
+            best_partial = self.weights_csc[:, cols].max(axis=1).toarray().ravel()
+            partial_hit = np.asarray(self.presence_csc[:, cols].sum(axis=1)).ravel() > 0
+            col = self.columns.get(word)
+            if col is not None:
+                partial_hit &= self.presence_csc[:, col].toarray().ravel() == 0
+            
+            scores += np.where(partial_hit, 0.5 * count * best_partial, 0)
+            coverage += np.where(partial_hit, 0.5 * count, 0)
+    
+    def _top(self, scores, coverage, max_results: int, min_coverage: float):
+        """Return the (chunk id, score) pairs of the best (without max_results, all) eligible chunks, ties in chunk order"""
+        eligible = np.flatnonzero(coverage > min_coverage)
+        if max_results is not None and eligible.size > max_results:
+            # Keep every chunk tied with the cut-off score so ties are broken by chunk id
+            cutoff = -np.partition(-scores[eligible], max_results - 1)[max_results - 1]
+            eligible = eligible[scores[eligible] >= cutoff]
+        
+        ranked = eligible[np.lexsort((self.chunk_ids[eligible], -scores[eligible]))][:max_results]
+        return list(zip(self.chunk_ids[ranked].tolist(), scores[ranked].tolist()))
+
+
+class SparseSearchBackend:
+    """Search backend that scores a query as one sparse matrix-vector product"""
+    
+    def __init__(self, search_index, scorer):
+        self.search_index = search_index
+        self.scorer = scorer
+    
+    def is_available(self):
+        """Check whether NumPy and SciPy are installed"""
+        return sparse is not None
+    
+    def search(self, kb_ids: list, query_plan: list, max_results: int, min_coverage: float):
+        """Return the ids of the best matching chunks"""
+        matrix = self._get_matrix(kb_ids)
+        if matrix.chunk_ids.size == 0:
+            return []
+        return matrix.search(query_plan, max_results, min_coverage)
+    
+    def search_many(self, kb_ids: list, query_plans: list, max_results: int, min_coverage: float):
+        """Return the best (chunk id, score) pairs of each query plan against one term matrix"""
+        matrix = self._get_matrix(kb_ids)
+        if matrix.chunk_ids.size == 0:
+            return [[] for _ in query_plans]
+        return matrix.search_many(query_plans, max_results, min_coverage)
+    
+    def _get_matrix(self, kb_ids: list):
+        """Return the cached term matrix for the knowledge bases, rebuilding it when stale"""
+        key = tuple(sorted(kb_ids))
+        generations = self.search_index.get_generations(kb_ids)
+        stamp = tuple(generations.get(kb_id, 0) for kb_id in key)
+        
+        with _matrices_lock:
+            cached = _matrices.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        postings = self.search_index.all_postings(kb_ids)
+        total_chunks, total_tokens, _ = self.search_index.get_collection_stats(kb_ids, ())
+        document_frequencies = self.search_index.all_document_frequencies(kb_ids)
+        stats = self.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
+        matrix = SparseTermMatrix(postings, stats, self.scorer)
+        logger.info(f"Built sparse term matrix {matrix.weights.shape} for knowledge bases {list(key)}")
+        
+        with _matrices_lock:
+            _matrices.pop(key, None)
+            while len(_matrices) >= MAX_CACHED_MATRICES:
+                _matrices.pop(next(iter(_matrices)))
+            _matrices[key] = (stamp, matrix)
+        
+        return matrix
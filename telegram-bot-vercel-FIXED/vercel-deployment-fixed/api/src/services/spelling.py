@@ -0,0 +1,96 @@
+# Largest edit distance corrected (short words allow one edit less)
+MAX_EDIT_DISTANCE = 2
+
+# Words up to this length are corrected by at most one edit
+SHORT_WORD_LENGTH = 4
+
+# Only this many leading characters are expanded into deletions, which bounds the dictionary size
+PREFIX_LENGTH = 7
+
+
+def deletions(word: str, max_distance: int):
+    """All strings obtained by deleting up to max_distance characters from the word"""
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {
+            candidate[:i] + candidate[i + 1:]
+            for candidate in frontier if len(candidate) > 1
+            for i in range(len(candidate))
+        }
+        found |= frontier
+    return found
+
+
+def edit_distance(first: str, second: str, max_distance: int):
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded"""
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    
+    previous_previous = None
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            # Adjacent transpositions count as one edit
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SymSpellDictionary:
+    """Precomputed deletion neighbourhoods of a vocabulary for constant-time typo correction"""
+    
+    def __init__(self, frequencies: dict, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, deletes=None):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        
+        # Prebuilt deletion tables (such as memory-mapped ones) are used as they are
+        if deletes is not None:
+            self.frequencies = frequencies
+            self.deletes = deletes
+            return
+        
+        self.frequencies = dict(frequencies)
+        self.deletes = {}
+        for term in self.frequencies:
+            for deletion in deletions(term[:prefix_length], max_distance):
+                self.deletes.setdefault(deletion, []).append(term)
+    
+    def correct(self, word: str):
+        """Return the word if it is known, else its closest most frequent term, else None"""
+        match = self.lookup(word)
+        return min(match[1], key=lambda term: (-self.frequencies.get(term, 0), term)) if match else None
+    
+    def lookup(self, word: str, frequency=None):
+        """Return (edit distance, terms) of the closest matches for the word, or None"""
+        # Callers combining several dictionaries rank the closest terms by their overall frequency.
+        # frequency(term) replaces the stored frequencies, e.g. to count only some chunks; terms it gives 0 are skipped
+        frequency = frequency or (lambda term: self.frequencies.get(term, 0))
+        if word in self.frequencies and frequency(word) > 0:
+            return 0, {word}
+        
+        max_distance = 1 if len(word) <= SHORT_WORD_LENGTH else self.max_distance
+        best = None
+        closest = set()
+        seen = set()
+        for deletion in deletions(word[:self.prefix_length], max_distance):
+            for term in self.deletes.get(deletion, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(word, term, max_distance)
+                if distance > max_distance or (best is not None and distance > best):
+                    continue
+                if frequency(term) <= 0:
+                    continue
+                if best is None or distance < best:
+                    best = distance
+                    closest = set()
+                closest.add(term)
+        return (best, closest) if best is not None else None
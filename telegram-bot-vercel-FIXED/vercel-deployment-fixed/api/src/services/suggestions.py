@@ -0,0 +1,174 @@
+import heapq
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from src.models.bot import db, KnowledgeBase, TermStatistic
+
+# How often a cached trie is checked against vocabulary changes made by other instances
+RECHECK_SECONDS = int(os.environ.get('SUGGEST_RECHECK_SECONDS', 30))
+
+# Most completions returned per request, and stored per trie node
+MAX_SUGGESTIONS = 10
+
+# Prefixes matching up to this many terms are ranked when asked; larger ones store their completions
+MAX_SCAN_TERMS = 64
+
+# The word being typed: the last run of word characters, unless the text ends after it
+_LAST_WORD = re.compile(r'(\w+)$')
+
+
+def _prefix_end(prefix: str):
+    """Smallest string sorting after every string that starts with the prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class CompletionTrie:
+    """Vocabulary trie weighted by chunk frequency, answering the most frequent completions of a prefix"""
+    
+    def __init__(self, frequencies: dict):
+        # The sorted vocabulary is the trie's leaf order: each node's terms form one contiguous range
+        self.terms = sorted(frequencies)
+        self.weights = array('q', (frequencies[term] for term in self.terms))
+        
+        # Nodes with too many terms to rank per keystroke keep their top completions
+        self.nodes = {}
+        pending = [(0, len(self.terms), 0)]
+        while pending:
+            lo, hi, depth = pending.pop()
+            if hi - lo <= MAX_SCAN_TERMS:
+                continue
+            prefix = self.terms[lo][:depth]
+            self.nodes[prefix] = self._rank(lo, hi, MAX_SUGGESTIONS)
+            
+            # Children: one range per next character (the prefix itself, if a term, sorts first)
+            i = lo + 1 if len(self.terms[lo]) == depth else lo
+            while i < hi:
+                j = bisect_left(self.terms, _prefix_end(prefix + self.terms[i][depth]), i, hi)
+                pending.append((i, j, depth + 1))
+                i = j
+    
+    def __len__(self):
+        return len(self.terms)
+    
+    def _rank(self, lo: int, hi: int, limit: int):
+        """Term ids of the range by descending weight, alphabetical among equals"""
+        return heapq.nsmallest(limit, range(lo, hi), key=lambda i: (-self.weights[i], i))
+    
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS):
+        """Return up to limit (term, weight) pairs starting with the prefix, most frequent first"""
+        if not prefix:
+            return []
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, _prefix_end(prefix), lo)
+        if hi - lo > MAX_SCAN_TERMS:
+            term_ids = self.nodes[prefix][:limit]
+        else:
+            term_ids = self._rank(lo, hi, limit)
+        return [(self.terms[i], self.weights[i]) for i in term_ids]
+    
+    def weight(self, term: str):
+        """Weight of a term, 0 when it is not in the vocabulary"""
+        i = bisect_left(self.terms, term)
+        return self.weights[i] if i < len(self.terms) and self.terms[i] == term else 0
+
+
+class SuggestionIndex:
+    """Completion tries per knowledge base, rebuilt after local ingests and re-checked for other instances' changes"""
+    
+    def __init__(self, recheck_seconds=RECHECK_SECONDS):
+        self.recheck_seconds = recheck_seconds
+        self._tries = {}  # kb id -> [index generation, trie, checked at]
+        self._lock = threading.Lock()
+    
+    def suggest(self, kb_ids: list, text: str, limit: int = MAX_SUGGESTIONS):
+        """Complete the last word of typed text: (word, [(term, chunk frequency, completed text)]), or None"""
+        # None means none of the knowledge bases exist
+        tries = self._get_tries(kb_ids)
+        if not tries:
+            return None
+        match = _LAST_WORD.search(text)
+        if not match:
+            return '', []
+        word = match.group(1).lower()
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        
+        # Candidates from each knowledge base, weighted by their chunk frequency across all of them
+        if len(tries) == 1:
+            ranked = tries[0].complete(word, limit)
+        else:
+            candidates = {term for trie in tries for term, _ in trie.complete(word, limit)}
+            ranked = heapq.nsmallest(
+                limit,
+                ((term, sum(trie.weight(term) for trie in tries)) for term in candidates),
+                key=lambda pair: (-pair[1], pair[0])
+            )
+        
+        head = text[:match.start(1)]
+        return word, [(term, weight, head + term) for term, weight in ranked]
+    
+    def refresh(self, kb_id: int):
+        """Rebuild a knowledge base's trie after its vocabulary changed (the change must be committed)"""
+        with self._lock:
+            if kb_id not in self._tries:
+                return
+        row = db.session.query(KnowledgeBase.index_generation).filter(KnowledgeBase.id == kb_id).first()
+        if row is None:
+            self.invalidate(kb_id)
+        else:
+            self._load(kb_id, row[0] or 0)
+    
+    def invalidate(self, kb_id: int):
+        """Drop a knowledge base's trie"""
+        with self._lock:
+            self._tries.pop(kb_id, None)
+    
+    def stats(self):
+        """Cached tries and their vocabulary sizes"""
+        with self._lock:
+            return {
+                'knowledge_bases': len(self._tries),
+                'terms': sum(len(trie) for _, trie, _ in self._tries.values())
+            }
+    
+    def _get_tries(self, kb_ids: list):
+        """Return current tries of the knowledge bases, checking entries older than the recheck interval"""
+        now = time.monotonic()
+        with self._lock:
+            entries = {kb_id: self._tries.get(kb_id) for kb_id in kb_ids}
+        stale = [kb_id for kb_id, entry in entries.items() if entry is None or now - entry[2] >= self.recheck_seconds]
+        
+        if stale:
+            generations = dict(db.session.query(KnowledgeBase.id, KnowledgeBase.index_generation).filter(
+                KnowledgeBase.id.in_(stale)
+            ).all())
+            for kb_id in stale:
+                entry = entries[kb_id]
+                if kb_id not in generations:
+                    self.invalidate(kb_id)
+                    entries[kb_id] = None
+                elif entry is not None and entry[0] == (generations[kb_id] or 0):
+                    entry[2] = now
+                else:
+                    entries[kb_id] = self._load(kb_id, generations[kb_id] or 0)
+        
+        return [entry[1] for entry in entries.values() if entry is not None]
+    
+    def _load(self, kb_id: int, generation: int):
+        """Build and cache a knowledge base's trie from its term statistics"""
+        rows = db.session.query(TermStatistic.term, TermStatistic.document_frequency).filter_by(
+            knowledge_base_id=kb_id
+        ).all()
+        entry = [generation, CompletionTrie(dict(rows)), time.monotonic()]
+        with self._lock:
+            current = self._tries.get(kb_id)
+            if current is not None and current[0] > generation:
+                return current
+            self._tries[kb_id] = entry
+        return entry
+
+
+# Shared by every request in the process
+suggestion_index = SuggestionIndex()
@@ -4,6 +4,9 @@ from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from src.models.bot import db, Bot, Conversation, TextChunk, Document, KnowledgeBase
 from src.services.knowledge_base_service import KnowledgeBaseService
+from src.services.search_budget import SEARCH_TIME_BUDGET_MS, SearchDeadline
+from src.services.search_filters import SearchFilter
+from src.services.question_index import question_index
 import threading
 import time
 
@@ -104,7 +107,21 @@ Example questions:
             
             # Search knowledge base
             try:
-                response = self.kb_service.search_knowledge_base(bot_id, user_message)
+                # A reworded repeat of a recent question reuses its answer without searching
+                response = question_index.lookup(bot_id, user_message)
+                reusable = response is not None
+                if response is None:
+                    version = question_index.version(bot_id)
+                    
+                    # Bounded so one huge knowledge base cannot stall every chat on the bot
+                    deadline = SearchDeadline(SEARCH_TIME_BUDGET_MS / 1000)
+                    search_filter = SearchFilter.from_json(bot.answer_filter)
+                    response = self.kb_service.search_knowledge_base(bot_id, user_message, deadline=deadline,
+                                                                     search_filter=search_filter)
+                    # Only complete answers are remembered (logged as reusable, to seed the index after restarts)
+                    if response and not deadline.partial:
+                        question_index.add(bot_id, user_message, response, version=version)
+                        reusable = True
                 
                 if not response:
                     response = """
@@ -118,7 +135,8 @@ You can try:
 If you think this information should be available, please contact the administrator to update the knowledge base.
                     """
                 
-                await update.message.reply_text(response)
+                # Search results are formatted as Telegram HTML with highlighted matches
+                await update.message.reply_text(response, parse_mode='HTML')
                 
                 # Log conversation
                 conversation = Conversation(
@@ -126,6 +144,7 @@ If you think this information should be available, please contact the administra
                     telegram_username=username,
                     message=user_message,
                     response=response,
+                    reusable=reusable,
                     bot_id=bot_id
                 )
                 db.session.add(conversation)
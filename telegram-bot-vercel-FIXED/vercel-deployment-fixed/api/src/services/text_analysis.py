@@ -0,0 +1,97 @@
+import re
+
+# Common stop words ignored by both ingestion and querying
+STOP_WORDS = {
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
+    'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their', 'what',
+    'when', 'where', 'why', 'how', 'who', 'which'
+}
+
+# Character n-gram size of the vocabulary index
+NGRAM_SIZE = 3
+
+
+def extract_keywords(text):
+    """Extract meaningful keywords from text"""
+    # Extract words (alphanumeric sequences)
+    words = re.findall(r'\b\w+\b', text.lower())
+    
+    # Filter out stop words and short words
+    return [word for word in words if len(word) > 2 and word not in STOP_WORDS]
+
+
+def ngrams(term: str, size: int = NGRAM_SIZE):
+    """Return the distinct character n-grams of a term"""
+    return {term[i:i + size] for i in range(len(term) - size + 1)}
+
+
+def parse_phrases(query: str):
+    """Return the keyword sequences of quoted phrases in a query (two or more keywords each)"""
+    phrases = []
+    for text in re.findall(r'"([^"]+)"', query):
+        keywords = extract_keywords(text)
+        if len(keywords) > 1:
+            phrases.append(keywords)
+    return phrases
+
+
+def encode_positions(positions):
+    """Delta + varint encode ascending keyword positions"""
+    encoded = bytearray()
+    previous = 0
+    for position in positions:
+        delta = position - previous
+        previous = position
+        while delta >= 0x80:
+            encoded.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        encoded.append(delta)
+    return bytes(encoded)
+
+
+def decode_positions(encoded):
+    """Decode positions written by encode_positions"""
+    positions = []
+    position = 0
+    delta = 0
+    shift = 0
+    for byte in encoded:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += delta
+        positions.append(position)
+        delta = 0
+        shift = 0
+    return positions
+
+
+def phrase_matches(term_positions: dict, phrase: list):
+    """Check whether the phrase keywords occur consecutively given {term: positions}"""
+    if any(term not in term_positions for term in phrase):
+        return False
+    following = [set(term_positions[term]) for term in phrase[1:]]
+    return any(
+        all(start + offset in positions for offset, positions in enumerate(following, 1))
+        for start in term_positions[phrase[0]]
+    )
+
+
+def min_distance(first: list, second: list):
+    """Smallest gap between two ascending position lists"""
+    i = j = 0
+    best = None
+    while i < len(first) and j < len(second):
+        gap = abs(first[i] - second[j])
+        if best is None or gap < best:
+            best = gap
+        if first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return best
@@ -0,0 +1,182 @@
+import heapq
+import sys
+from bisect import bisect_left
+from src.services.search_budget import CHECK_INTERVAL
+
+# Position past the end of every posting list
+END = sys.maxsize
+
+# Slack for floating point differences between upper bounds and exact scores
+EPSILON = 1e-9
+
+
+class PostingCursor:
+    """Forward-only cursor over a posting list sorted by chunk position"""
+    
+    def __init__(self, term, positions, frequencies, upper_bound):
+        self.term = term
+        self.positions = positions
+        self.frequencies = frequencies
+        self.upper_bound = upper_bound
+        self.index = 0
+        self.position = END  # Chunk position under the cursor, END once the list is exhausted
+        self._move(0)
+    
+    def _move(self, index):
+        self.index = index
+        self.position = self.positions[index] if index < len(self.positions) else END
+    
+    def frequency(self):
+        """Term frequency in the chunk under the cursor"""
+        return self.frequencies[self.index]
+    
+    def advance(self):
+        """Move to the next posting"""
+        self._move(self.index + 1)
+    
+    def seek(self, target):
+        """Skip to the first posting at or after the target position"""
+        if self.position < target:
+            self._move(bisect_left(self.positions, target, self.index))
+    
+    def frequency_at(self, position):
+        """Term frequency in a chunk without moving the cursor, 0 when the term is absent"""
+        i = bisect_left(self.positions, position)
+        return self.frequencies[i] if i < len(self.positions) and self.positions[i] == position else 0
+
+
+def _seed_candidates(cursors: list, k: int, contribution):
+    """Return (bound, position, term frequencies) of up to k promising chunks, most promising first"""
+    # The most frequent postings of the highest-bound (rarest) terms, whose lists are short to rank
+    positions = set()
+    for cursor in reversed(cursors):
+        if len(positions) >= k:
+            break
+        frequencies = cursor.frequencies
+        for i in heapq.nlargest(k - len(positions), range(len(frequencies)), key=frequencies.__getitem__):
+            positions.add(cursor.positions[i])
+    
+    candidates = []
+    for position in positions:
+        term_frequencies = {}
+        bound = 0
+        for cursor in cursors:
+            frequency = cursor.frequency_at(position)
+            if frequency:
+                term_frequencies[cursor.term] = frequency
+                bound += contribution(cursor.term, frequency, position)
+        candidates.append((bound, position, term_frequencies))
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+    return candidates
+
+
+def max_score_top_k(cursors: list, k: int, contribution, score, deadline=None):
+    """Return the top-k (score, position) pairs and the number of chunks fully scored"""
+    # contribution() bounds one term's share of a chunk score and each cursor's upper bound
+    # bounds every contribution of its term; score() returns None for chunks that do not qualify.
+    # Past the deadline the best chunks found so far are returned.
+    cursors = sorted(cursors, key=lambda cursor: cursor.upper_bound)
+    if not cursors:
+        return [], 0
+    
+    # prefix[i] bounds the score a chunk can collect from cursors[0..i]
+    prefix = []
+    total = 0
+    for cursor in cursors:
+        total += cursor.upper_bound
+        prefix.append(total)
+    
+    heap = []  # (score, -position), worst entry first
+    threshold = None
+    first_essential = 0
+    scored = 0
+    
+    def offer(value, position):
+        """Keep a scored chunk if it is among the best k; returns whether the heap changed"""
+        # Earlier positions win ties, whatever order chunks are scored in
+        entry = (value, -position)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            return False
+        return True
+    
+    # Chunks where the query's terms are most frequent are scored first, so a search stopped by its
+    # deadline keeps the most promising chunks, and the k-th score starts pruning the walk early
+    seeded = set()
+    for bound, position, term_frequencies in _seed_candidates(cursors, k, contribution):
+        seeded.add(position)
+        if threshold is not None and bound <= threshold - EPSILON:
+            continue
+        value = score(position, term_frequencies)
+        scored += 1
+        if value is not None and offer(value, position) and len(heap) == k:
+            threshold = heap[0][0]
+    if threshold is not None:
+        while first_essential < len(cursors) and prefix[first_essential] <= threshold - EPSILON:
+            first_essential += 1
+    
+    # Essential cursors ordered by position; cursors that become non-essential are dropped lazily
+    frontier = [(cursor.position, i) for i, cursor in enumerate(cursors) if cursor.position != END]
+    heapq.heapify(frontier)
+    
+    visited = 0
+    while True:
+        visited += 1
+        if deadline is not None and visited % CHECK_INTERVAL == 0 and deadline.expired():
+            break
+        
+        while frontier and frontier[0][1] < first_essential:
+            heapq.heappop(frontier)
+        if not frontier:
+            break
+        
+        # Only chunks in an essential list can still beat the current k-th score; essential
+        # terms count at their upper bound, which is cheaper than an exact contribution
+        position = frontier[0][0]
+        term_frequencies = {}
+        bound = 0
+        while frontier and frontier[0][0] == position:
+            _, i = heapq.heappop(frontier)
+            if i < first_essential:
+                continue
+            cursor = cursors[i]
+            term_frequencies[cursor.term] = cursor.frequency()
+            bound += cursor.upper_bound
+            cursor.advance()
+            if cursor.position != END:
+                heapq.heappush(frontier, (cursor.position, i))
+        
+        # Seeded chunks were scored with all their terms already
+        if position in seeded:
+            continue
+        
+        # Probe the non-essential lists, largest bound first, while the chunk can still qualify
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if bound + prefix[i] <= threshold - EPSILON:
+                pruned = True
+                break
+            cursor = cursors[i]
+            cursor.seek(position)
+            if cursor.position == position:
+                term_frequencies[cursor.term] = cursor.frequency()
+                bound += contribution(cursor.term, cursor.frequency(), position)
+        
+        if pruned or (threshold is not None and bound <= threshold - EPSILON):
+            continue
+        
+        value = score(position, term_frequencies)
+        scored += 1
+        if value is None or not offer(value, position):
+            continue
+        
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and prefix[first_essential] <= threshold - EPSILON:
+                first_essential += 1
+    
+    ranked = sorted(((value, -negative_position) for value, negative_position in heap), key=lambda x: (-x[0], x[1]))
+    return ranked, scored
@@ -0,0 +1,349 @@
+import heapq
+import logging
+import math
+import os
+import random
+import struct
+import threading
+import zlib
+from array import array
+from collections import Counter
+from src.models.bot import db, Document, TextChunk
+from src.services.text_analysis import extract_keywords, ngrams
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; bots fall back to the keyword backend
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Most ANN indexes kept in memory at once (one per set of knowledge bases)
+MAX_CACHED_INDEXES = 16
+
+# Rebuild an index from scratch once this share of its nodes has been deleted
+MAX_DELETED_RATIO = 0.25
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class Embedder:
+    """Interface for offline text embedders; subclass to plug in a local model"""
+    
+    name = 'base'
+    dimensions = 0
+    
+    def embed(self, text: str):
+        """Return the embedding of the text as a list of floats"""
+        raise NotImplementedError
+    
+    def embed_keywords(self, text: str, keywords: list):
+        """Embed text whose keywords are already analysed; models with their own tokeniser use the text"""
+        return self.embed(text)
+
+
+class HashingEmbedder(Embedder):
+    """CPU-only embedder hashing keywords and their character trigrams into a fixed-size vector"""
+    
+    name = 'hashing'
+    
+    def __init__(self, dimensions=256, ngram_weight=0.25):
+        self.dimensions = dimensions
+        self.ngram_weight = ngram_weight
+    
+    def embed(self, text: str):
+        """Return an L2-normalised hashed feature vector"""
+        return self.embed_keywords(text, extract_keywords(text))
+    
+    def embed_keywords(self, text: str, keywords: list):
+        """Return the hashed feature vector of pre-analysed keywords"""
+        features = Counter()
+        for keyword in keywords:
+            features[keyword] += 1.0
+            # Padded trigrams let inflected and compound forms land close together
+            for gram in ngrams(f'#{keyword}#'):
+                features[gram] += self.ngram_weight
+        
+        vector = [0.0] * self.dimensions
+        for feature, weight in features.items():
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            sign = -1.0 if hashed & 0x80000000 else 1.0
+            # Sublinear scaling of repeated features
+            if weight > 1:
+                weight = 1 + math.log(weight)
+            vector[hashed % self.dimensions] += sign * weight
+        
+        norm = math.sqrt(sum(value * value for value in vector))
+        if not norm:
+            return vector
+        return [value / norm for value in vector]
+
+
+# Embedders selectable through the SEARCH_EMBEDDER environment variable
+EMBEDDERS = {
+    'hashing': HashingEmbedder
+}
+
+_embedder = None
+
+
+def register_embedder(name: str, factory):
+    """Register an embedder factory (e.g. a local sentence-embedding model)"""
+    EMBEDDERS[name] = factory
+
+
+def get_embedder():
+    """Return the configured embedder instance"""
+    global _embedder
+    if _embedder is None:
+        name = os.environ.get('SEARCH_EMBEDDER', 'hashing')
+        if name not in EMBEDDERS:
+            logger.warning(f"Unknown embedder '{name}', using hashing embedder")
+            name = 'hashing'
+        _embedder = EMBEDDERS[name]()
+    return _embedder
+
+
+def encode_vector(vector):
+    """Quantise a vector to int8 with a float16 scale (dimensions + 2 bytes)"""
+    max_value = max((abs(value) for value in vector), default=0)
+    if not max_value:
+        return None
+    
+    scale = max_value / 127
+    values = array('b', (int(round(value / scale)) for value in vector))
+    return struct.pack('<e', scale) + values.tobytes()
+
+
+def decode_vector(blob):
+    """Return (scale, int8 values) from an encoded vector"""
+    scale = struct.unpack_from('<e', blob)[0]
+    return scale, array('b', blob[2:])
+
+
+class HNSWIndex:
+    """Hierarchical navigable small-world graph over int8 vectors (inner-product similarity)"""
+    
+    def __init__(self, dimensions, m=12, ef_construction=64, ef_search=48, seed=42):
+        self.dimensions = dimensions
+        self.m = m
+        self.max_links_base = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_multiplier = 1 / math.log(m)
+        self.random = random.Random(seed)
+        
+        self.item_ids = []
+        self.scales = []
+        self.vectors = np.zeros((64, dimensions), dtype=np.int8)  # Grown by doubling
+        self.layers = []
+        self.entry_point = None
+        self.deleted = set()
+        self.nodes_by_item = {}
+    
+    def __len__(self):
+        return len(self.item_ids) - len(self.deleted)
+    
+    def _similarities(self, query, nodes):
+        """Inner products of a float query against the given nodes"""
+        nodes = list(nodes)
+        return (self.vectors[nodes] @ query) * np.asarray([self.scales[node] for node in nodes])
+    
+    def _vector(self, node):
+        return self.vectors[node].astype(np.float32) * self.scales[node]
+    
+    def add(self, item_id, blob):
+        """Insert an encoded vector under an external item id"""
+        scale, values = decode_vector(blob)
+        node = len(self.item_ids)
+        if node >= len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.dimensions), dtype=np.int8)
+            grown[:node] = self.vectors[:node]
+            self.vectors = grown
+        self.vectors[node] = np.frombuffer(values.tobytes(), dtype=np.int8)
+        self.item_ids.append(item_id)
+        self.scales.append(scale)
+        self.nodes_by_item[item_id] = node
+        
+        top_level = len(self.layers) - 1
+        level = int(-math.log(1 - self.random.random()) * self.level_multiplier)
+        while len(self.layers) <= level:
+            self.layers.append({})
+        for layer in range(level + 1):
+            self.layers[layer][node] = []
+        
+        if self.entry_point is None:
+            self.entry_point = node
+            return
+        
+        query = self._vector(node)
+        entry_points = [self.entry_point]
+        
+        # Greedy descent through the layers above the new node
+        for layer in range(top_level, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+        
+        for layer in range(min(level, top_level), -1, -1):
+            candidates = self._search_layer(query, entry_points, self.ef_construction, layer)
+            neighbours = [candidate for _, candidate in candidates[:self.m]]
+            self.layers[layer][node] = neighbours
+            
+            max_links = self.max_links_base if layer == 0 else self.m
+            for neighbour in neighbours:
+                links = self.layers[layer][neighbour]
+                links.append(node)
+                if len(links) > max_links:
+                    similarities = self._similarities(self._vector(neighbour), links)
+                    keep = np.argsort(-similarities)[:max_links]
+                    self.layers[layer][neighbour] = [links[i] for i in keep]
+            
+            entry_points = [candidate for _, candidate in candidates]
+        
+        # A node on a new top layer becomes the entry point
+        if level > top_level:
+            self.entry_point = node
+    
+    def remove(self, item_id):
+        """Mark an item as deleted; it stays in the graph for navigation"""
+        node = self.nodes_by_item.pop(item_id, None)
+        if node is not None:
+            self.deleted.add(node)
+    
+    def _search_layer(self, query, entry_points, ef, layer):
+        """Best-first search of one layer, returning (similarity, node) pairs, best first"""
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        similarities = self._similarities(query, entry_points)
+        
+        candidates = [(-similarity, node) for similarity, node in zip(similarities, entry_points)]
+        heapq.heapify(candidates)
+        results = [(similarity, node) for similarity, node in zip(similarities, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        
+        while candidates:
+            negative_similarity, node = heapq.heappop(candidates)
+            if len(results) >= ef and -negative_similarity < results[0][0]:
+                break
+            
+            neighbours = [neighbour for neighbour in graph.get(node, ()) if neighbour not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            
+            for similarity, neighbour in zip(self._similarities(query, neighbours), neighbours):
+                if len(results) < ef or similarity > results[0][0]:
+                    heapq.heappush(candidates, (-similarity, neighbour))
+                    heapq.heappush(results, (similarity, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        
+        return sorted(results, reverse=True)
+    
+    def search(self, query, k):
+        """Return up to k (item id, similarity) pairs, most similar first"""
+        if self.entry_point is None:
+            return []
+        
+        query = np.asarray(query, dtype=np.float32)
+        entry_points = [self.entry_point]
+        for layer in range(len(self.layers) - 1, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+        
+        # Over-fetch so deleted nodes do not starve the result list
+        ef = max(self.ef_search, k + len(self.deleted))
+        results = self._search_layer(query, entry_points, ef, 0)
+        return [
+            (self.item_ids[node], float(similarity))
+            for similarity, node in results if node not in self.deleted
+        ][:k]
+
+
+class VectorSearchBackend:
+    """Search backend ranking chunks by embedding similarity through an HNSW index"""
+    
+    def __init__(self, search_index, min_similarity=0.1):
+        self.search_index = search_index
+        self.min_similarity = min_similarity
+    
+    def is_available(self):
+        """Check whether NumPy is installed"""
+        return np is not None
+    
+    def search(self, kb_ids: list, query: str, max_results: int):
+        """Return the ids of the chunks most similar to the query"""
+        embedder = get_embedder()
+        query_vector = embedder.embed(query)
+        if not any(query_vector):
+            return []
+        
+        index = self._get_index(kb_ids, embedder)
+        return [
+            chunk_id
+            for chunk_id, similarity in index.search(query_vector, max_results)
+            if similarity > self.min_similarity
+        ]
+    
+    def _embed_missing(self, chunks: list, embedder):
+        """Embed chunks stored without a vector (or with another embedder's); returns whether any were"""
+        embedded = False
+        for chunk in chunks:
+            if chunk.embedding is None or len(chunk.embedding) - 2 != embedder.dimensions:
+                keywords = self.search_index.chunk_keywords(chunk)
+                chunk.embedding = encode_vector(embedder.embed_keywords(chunk.content, keywords))
+                embedded = True
+        return embedded
+    
+    def _get_index(self, kb_ids: list, embedder):
+        """Return the cached ANN index for the knowledge bases, catching up with index changes"""
+        key = tuple(sorted(kb_ids))
+        generations = self.search_index.get_generations(kb_ids)
+        stamp = tuple(generations.get(kb_id, 0) for kb_id in key)
+        
+        with _indexes_lock:
+            cached = _indexes.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        
+        index = cached[1] if cached is not None else None
+        if index is None or index.dimensions != embedder.dimensions or len(index.deleted) > MAX_DELETED_RATIO * len(index.item_ids):
+            index = HNSWIndex(embedder.dimensions)
+        
+        # Apply additions and deletions since the cached generation (chunks without keywords have no vector)
+        current_ids = {
+            row[0]
+            for row in db.session.query(TextChunk.id).join(Document).filter(
+                Document.knowledge_base_id.in_(kb_ids),
+                Document.processed == True,
+                TextChunk.token_count > 0
+            ).all()
+        }
+        for chunk_id in set(index.nodes_by_item) - current_ids:
+            index.remove(chunk_id)
+        
+        new_ids = current_ids - set(index.nodes_by_item)
+        if new_ids:
+            chunks = TextChunk.query.filter(TextChunk.id.in_(new_ids)).order_by(TextChunk.id).all()
+            embedded = self._embed_missing(chunks, embedder)
+            vectors = [(chunk.id, chunk.embedding) for chunk in chunks]
+            if embedded:
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Could not store chunk embeddings: {e}")
+            for chunk_id, blob in vectors:
+                if blob is not None:
+                    index.add(chunk_id, blob)
+        
+        logger.info(f"Vector index for knowledge bases {list(key)} now holds {len(index)} chunks")
+        
+        with _indexes_lock:
+            _indexes.pop(key, None)
+            while len(_indexes) >= MAX_CACHED_INDEXES:
+                _indexes.pop(next(iter(_indexes)))
+            _indexes[key] = (stamp, index)
+        
+        return index
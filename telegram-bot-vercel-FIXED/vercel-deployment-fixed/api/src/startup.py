@@ -0,0 +1,58 @@
+# Columns whose addition means existing chunks were never indexed (or analysed) for search
+SEARCH_INDEX_COLUMNS = {'knowledge_base.indexed_chunks', 'text_chunk.token_count', 'text_chunk.keywords'}
+
+
+def initialize_app(app):
+    """Startup shared by every entry point: CLI commands, database schema, search indexes and warm snapshots"""
+    from src.commands import search_index_cli
+    from src.models.bot import db
+    
+    # Command line tools: flask --app app search-index export|import
+    app.cli.add_command(search_index_cli)
+    
+    with app.app_context():
+        db.create_all()
+        
+        # Databases created by earlier versions get the columns added since
+        from src.services.schema_upgrade import upgrade_schema
+        try:
+            added = upgrade_schema(db.engine)
+            if SEARCH_INDEX_COLUMNS & set(added):
+                reindex_knowledge_bases()
+        except Exception as e:
+            print(f"Warning: Could not upgrade the database schema: {e}")
+        
+        # Set up database full-text search for chunks
+        from src.services.fulltext_search import install_fulltext_search
+        try:
+            install_fulltext_search(db.engine)
+        except Exception as e:
+            print(f"Warning: Could not set up full-text search: {e}")
+        
+        # Trigram index behind document name search (names are scanned without it)
+        from src.services.filename_search import install_filename_search
+        try:
+            install_filename_search(db.engine)
+        except Exception as e:
+            print(f"Warning: Could not set up filename search: {e}")
+        
+        # New instances pull search snapshots exported by others instead of indexing from scratch
+        from src.services.corpus_snapshot import corpus_snapshots
+        try:
+            corpus_snapshots.warm_start()
+        except Exception as e:
+            print(f"Warning: Could not pull search snapshots: {e}")
+
+
+def reindex_knowledge_bases():
+    """Index the documents of every knowledge base, after an upgrade from a version without search indexing"""
+    from src.models.bot import KnowledgeBase
+    from src.services.search_index import SearchIndex
+    
+    search_index = SearchIndex()
+    for kb_id, in KnowledgeBase.query.with_entities(KnowledgeBase.id).all():
+        try:
+            result = search_index.reindex_knowledge_base(kb_id)
+            print(f"Reindexed knowledge base {kb_id}: {result['documents']} documents, {result['postings']} postings")
+        except Exception as e:
+            print(f"Warning: Could not reindex knowledge base {kb_id}: {e}")
@@ -789,16 +789,80 @@ async function deleteDocument(docId) {
     }
 }
 
-// Search knowledge base
-async function searchKnowledgeBase() {
+// Search knowledge base, suggesting words from its vocabulary while typing
+function searchKnowledgeBase() {
     if (!currentKnowledgeBase) {
         showNotification('Please select a knowledge base first', 'warning');
         return;
     }
     
-    const query = prompt('Enter your search query:');
-    if (!query) return;
+    const modal = document.createElement('div');
+    modal.className = 'modal fade';
+    modal.innerHTML = `
+        <div class="modal-dialog">
+            <form class="modal-content">
+                <div class="modal-header">
+                    <h5 class="modal-title">Search Knowledge Base</h5>
+                    <button type="button" class="btn-close" data-bs-dismiss="modal"></button>
+                </div>
+                <div class="modal-body">
+                    <input type="text" class="form-control" placeholder="Enter your search query" list="search-suggestions" autocomplete="off" required>
+                    <datalist id="search-suggestions"></datalist>
+                </div>
+                <div class="modal-footer">
+                    <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">Cancel</button>
+                    <button type="submit" class="btn btn-primary">Search</button>
+                </div>
+            </form>
+        </div>
+    `;
+    
+    const input = modal.querySelector('input');
+    const datalist = modal.querySelector('datalist');
+    let suggestTimer = null;
+    input.addEventListener('input', () => {
+        clearTimeout(suggestTimer);
+        suggestTimer = setTimeout(() => loadSearchSuggestions(input.value, datalist), 100);
+    });
+    
+    document.body.appendChild(modal);
+    const bsModal = new bootstrap.Modal(modal);
+    modal.querySelector('form').addEventListener('submit', (event) => {
+        event.preventDefault();
+        const query = input.value.trim();
+        bsModal.hide();
+        if (query) runKnowledgeBaseSearch(query);
+    });
+    modal.addEventListener('shown.bs.modal', () => input.focus());
+    modal.addEventListener('hidden.bs.modal', () => modal.remove());
+    bsModal.show();
+}
+
+// Fill the search box suggestions with completions of the word being typed
+async function loadSearchSuggestions(text, datalist) {
+    if (!text.trim()) {
+        datalist.innerHTML = '';
+        return;
+    }
     
+    try {
+        const response = await fetch(`${API_BASE}/knowledge-bases/${currentKnowledgeBase}/suggest?q=${encodeURIComponent(text)}&limit=8`);
+        const data = await response.json();
+        datalist.innerHTML = '';
+        if (data.success) {
+            data.data.suggestions.forEach(suggestion => {
+                const option = document.createElement('option');
+                option.value = suggestion.text;
+                datalist.appendChild(option);
+            });
+        }
+    } catch (error) {
+        console.error('Error loading suggestions:', error);
+    }
+}
+
+// Run a search and show its results
+async function runKnowledgeBaseSearch(query) {
     try {
         showLoading(true);
         
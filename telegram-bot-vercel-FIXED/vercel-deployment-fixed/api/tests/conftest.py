@@ -0,0 +1,188 @@
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix='kb-search-tests-')
+
+# Seeds of the corpora made by make_corpus; each also names its bot
+_corpus_seeds = itertools.count(100)
+
+# The app imports its modules both as src.* and as top-level packages of api/src
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.join(API_DIR, 'src'))
+
+# Read when the services are imported: private index files, no time budget, no snapshot rechecks
+os.environ['SEARCH_INDEX_DIR'] = os.path.join(TEST_DIR, 'search-index')
+os.environ['SEARCH_SNAPSHOT_SOURCE'] = ''
+os.environ['SEARCH_TIME_BUDGET_MS'] = '0'
+os.environ['SNAPSHOT_RECHECK_SECONDS'] = '3600'
+
+from flask import Flask
+from src.models.user import db
+from src.models.bot import Bot, KnowledgeBase, Document
+from src.services import corpus_snapshot, snapshot_archive
+from src.services.corpus_snapshot import SnapshotRegistry, corpus_snapshots
+from src.services.file_processor import FileProcessor
+from src.services.filename_search import install_filename_search
+from src.services.fulltext_search import install_fulltext_search
+from src.services.index_files import IndexStore, index_store
+from src.services.knowledge_base_service import KnowledgeBaseService
+from src.services.text_analysis import STOP_WORDS
+
+
+def make_vocabulary(rng, size):
+    """Pronounceable made-up words, so misspellings have a single closest word more often than not"""
+    words = set()
+    while len(words) < size:
+        word = ''.join(rng.choice('bcdfgklmnprstvz') + rng.choice('aeiou') for _ in range(rng.randint(2, 4)))
+        if word not in STOP_WORDS:
+            words.add(word)
+    return sorted(words)
+
+
+class Corpus:
+    """A keyword-search bot whose knowledge bases hold generated documents, with Zipf-distributed words"""
+    
+    def __init__(self, processor, seed, knowledge_bases=2, documents=8, sentences=40):
+        self.processor = processor
+        self.rng = random.Random(seed)
+        self.words = make_vocabulary(self.rng, 600)
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+        
+        bot = Bot(name=f'Test bot {seed}', username=f'test_bot_{seed}', token='token')
+        db.session.add(bot)
+        db.session.commit()
+        self.bot_id = bot.id
+        
+        self.kb_ids = []
+        for i in range(knowledge_bases):
+            knowledge_base = KnowledgeBase(name=f'Knowledge base {i}', bot_id=bot.id)
+            db.session.add(knowledge_base)
+            db.session.commit()
+            self.kb_ids.append(knowledge_base.id)
+        
+        self.document_ids = []
+        for i in range(documents):
+            self.add_document(self.kb_ids[i % knowledge_bases], sentences)
+    
+    def add_document(self, kb_id, sentences=20):
+        """Write, store and process a generated text document; returns its id"""
+        name = f'doc-{self.bot_id}-{len(self.document_ids)}.txt'
+        path = os.path.join(self.processor.upload_folder, name)
+        with open(path, 'w') as f:
+            for _ in range(sentences):
+                f.write(' '.join(self.rng.choices(self.words, weights=self.weights, k=self.rng.randint(5, 15))) + '. ')
+        
+        document = Document(filename=name, original_filename=name, file_path=path, file_type='txt',
+                            file_size=os.path.getsize(path), knowledge_base_id=kb_id)
+        db.session.add(document)
+        db.session.commit()
+        assert self.processor.process_document(document.id)
+        self.document_ids.append(document.id)
+        wait_for_snapshot_tasks()
+        return document.id
+    
+    def delete_document(self, document_id):
+        assert self.processor.delete_document(document_id)
+        self.document_ids.remove(document_id)
+        wait_for_snapshot_tasks()
+    
+    def queries(self, count, seed=0):
+        """Queries of one to three words, mostly drawn from the vocabulary, some missing from it"""
+        rng = random.Random(seed)
+        queries = []
+        for _ in range(count):
+            words = rng.choices(self.words, weights=self.weights, k=rng.randint(1, 3))
+            if rng.random() < 0.1:
+                words.append('zzyzx')
+            queries.append(' '.join(words))
+        return queries
+    
+    def assert_ranks_like_the_database_index(self, service, snapshot, count=30):
+        """Check the snapshot's rankings against the database index, over all and over one knowledge base"""
+        for kb_ids in (self.kb_ids, self.kb_ids[:1]):
+            for query in self.queries(count):
+                from_snapshot = [chunk.id for chunk in service._search_chunks(kb_ids, query, 5, source=snapshot)]
+                from_database = [chunk.id for chunk in service._search_chunks(kb_ids, query, 5)]
+                assert from_snapshot == from_database, (kb_ids, query)
+
+
+def wait_for_snapshot_tasks():
+    """Wait for snapshot builds and merges running in background threads"""
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(10)
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        install_fulltext_search(db.engine)
+        install_filename_search(db.engine)
+        yield app
+
+
+@pytest.fixture(scope='session')
+def client(app, processor):
+    """Test client of the file and search routes, mounted under /api as in the app"""
+    from src.routes.file_routes import file_bp
+    app.config['UPLOAD_FOLDER'] = processor.upload_folder
+    app.register_blueprint(file_bp, url_prefix='/api')
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def processor(app):
+    upload_folder = os.path.join(TEST_DIR, 'uploads')
+    os.makedirs(upload_folder, exist_ok=True)
+    return FileProcessor(upload_folder)
+
+
+@pytest.fixture(scope='session')
+def corpus(processor):
+    """Shared read-only corpus; tests that add or delete documents use make_corpus"""
+    return Corpus(processor, seed=1)
+
+
+@pytest.fixture
+def make_corpus(processor):
+    """Build a fresh corpus of its own bot"""
+    return lambda **options: Corpus(processor, seed=next(_corpus_seeds), **options)
+
+
+@pytest.fixture
+def new_instance(app, monkeypatch):
+    """Start what another process would have: its own snapshot registry and index store (by default over the same directory)"""
+    def start(directory=None):
+        store = IndexStore(directory or index_store.directory)
+        monkeypatch.setattr(corpus_snapshot, 'index_store', store)
+        monkeypatch.setattr(snapshot_archive, 'index_store', store)
+        return SnapshotRegistry()
+    
+    yield start
+    wait_for_snapshot_tasks()
+
+
+@pytest.fixture
+def service(app):
+    service = KnowledgeBaseService()
+    service.dynamic_pruning = True
+    return service
+
+
+@pytest.fixture
+def snapshot(corpus):
+    """Current snapshot of the shared corpus, built in the test thread"""
+    corpus_snapshots._rebuild(corpus.bot_id)
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    assert snapshot is not None
+    return snapshot
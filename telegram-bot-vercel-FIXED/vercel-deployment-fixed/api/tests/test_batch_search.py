@@ -0,0 +1,60 @@
+import json
+from src.services import knowledge_base_service
+from src.services.knowledge_base_service import KnowledgeBaseService
+
+
+def batch(client, **body):
+    return client.post('/api/knowledge-bases/search/batch', json=body)
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_streams_one_line_per_query_in_order(client, corpus, service):
+    queries = corpus.queries(120, seed=12)
+    response = batch(client, kb_ids=corpus.kb_ids, queries=queries, max_results=5)
+    assert response.status_code == 200 and response.is_streamed and response.mimetype == 'application/x-ndjson'
+    
+    results = lines(response)
+    assert [(result['index'], result['query']) for result in results] == list(enumerate(queries))
+    for query, result in zip(queries, results):
+        expected = service.search_chunks(corpus.kb_ids, query, 5, 'keyword')
+        assert [item['chunk']['id'] for item in result['data']] == [chunk.id for chunk in expected], query
+        assert [item['document']['filename'] for item in result['data']] == [
+            chunk.document.original_filename for chunk in expected
+        ]
+
+
+def test_batch_within_one_knowledge_base(client, corpus, service):
+    kb_ids = corpus.kb_ids[1:]
+    queries = corpus.queries(30, seed=13)
+    results = lines(batch(client, kb_ids=kb_ids, queries=queries, max_results=3))
+    for query, result in zip(queries, results):
+        expected = [chunk.id for chunk in service.search_chunks(kb_ids, query, 3, 'keyword')]
+        assert [item['chunk']['id'] for item in result['data']] == expected, query
+
+
+def test_batch_rejects_invalid_requests(client, corpus, monkeypatch):
+    assert batch(client, kb_ids=corpus.kb_ids).status_code == 400
+    assert batch(client, queries=['price']).status_code == 400
+    
+    missing = batch(client, kb_ids=corpus.kb_ids + [999999], queries=['price'])
+    assert missing.status_code == 404 and '999999' in missing.get_json()['error']
+    
+    monkeypatch.setattr(knowledge_base_service, 'BATCH_MAX_QUERIES', 2)
+    assert batch(client, kb_ids=corpus.kb_ids, queries=['a', 'b', 'c']).status_code == 400
+    assert batch(client, kb_ids=corpus.kb_ids, queries=['a', 'b']).status_code == 200
+
+
+def test_a_failure_mid_stream_ends_with_an_error_line(client, corpus, monkeypatch):
+    def failing_batch(self, kb_ids, queries, *args):
+        yield []
+        raise RuntimeError('index unavailable')
+    
+    monkeypatch.setattr(KnowledgeBaseService, 'search_batch', failing_batch)
+    results = lines(batch(client, kb_ids=corpus.kb_ids, queries=['price', 'plan']))
+    assert results == [
+        {'index': 0, 'query': 'price', 'data': []},
+        {'success': False, 'error': 'index unavailable'}
+    ]
@@ -0,0 +1,72 @@
+import math
+from collections import Counter
+from src.models.bot import Document, TextChunk
+
+K1 = 1.2
+B = 0.75
+
+
+def collection(kb_ids):
+    """Chunk keyword counts of the knowledge bases' processed documents, counted from the chunks themselves"""
+    chunks = TextChunk.query.join(Document).filter(
+        Document.knowledge_base_id.in_(kb_ids), Document.processed == True
+    ).all()
+    return {chunk.id: Counter(chunk.keywords.split()) for chunk in chunks}
+
+
+def reference_ranking(chunks, query_plan, k):
+    """Okapi BM25 with half credit for the best partial match of a word missing from the chunk"""
+    total_tokens = sum(sum(counts.values()) for counts in chunks.values())
+    average_length = total_tokens / len(chunks)
+    document_frequencies = Counter(term for counts in chunks.values() for term in counts)
+    
+    def bm25(term, counts):
+        frequency = document_frequencies[term]
+        idf = math.log(1 + (len(chunks) - frequency + 0.5) / (frequency + 0.5))
+        length = sum(counts.values())
+        return idf * counts[term] * (K1 + 1) / (counts[term] + K1 * (1 - B + B * length / average_length))
+    
+    scored = []
+    for chunk_id, counts in chunks.items():
+        score = 0
+        for word, partial_terms in query_plan:
+            if word in counts:
+                score += bm25(word, counts)
+            elif partial_terms & counts.keys():
+                score += 0.5 * max(bm25(term, counts) for term in partial_terms & counts.keys())
+        if score:
+            scored.append((round(score, 9), chunk_id))
+    return [chunk_id for _, chunk_id in sorted(scored, key=lambda entry: (-entry[0], entry[1]))[:k]]
+
+
+def test_statistics_maintained_at_ingest_match_the_chunks(make_corpus, service):
+    corpus = make_corpus(documents=4)
+    corpus.add_document(corpus.kb_ids[0])
+    corpus.delete_document(corpus.document_ids[1])
+    corpus.delete_document(corpus.document_ids[-1])
+    
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1], corpus.kb_ids[1:]):
+        chunks = collection(kb_ids)
+        document_frequencies = Counter(term for counts in chunks.values() for term in counts)
+        total_tokens = sum(sum(counts.values()) for counts in chunks.values())
+        stored = service.search_index.get_collection_stats(kb_ids, set(document_frequencies) | {'zzyzx'})
+        assert stored == (len(chunks), total_tokens, dict(document_frequencies))
+
+
+def test_single_word_rankings_match_reference_bm25(corpus, service):
+    chunks = collection(corpus.kb_ids)
+    vocabulary = {term for counts in chunks.values() for term in counts}
+    for word in [word for word in corpus.words if word in vocabulary][::7]:
+        query_plan, _ = service._build_query_plan(corpus.kb_ids, word)
+        ranking = [chunk.id for chunk in service._search_chunks(corpus.kb_ids, word, 10)]
+        assert ranking == reference_ranking(chunks, query_plan, 10), word
+
+
+def test_rare_words_outweigh_common_ones(corpus, service):
+    chunks = collection(corpus.kb_ids)
+    document_frequencies = Counter(term for counts in chunks.values() for term in counts)
+    common, rare = corpus.words[0], min(document_frequencies, key=lambda term: (document_frequencies[term], term))
+    assert document_frequencies[common] > 10 * document_frequencies[rare]
+    
+    best = service._search_chunks(corpus.kb_ids, f'{common} {rare}', 1)[0]
+    assert rare in best.keywords.split()
@@ -0,0 +1,51 @@
+from src.models.bot import db, Document, TextChunk
+from src.services import search_index as search_index_module
+from src.services.search_index import SearchIndex
+from src.services.text_analysis import extract_keywords
+from src.services.vector_search import HashingEmbedder
+
+
+def chunks_of(kb_ids):
+    return TextChunk.query.join(Document).filter(Document.knowledge_base_id.in_(kb_ids)).order_by(TextChunk.id).all()
+
+
+def test_ingest_stores_each_chunks_analysed_keywords(corpus):
+    chunks = chunks_of(corpus.kb_ids)
+    assert chunks
+    for chunk in chunks:
+        keywords = extract_keywords(chunk.content)
+        assert chunk.keywords.split() == keywords and chunk.token_count == len(keywords), chunk.id
+
+
+def test_reindexing_reads_the_stored_keywords(make_corpus, monkeypatch):
+    corpus = make_corpus(documents=2)
+    
+    def fail(text):
+        raise AssertionError('stored content was analysed again')
+    
+    monkeypatch.setattr(search_index_module, 'extract_keywords', fail)
+    for kb_id in corpus.kb_ids:
+        assert SearchIndex().reindex_knowledge_base(kb_id)['documents']
+
+
+def test_reindexing_backfills_chunks_stored_without_keywords(make_corpus, service):
+    corpus = make_corpus(documents=4)
+    queries = corpus.queries(30, seed=8)
+    rankings = [[chunk.id for chunk in service._search_chunks(corpus.kb_ids, query, 5)] for query in queries]
+    expected = {chunk.id: chunk.keywords for chunk in chunks_of(corpus.kb_ids)}
+    
+    # Chunks stored by versions before keywords were kept
+    TextChunk.query.filter(TextChunk.id.in_(list(expected))).update({'keywords': None}, synchronize_session=False)
+    db.session.commit()
+    db.session.expire_all()
+    
+    for kb_id in corpus.kb_ids:
+        SearchIndex().reindex_knowledge_base(kb_id)
+    assert {chunk.id: chunk.keywords for chunk in chunks_of(corpus.kb_ids)} == expected
+    assert [[chunk.id for chunk in service._search_chunks(corpus.kb_ids, query, 5)] for query in queries] == rankings
+
+
+def test_hashing_embedder_embeds_stored_keywords_like_the_text(corpus):
+    embedder = HashingEmbedder()
+    for chunk in chunks_of(corpus.kb_ids)[:20]:
+        assert embedder.embed_keywords(chunk.content, chunk.keywords.split()) == embedder.embed(chunk.content)
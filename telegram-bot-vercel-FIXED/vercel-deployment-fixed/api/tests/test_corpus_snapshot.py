@@ -0,0 +1,52 @@
+import pytest
+from src.services import index_segments
+from src.services.corpus_snapshot import corpus_snapshots
+
+
+def ranking(service, kb_ids, query, source=None, max_results=5):
+    return [chunk.id for chunk in service._search_chunks(kb_ids, query, max_results, source=source)]
+
+
+@pytest.mark.parametrize('pruning', [False, True])
+def test_snapshot_ranks_like_the_database_index(corpus, service, snapshot, pruning):
+    service.dynamic_pruning = pruning
+    for query in corpus.queries(80):
+        assert ranking(service, corpus.kb_ids, query, snapshot) == ranking(service, corpus.kb_ids, query), query
+
+
+def test_snapshot_ranks_like_the_database_index_within_one_knowledge_base(corpus, service, snapshot):
+    kb_ids = corpus.kb_ids[:1]
+    for query in corpus.queries(40, seed=1):
+        assert ranking(service, kb_ids, query, snapshot) == ranking(service, kb_ids, query), query
+
+
+def test_snapshot_collection_statistics_match_the_database(corpus, service, snapshot):
+    terms = corpus.words[:50] + ['zzyzx']
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[1:]):
+        assert snapshot.get_collection_stats(kb_ids, terms) == service.search_index.get_collection_stats(kb_ids, terms)
+
+
+def test_incremental_updates_rank_like_the_database_index(make_corpus, service, monkeypatch):
+    corpus = make_corpus(documents=2)
+    corpus_snapshots._rebuild(corpus.bot_id)
+    
+    # Each processed document is published as a new segment; background merges combine them
+    for i in range(7):
+        corpus.add_document(corpus.kb_ids[i % 2])
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    assert snapshot is not None and len(snapshot.segments) > 1
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
+    
+    # Deleted documents are tombstoned until a merge drops their chunks
+    deleted = corpus.document_ids[:3]
+    for document_id in deleted:
+        corpus.delete_document(document_id)
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    assert snapshot.tombstones and not any(snapshot.contains_document(document_id) for document_id in deleted)
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
+    
+    monkeypatch.setattr(index_segments, 'MAX_DELETED_RATIO', 0.01)
+    corpus_snapshots._merge(corpus.bot_id)
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    assert not any(snapshot.dead)
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
@@ -0,0 +1,96 @@
+import math
+import threading
+from collections import Counter
+import pytest
+from src.models.bot import Document, TextChunk
+from src.services.search_profile import SearchProfile, active_profile
+
+K1 = 1.2
+B = 0.75
+
+
+def reference_term_scores(kb_ids):
+    """Okapi BM25 of a term in a chunk, from keyword counts of the knowledge bases' processed chunks"""
+    chunks = {
+        chunk.id: Counter(chunk.keywords.split())
+        for chunk in TextChunk.query.join(Document).filter(
+            Document.knowledge_base_id.in_(kb_ids), Document.processed == True
+        )
+    }
+    average_length = sum(sum(counts.values()) for counts in chunks.values()) / len(chunks)
+    document_frequencies = Counter(term for counts in chunks.values() for term in counts)
+    
+    def bm25(term, chunk_id):
+        counts = chunks[chunk_id]
+        idf = math.log(1 + (len(chunks) - document_frequencies[term] + 0.5) / (document_frequencies[term] + 0.5))
+        length = sum(counts.values())
+        return idf * counts[term] * (K1 + 1) / (counts[term] + K1 * (1 - B + B * length / average_length))
+    
+    return bm25
+
+
+def explained(service, kb_ids, query, source=None, max_results=5):
+    with SearchProfile() as profile:
+        chunks = service._search_chunks(kb_ids, query, max_results, source=source)
+    return [chunk.id for chunk in chunks], profile.to_dict()
+
+
+@pytest.mark.parametrize('use_snapshot', [False, True])
+def test_score_breakdowns_add_up_to_the_ranked_scores(corpus, service, snapshot, use_snapshot):
+    bm25 = reference_term_scores(corpus.kb_ids)
+    for query in corpus.queries(40, seed=14):
+        ranking, explain = explained(service, corpus.kb_ids, query, snapshot if use_snapshot else None)
+        assert [result['chunk_id'] for result in explain['results']] == ranking, query
+        
+        for result in explain['results']:
+            terms = result['terms']
+            assert terms and result['score'] == pytest.approx(
+                sum(term['score'] for term in terms) + result['proximity'], abs=1e-4
+            ), query
+            for term in terms:
+                weight = 1.0 if term['match'] == 'exact' else 0.5
+                assert term['score'] == pytest.approx(weight * bm25(term['term'], result['chunk_id']), abs=1e-5)
+                assert (term['term'] == term['word']) == (term['match'] == 'exact')
+            if len(set(query.split())) == 1:
+                assert result['proximity'] == 0
+
+
+def test_explain_reports_the_search_stages(corpus, service):
+    query = ' '.join(corpus.words[:2])
+    ranking, explain = explained(service, corpus.kb_ids, query)
+    stages = {entry['name']: entry for entry in explain['stages']}
+    assert ranking and {'query_plan', 'postings', 'collection_stats', 'explain'} <= set(stages)
+    assert explain['counts']['candidates'] >= len(ranking) and explain['counts']['postings'] > 0
+    assert 0 < sum(entry['sql_queries'] for entry in stages.values()) <= explain['sql_queries']
+    assert all(entry['calls'] >= 1 and entry['wall_ms'] >= 0 for entry in stages.values())
+
+
+def test_only_the_profiled_thread_is_measured(corpus, service):
+    other = threading.Thread(target=lambda: [service._search_chunks(corpus.kb_ids, word, 5) for word in corpus.words[:20]])
+    with SearchProfile() as profile:
+        assert active_profile() is profile
+        other.start()
+        other.join()
+    assert active_profile() is None
+    assert profile.sql_queries == 0 and not profile.results and not profile.stages
+
+
+def test_profiled_bot_searches_bypass_the_cache(corpus, service):
+    query = corpus.words[0]
+    reply = service.search_knowledge_base(corpus.bot_id, query)
+    profile = SearchProfile()
+    assert service.search_knowledge_base(corpus.bot_id, query, profile=profile) == reply
+    assert profile.results and profile.to_dict()['stages']
+
+
+def test_search_route_returns_the_profile_on_request(client, corpus):
+    url = f'/api/knowledge-bases/{corpus.kb_ids[0]}/search'
+    query = ' '.join(corpus.words[:3])
+    plain = client.post(url, json={'query': query}).get_json()
+    explain = client.post(url, json={'query': query, 'explain': True}).get_json()
+    assert 'explain' not in plain and plain['data'] == explain['data']
+    assert [result['chunk_id'] for result in explain['explain']['results']] == [
+        item['chunk']['id'] for item in explain['data']
+    ]
+    assert 'serialize' in {entry['name'] for entry in explain['explain']['stages']}
+    assert 'explain' in client.post(f'{url}?explain=true', json={'query': query}).get_json()
@@ -0,0 +1,58 @@
+import random
+import pytest
+from src.models.bot import db, Document
+from src.services import filename_search
+
+NAME_PARTS = ['annual', 'Report', 'plans', 'invoice', 'Q3', 'summary', '100%', 'draft_v2', 'draft-v1', 'notes', 'ANNUAL']
+
+
+@pytest.fixture
+def kb_id(make_corpus):
+    """A knowledge base of documents with overlapping names, in mixed case and with LIKE wildcards"""
+    corpus = make_corpus(knowledge_bases=1, documents=0)
+    rng = random.Random(0)
+    for i in range(60):
+        name = rng.choice(['-', '_', ' ']).join(rng.sample(NAME_PARTS, rng.randint(1, 3))) + rng.choice(['.pdf', '.txt'])
+        db.session.add(Document(filename=f'{i}_{name.lower().replace(" ", "_")}', original_filename=name,
+                                file_path=name, file_type='txt', file_size=1, knowledge_base_id=corpus.kb_ids[0]))
+    db.session.commit()
+    return corpus.kb_ids[0]
+
+
+QUERIES = ['annual', 'REPORT', 'plans-', 'q3 ', 'draft_v', '100%', '0%', 'summary.pdf', 'nomatch', 'an', '_']
+
+
+def search(service, kb_id, query, page, per_page):
+    documents, total = service.search_documents(kb_id, query, page, per_page)
+    return [document.id for document in documents], total
+
+
+def like_scan(monkeypatch):
+    """Search without the trigram index, as on a database where it could not be installed"""
+    monkeypatch.setattr(filename_search, '_installed', set())
+
+
+def test_trigram_search_finds_what_a_like_scan_finds(kb_id, service, monkeypatch):
+    assert 'sqlite' in filename_search._installed
+    indexed = {query: search(service, kb_id, query, 1, 100) for query in QUERIES}
+    like_scan(monkeypatch)
+    for query in QUERIES:
+        ranking, total = indexed[query]
+        scanned, scanned_total = search(service, kb_id, query, 1, 100)
+        assert sorted(ranking) == sorted(scanned) and total == scanned_total == len(ranking), query
+    assert indexed['annual'][1] and not indexed['nomatch'][1]
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_pages_cover_the_ranking_once(kb_id, service, monkeypatch, indexed):
+    if not indexed:
+        like_scan(monkeypatch)
+    for query in QUERIES:
+        ranking, total = search(service, kb_id, query, 1, 100)
+        pages = []
+        for page in range(1, total // 7 + 2):
+            ids, page_total = search(service, kb_id, query, page, 7)
+            assert page_total == total, (query, page)
+            pages.extend(ids)
+        assert pages == ranking, query
+        assert search(service, kb_id, query, total // 7 + 3, 7) == ([], total), query
@@ -0,0 +1,86 @@
+import re
+from sqlalchemy import create_engine, text
+from src.models.bot import db, Document, TextChunk
+from src.services.fulltext_search import FullTextSearchBackend, install_fulltext_search
+
+
+def words_of(chunk):
+    """Words as the FTS5 default tokenizer splits them"""
+    return set(re.findall(r'\w+', chunk.content.lower()))
+
+
+def bm25_scores(query_words):
+    """SQLite's bm25() of every chunk matching any query word (lower is better)"""
+    match = ' OR '.join(f'"{word}"' for word in sorted(set(query_words)))
+    rows = db.session.execute(text(
+        "SELECT rowid, bm25(text_chunk_fts) FROM text_chunk_fts WHERE text_chunk_fts MATCH :match"
+    ), {'match': match}).all()
+    return dict(rows)
+
+
+def processed_chunks(kb_ids):
+    return TextChunk.query.join(Document).filter(
+        Document.knowledge_base_id.in_(kb_ids), Document.processed == True
+    ).all()
+
+
+def test_database_matches_the_chunks_containing_any_query_word(corpus):
+    backend = FullTextSearchBackend()
+    assert backend.is_available()
+    chunks = processed_chunks(corpus.kb_ids)
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1]):
+        for query in corpus.queries(40, seed=10):
+            query_words = query.split()
+            expected = {
+                chunk.id for chunk in chunks
+                if chunk.document.knowledge_base_id in kb_ids and words_of(chunk) & set(query_words)
+            }
+            ranked = backend.search(kb_ids, query_words, 10000)
+            assert set(ranked) == expected, query
+            
+            # Ranked by the database, and the limit cuts that ranking
+            scores = bm25_scores(query_words)
+            assert [scores[chunk_id] for chunk_id in ranked] == sorted(scores[chunk_id] for chunk_id in ranked), query
+            assert backend.search(kb_ids, query_words, 3) == ranked[:3]
+
+
+def test_fulltext_backend_loads_the_ranked_chunks(corpus, service):
+    for query in corpus.queries(20, seed=11):
+        chunks = service.search_chunks(corpus.kb_ids, query, 5, 'fulltext')
+        expected = FullTextSearchBackend().search(corpus.kb_ids, service._extract_keywords(query), 5)
+        assert [chunk.id for chunk in chunks] == expected, query
+
+
+def test_deleted_and_unprocessed_documents_are_not_matched(make_corpus):
+    corpus = make_corpus(documents=2)
+    deleted_id, unprocessed_id = corpus.document_ids[:2]
+    deleted = {chunk.id for chunk in TextChunk.query.filter_by(document_id=deleted_id)}
+    word_counts = {}
+    for chunk in processed_chunks(corpus.kb_ids):
+        for word in words_of(chunk):
+            word_counts[word] = word_counts.get(word, 0) + 1
+    corpus.delete_document(deleted_id)
+    
+    document = Document.query.get(unprocessed_id)
+    document.processed = False
+    db.session.commit()
+    unprocessed = {chunk.id for chunk in document.chunks}
+    
+    found = set(FullTextSearchBackend().search(corpus.kb_ids, list(word_counts), 10000))
+    assert deleted and unprocessed and not found & (deleted | unprocessed)
+
+
+def test_install_indexes_existing_chunks(app, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'existing.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO text_chunk (id, content, chunk_index, token_count, document_id) "
+            "VALUES (1, 'Annual plans renew every year', 0, 4, 1)"
+        ))
+    
+    assert install_fulltext_search(engine) and install_fulltext_search(engine)
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT rowid FROM text_chunk_fts WHERE text_chunk_fts MATCH 'renew'")).all()
+    assert rows == [(1,)]
+    engine.dispose()
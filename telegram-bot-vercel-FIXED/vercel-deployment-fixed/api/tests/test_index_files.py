@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.index_files import FORMAT_VERSION, IndexStore, MappedSegment, index_store
+
+
+def test_cold_instance_maps_the_stored_index(make_corpus, service, new_instance):
+    corpus = make_corpus(documents=4)
+    corpus_snapshots._rebuild(corpus.bot_id)
+    built = corpus_snapshots.get(corpus.bot_id)
+    
+    snapshot = new_instance().open_stored(corpus.bot_id)
+    assert snapshot is not None
+    assert all(isinstance(segment, MappedSegment) for segment in snapshot.segments)
+    assert snapshot.chunk_count == built.chunk_count
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
+    
+    words = corpus.words[:30]
+    assert snapshot.get_collection_stats(corpus.kb_ids, words) == built.get_collection_stats(corpus.kb_ids, words)
+    for word in ('zzyzx', corpus.words[0][:-1] + 'q', corpus.words[5][1:]):
+        assert snapshot.correct_term(corpus.kb_ids, word) == built.correct_term(corpus.kb_ids, word)
+
+
+def test_empty_bot_index_is_stored(make_corpus, new_instance):
+    corpus = make_corpus(documents=0)
+    corpus_snapshots._rebuild(corpus.bot_id)
+    assert index_store.has(corpus.bot_id)
+    
+    snapshot = new_instance().open_stored(corpus.bot_id)
+    assert snapshot is not None and snapshot.chunk_count == 0
+
+
+def test_index_files_of_another_format_are_ignored(make_corpus, new_instance):
+    corpus = make_corpus(documents=1)
+    corpus_snapshots._rebuild(corpus.bot_id)
+    path = index_store._manifest_path(corpus.bot_id)
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['format'] = FORMAT_VERSION + 1
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    
+    assert new_instance().open_stored(corpus.bot_id) is None
+
+
+def test_instances_write_the_manifest_concurrently(tmp_path):
+    # Separate stores over one directory, as in separate processes: their locks do not exclude each other
+    stores = [IndexStore(str(tmp_path)) for _ in range(8)]
+    errors = []
+    
+    def write(store, writer):
+        try:
+            for i in range(100):
+                store._write_manifest(1, {'format': FORMAT_VERSION, 'writer': writer, 'segments': [f'{i}.seg']})
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=write, args=(store, writer)) for writer, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert not errors
+    with open(stores[0]._manifest_path(1)) as f:
+        assert json.load(f)['segments'] == ['99.seg']
+    assert os.listdir(os.path.dirname(stores[0]._manifest_path(1))) == ['manifest.json']
@@ -0,0 +1,68 @@
+import random
+from collections import namedtuple
+from src.models.bot import Document, TextChunk
+from src.services.knowledge_base_service import COLLAPSE_OVERFETCH
+from src.services.snippets import collapse_neighbours, join_overlapping
+
+FakeChunk = namedtuple('FakeChunk', 'id document_id chunk_index content')
+
+
+def document_chunks(document_id):
+    return TextChunk.query.filter_by(document_id=document_id).order_by(TextChunk.chunk_index).all()
+
+
+def test_joining_a_documents_chunks_restores_its_text(corpus, processor):
+    for document_id in corpus.document_ids:
+        chunks = document_chunks(document_id)
+        assert len(chunks) > 1
+        content = chunks[0].content
+        for chunk in chunks[1:]:
+            content = join_overlapping(content, chunk.content)
+        with open(Document.query.get(document_id).file_path) as f:
+            assert content == processor._clean_text(f.read()), document_id
+
+
+def test_text_without_a_common_overlap_is_joined_with_a_space():
+    assert join_overlapping('Annual plans renew.', 'Monthly plans do not.') == 'Annual plans renew. Monthly plans do not.'
+    assert join_overlapping('plans renew every year', 'every year on the first') == 'plans renew every year on the first'
+
+
+def test_collapse_merges_runs_of_neighbours_ranked_by_their_best_chunk():
+    rng = random.Random(0)
+    for _ in range(300):
+        chunks = {
+            (document_id, chunk_index): FakeChunk(document_id * 100 + chunk_index, document_id, chunk_index,
+                                                  f'd{document_id}c{chunk_index}')
+            for document_id in range(3) for chunk_index in range(12)
+        }
+        ranking = rng.sample(list(chunks.values()), rng.randint(1, 20))
+        ranking += rng.choices(ranking, k=rng.randint(0, 3))  # Repeated results are shown once
+        spans = collapse_neighbours(ranking)
+        
+        # Every ranked chunk is in exactly one span, and spans of a document neither touch nor overlap
+        covered = sorted((span.document_id, index) for span in spans
+                         for index in range(span.chunk_index, span.last_chunk_index + 1))
+        assert covered == sorted({(chunk.document_id, chunk.chunk_index) for chunk in ranking})
+        
+        # Spans are ranked by (and named after) their best chunk; text follows the document order
+        first_rank = {}
+        for rank, chunk in enumerate(ranking):
+            first_rank.setdefault(chunk.id, rank)
+        for span in spans:
+            members = [chunks[(span.document_id, index)] for index in range(span.chunk_index, span.last_chunk_index + 1)]
+            assert span.id == min(members, key=lambda chunk: first_rank[chunk.id]).id
+            assert span.content == ' '.join(member.content for member in members)
+        assert [first_rank[span.id] for span in spans] == sorted(first_rank[span.id] for span in spans)
+
+
+def test_replies_show_distinct_results(corpus, service):
+    for query in corpus.queries(40, seed=15):
+        chunks = service._search_chunks(corpus.kb_ids, query, 5 * COLLAPSE_OVERFETCH)
+        spans = service._collapse_neighbours(chunks, 5)
+        assert len(spans) <= 5 and (not chunks or spans[0].id == chunks[0].id), query
+        for span in spans:
+            members = document_chunks(span.document_id)[span.chunk_index:span.last_chunk_index + 1]
+            assert all(member.content in span.content for member in members)
+            assert span.document.id == span.document_id
+        neighbours = {(span.document_id, index) for span in spans for index in (span.chunk_index - 1, span.last_chunk_index + 1)}
+        assert not neighbours & {(span.document_id, span.chunk_index) for span in spans}, query
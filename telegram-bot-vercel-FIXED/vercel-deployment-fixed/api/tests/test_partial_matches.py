@@ -0,0 +1,55 @@
+import random
+from src.models.bot import Document, TermStatistic, TextChunk
+from src.services.search_index import MIN_PARTIAL_LENGTH, NgramIndex
+
+
+def reference_partial_matches(vocabulary, word):
+    return {
+        term for term in vocabulary
+        if term != word and (word in term or (term in word and len(term) >= MIN_PARTIAL_LENGTH))
+    }
+
+
+def fragments(words, count, seed=0):
+    """Substrings of vocabulary words, and words with letters added around them"""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        word = rng.choice(words)
+        if rng.random() < 0.5 and len(word) > 3:
+            start = rng.randrange(len(word) - 2)
+            result.append(word[start:rng.randint(start + 3, len(word))])
+        else:
+            result.append(rng.choice(['', 'ka', 'zo']) + word + rng.choice(['', 'ri', 'stu']))
+    return result
+
+
+def test_ngram_index_finds_every_partial_match(corpus):
+    index = NgramIndex(corpus.words)
+    for word in fragments(corpus.words, 500) + ['zzyzx', 'aaa']:
+        assert index.partial_matches(word) == reference_partial_matches(corpus.words, word), word
+
+
+def test_knowledge_base_partial_terms_cover_its_vocabulary(corpus, service, snapshot):
+    vocabularies = {kb_id: set() for kb_id in corpus.kb_ids}
+    for term, kb_id in TermStatistic.query.with_entities(TermStatistic.term, TermStatistic.knowledge_base_id):
+        if kb_id in vocabularies:
+            vocabularies[kb_id].add(term)
+    for word in fragments(corpus.words, 200, seed=1):
+        for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1]):
+            vocabulary = set().union(*(vocabularies[kb_id] for kb_id in kb_ids))
+            expected = reference_partial_matches(vocabulary, word)
+            assert service.search_index.find_partial_terms(kb_ids, word) == expected, word
+            assert snapshot.find_partial_terms(kb_ids, word) == expected, word
+
+
+def test_chunks_with_only_a_partial_match_are_found(corpus, service):
+    chunks = TextChunk.query.join(Document).filter(Document.knowledge_base_id.in_(corpus.kb_ids)).all()
+    vocabulary = {term for chunk in chunks for term in chunk.keywords.split()}
+    partial_only = 0
+    for word in sorted(vocabulary)[::5]:
+        partial_terms = reference_partial_matches(vocabulary, word) if len(word) > 3 else set()
+        expected = {chunk.id for chunk in chunks if ({word} | partial_terms) & set(chunk.keywords.split())}
+        assert {chunk.id for chunk in service._search_chunks(corpus.kb_ids, word, 1000)} == expected, word
+        partial_only += len(expected) - sum(word in chunk.keywords.split() for chunk in chunks)
+    assert partial_only
@@ -0,0 +1,96 @@
+import random
+import pytest
+from src.models.bot import Document, TextChunk
+from src.services.question_index import QuestionIndex
+from src.services.search_cache import normalize_query
+from src.services.text_analysis import decode_positions, encode_positions, parse_phrases
+
+
+def phrase_queries(corpus, count, seed=0):
+    """Quoted two-word phrases taken from the corpus chunks, with the id of a chunk containing each"""
+    chunks = TextChunk.query.join(Document).filter(Document.knowledge_base_id.in_(corpus.kb_ids)).all()
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        chunk = rng.choice(chunks)
+        keywords = chunk.keywords.split()
+        i = rng.randrange(len(keywords) - 1)
+        queries.append((' '.join(keywords[i:i + 2]), chunk.id))
+    return queries
+
+
+def contains_phrase(chunk, phrase):
+    return f' {phrase} ' in f' {chunk.keywords} '
+
+
+@pytest.mark.parametrize('positions', [[], [0], [3, 4, 5], [1, 200, 70000, 70001], list(range(0, 5000, 7))])
+def test_positions_round_trip(positions):
+    assert decode_positions(encode_positions(positions)) == positions
+
+
+def test_parse_phrases():
+    assert parse_phrases('"Annual plans" of "the company" cost "price"') == [['annual', 'plans']]
+    assert parse_phrases('annual plans') == []
+
+
+@pytest.mark.parametrize('pruning', [False, True])
+def test_phrase_results_contain_the_phrase(corpus, service, snapshot, pruning):
+    service.dynamic_pruning = pruning
+    for phrase, chunk_id in phrase_queries(corpus, 40):
+        query = f'"{phrase}"'
+        for source in (snapshot, None):
+            results = service._search_chunks(corpus.kb_ids, query, 100, source=source)
+            assert chunk_id in [chunk.id for chunk in results], query
+            loaded = TextChunk.query.filter(TextChunk.id.in_([chunk.id for chunk in results])).all()
+            assert all(contains_phrase(chunk, phrase) for chunk in loaded), query
+
+
+def test_phrase_results_are_a_subset_of_loose_results(corpus, service, snapshot):
+    for phrase, _ in phrase_queries(corpus, 40, seed=1):
+        for source in (snapshot, None):
+            phrase_results = {chunk.id for chunk in service._search_chunks(corpus.kb_ids, f'"{phrase}"', 1000, source=source)}
+            loose_results = {chunk.id for chunk in service._search_chunks(corpus.kb_ids, phrase, 1000, source=source)}
+            assert phrase_results <= loose_results, phrase
+
+
+def test_phrase_search_ranks_alike_on_the_snapshot_and_the_database(corpus, service, snapshot):
+    rng = random.Random(2)
+    for phrase, _ in phrase_queries(corpus, 40, seed=2):
+        query = f'"{phrase}" {rng.choice(corpus.words[:100])}'
+        snapshot_ranking = [chunk.id for chunk in service._search_chunks(corpus.kb_ids, query, 5, source=snapshot)]
+        database_ranking = [chunk.id for chunk in service._search_chunks(corpus.kb_ids, query, 5)]
+        assert snapshot_ranking == database_ranking, query
+
+
+def test_phrase_queries_are_cached_apart_from_loose_queries():
+    assert normalize_query('"Annual plans" price?') != normalize_query('annual plans price')
+    assert normalize_query('"annual  plans" price') == normalize_query('"Annual plans" Price!')
+    assert normalize_query('"annual plans" "monthly fees"') != normalize_query('"annual plans monthly fees"')
+
+
+def test_phrase_questions_do_not_reuse_loose_answers(corpus):
+    questions = QuestionIndex()
+    questions.add(corpus.bot_id, 'how much do the annual plans cost', 'loose answer')
+    assert questions.lookup(corpus.bot_id, 'how much do "annual plans" cost') is None
+    assert questions.lookup(corpus.bot_id, 'How much do the annual plans cost?') == 'loose answer'
+    
+    questions.add(corpus.bot_id, 'how much do "annual plans" cost', 'phrase answer')
+    assert questions.lookup(corpus.bot_id, 'how much do the "annual plans" cost') == 'phrase answer'
+    assert questions.lookup(corpus.bot_id, 'how much do the annual plans cost') == 'loose answer'
+
+
+@pytest.mark.parametrize('max_results', [5, 20])
+def test_sparse_backend_ranks_phrase_and_multi_word_queries_like_keyword_search(corpus, service, max_results):
+    rng = random.Random(3)
+    queries = [f'"{phrase}"' for phrase, _ in phrase_queries(corpus, 20, seed=3)]
+    queries += [f'{rng.choice(corpus.words[:50])} "{phrase}"' for phrase, _ in phrase_queries(corpus, 20, seed=4)]
+    queries += [query for query in corpus.queries(60, seed=5) if len(query.split()) > 1]
+    
+    def ranking(chunks):
+        return [chunk.id for chunk in chunks]
+    
+    keyword = [ranking(service.search_chunks(corpus.kb_ids, query, max_results, 'keyword')) for query in queries]
+    sparse = [ranking(service.search_chunks(corpus.kb_ids, query, max_results, 'sparse')) for query in queries]
+    batch = [ranking(chunks) for chunks in service.search_batch(corpus.kb_ids, queries, max_results, 'sparse')]
+    for query, expected, single, batched in zip(queries, keyword, sparse, batch):
+        assert single == expected and batched == expected, query
@@ -0,0 +1,63 @@
+from sqlalchemy import text
+from src.models.user import db
+from src.models.bot import Conversation
+from src.services.question_index import QuestionIndex
+
+
+def log(bot_id, message, response, reusable):
+    db.session.add(Conversation(telegram_user_id='1', message=message, response=response, reusable=reusable,
+                                bot_id=bot_id))
+    db.session.commit()
+
+
+def test_reworded_questions_reuse_logged_answers(make_corpus):
+    corpus = make_corpus(documents=0)
+    log(corpus.bot_id, 'How do the annual plans work?', 'Annual plans renew every year.', True)
+    
+    questions = QuestionIndex()
+    assert questions.lookup(corpus.bot_id, 'how do annual plans work') == 'Annual plans renew every year.'
+    assert questions.lookup(corpus.bot_id, 'where is the office') is None
+
+
+def test_only_reusable_answers_are_seeded(make_corpus):
+    corpus = make_corpus(documents=0)
+    log(corpus.bot_id, 'What does the refund policy say?', "Sorry, I couldn't find an answer.", False)
+    log(corpus.bot_id, 'Which payment methods are accepted?', 'Cards (partial results)', False)
+    log(corpus.bot_id, '/start', 'Welcome!', False)
+    
+    questions = QuestionIndex()
+    assert questions.lookup(corpus.bot_id, 'what does the refund policy say') is None
+    assert questions.lookup(corpus.bot_id, 'which payment methods are accepted') is None
+
+
+def test_answers_are_forgotten_when_the_corpus_changes(make_corpus):
+    corpus = make_corpus(documents=0)
+    questions = QuestionIndex()
+    version = questions.version(corpus.bot_id)
+    questions.invalidate_bot(corpus.bot_id)
+    questions.add(corpus.bot_id, 'how do annual plans work', 'stale answer', version)
+    assert questions.lookup(corpus.bot_id, 'how do annual plans work') is None
+    
+    questions.add(corpus.bot_id, 'how do annual plans work', 'current answer', questions.version(corpus.bot_id))
+    assert questions.lookup(corpus.bot_id, 'how do annual plans work') == 'current answer'
+    questions.invalidate_bot(corpus.bot_id)
+    assert questions.lookup(corpus.bot_id, 'how do annual plans work') is None
+
+
+
+def test_answers_are_forgotten_when_another_instance_changes_the_corpus(make_corpus):
+    corpus = make_corpus(documents=0)
+    checked = QuestionIndex(recheck_seconds=0)
+    cached = QuestionIndex(recheck_seconds=3600)
+    for questions in (checked, cached):
+        questions.add(corpus.bot_id, 'how do annual plans work', 'stale answer', questions.version(corpus.bot_id))
+    
+    # Another instance indexed a document: only the knowledge base row tells this one
+    db.session.execute(text('UPDATE knowledge_base SET index_generation = index_generation + 1 WHERE id = :kb_id'),
+                       {'kb_id': corpus.kb_ids[1]})
+    db.session.commit()
+    assert checked.lookup(corpus.bot_id, 'how do annual plans work') is None
+    assert cached.lookup(corpus.bot_id, 'how do annual plans work') == 'stale answer'
+    
+    checked.add(corpus.bot_id, 'how do annual plans work', 'current answer', checked.version(corpus.bot_id))
+    assert checked.lookup(corpus.bot_id, 'how do annual plans work') == 'current answer'
@@ -0,0 +1,69 @@
+from flask import Flask
+from sqlalchemy import create_engine, inspect, text
+from src.models.user import db
+from src.services.schema_upgrade import upgrade_schema
+from src.startup import initialize_app
+
+# Columns added to existing tables by the search work, as an earlier version would lack them
+ADDED_COLUMNS = [
+    ('bot', 'search_backend'),
+    ('bot', 'answer_filter'),
+    ('knowledge_base', 'indexed_chunks'),
+    ('knowledge_base', 'index_generation'),
+    ('conversation', 'reusable'),
+]
+
+
+def test_missing_columns_are_added_once(app, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table, column in ADDED_COLUMNS:
+            connection.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        connection.execute(text("INSERT INTO bot (id, name, token, username) VALUES (1, 'Old bot', 'token', 'old_bot')"))
+        connection.execute(text("INSERT INTO knowledge_base (id, name, bot_id, indexed_tokens) VALUES (1, 'Old', 1, 0)"))
+    
+    added = upgrade_schema(engine)
+    assert sorted(added) == sorted(f'{table}.{column}' for table, column in ADDED_COLUMNS)
+    for table, column in ADDED_COLUMNS:
+        assert column in {existing['name'] for existing in inspect(engine).get_columns(table)}
+    
+    # Existing rows get the column defaults
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT indexed_chunks, index_generation FROM knowledge_base')).one() == (0, 0)
+        assert connection.execute(text('SELECT search_backend, answer_filter FROM bot')).one() == ('keyword', None)
+    
+    assert upgrade_schema(engine) == []
+    engine.dispose()
+
+
+def test_startup_reindexes_databases_without_search_indexing(app, tmp_path):
+    path = tmp_path / 'unindexed.db'
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table, column in ADDED_COLUMNS:
+            connection.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        connection.execute(text("INSERT INTO bot (id, name, token, username) VALUES (1, 'Old bot', 'token', 'old_bot')"))
+        connection.execute(text("INSERT INTO knowledge_base (id, name, bot_id, indexed_tokens) VALUES (1, 'Old', 1, 0)"))
+        connection.execute(text(
+            "INSERT INTO document (id, filename, original_filename, file_path, file_type, file_size, knowledge_base_id, processed) "
+            "VALUES (1, 'plans.txt', 'plans.txt', 'plans.txt', 'txt', 10, 1, 1)"
+        ))
+        connection.execute(text(
+            "INSERT INTO text_chunk (content, chunk_index, token_count, document_id) VALUES "
+            "('Annual plans are billed once a year', 0, 0, 1), ('Monthly plans can be cancelled at any time', 1, 0, 1)"
+        ))
+    engine.dispose()
+    
+    upgraded = Flask(__name__)
+    upgraded.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(upgraded)
+    initialize_app(upgraded)
+    
+    with upgraded.app_context():
+        assert db.session.execute(text('SELECT indexed_chunks FROM knowledge_base')).scalar() == 2
+        assert db.session.execute(text("SELECT COUNT(*) FROM term_posting WHERE term = 'annual'")).scalar() == 1
+        assert 'search-index' in upgraded.cli.commands
+        db.session.remove()
+        db.engine.dispose()
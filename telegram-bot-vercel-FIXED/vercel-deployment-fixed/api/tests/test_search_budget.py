@@ -0,0 +1,53 @@
+import pytest
+from src.services import knowledge_base_service
+from src.services.search_budget import SearchDeadline, SearchMetrics, search_metrics
+from src.services.search_cache import search_cache
+
+
+def common_query(corpus):
+    """The corpus' most frequent words, matching most chunks"""
+    return ' '.join(corpus.words[:3])
+
+
+def test_deadline_without_a_budget_never_expires():
+    deadline = SearchDeadline(None)
+    assert not deadline.expired() and deadline.remaining() is None and not deadline.partial
+    
+    spent = SearchDeadline(1e-9)
+    assert spent.expired() and spent.partial and spent.remaining() == 0.0
+    assert SearchDeadline(60).remaining() > 59
+
+
+def test_metrics_report_partial_rate_and_latency_percentiles():
+    metrics = SearchMetrics(samples=100)
+    for ms in range(1, 201):
+        metrics.record(ms / 1000, partial=ms % 4 == 0)
+    stats = metrics.stats()
+    assert stats['searches'] == 200 and stats['partial_searches'] == 50 and stats['partial_rate'] == 0.25
+    # Only the most recent samples are kept
+    assert stats['latency_ms'] == {'p50': 151.0, 'p95': 196.0, 'p99': 200.0, 'max': 200.0}
+    assert SearchMetrics().stats()['latency_ms']['max'] == 0
+
+
+@pytest.mark.parametrize('pruning', [False, True])
+def test_partial_results_are_counted_and_not_cached(make_corpus, service, monkeypatch, pruning):
+    corpus = make_corpus(documents=4)
+    service.dynamic_pruning = pruning
+    monkeypatch.setattr(knowledge_base_service, 'CHECK_INTERVAL', 1)
+    query = common_query(corpus)
+    before = search_metrics.stats()
+    
+    deadline = SearchDeadline(1e-9)
+    service.search_knowledge_base(corpus.bot_id, query, deadline=deadline)
+    assert deadline.partial
+    assert search_cache.get(corpus.bot_id, query, service.max_results) == (False, None)
+    after = search_metrics.stats()
+    assert after['searches'] == before['searches'] + 1 and after['partial_searches'] == before['partial_searches'] + 1
+    
+    # Within the budget the full answer is returned, and cached
+    deadline = SearchDeadline(60)
+    reply = service.search_knowledge_base(corpus.bot_id, query, deadline=deadline)
+    assert not deadline.partial and reply is not None
+    assert search_cache.get(corpus.bot_id, query, service.max_results) == (True, reply)
+    search_cache.invalidate_bot(corpus.bot_id)
+    assert service.search_knowledge_base(corpus.bot_id, query) == reply
@@ -0,0 +1,98 @@
+import pytest
+from src.services import search_cache as search_cache_module
+from src.services.search_cache import ENTRY_OVERHEAD_BYTES, SearchCache, normalize_query, search_cache
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+def test_trivially_different_queries_share_an_entry():
+    cache = SearchCache()
+    cache.set(1, 'What does the annual plan cost?', 5, 'reply')
+    assert cache.get(1, 'what does the  ANNUAL plan cost', 5) == (True, 'reply')
+    assert cache.get(1, 'what does the annual plan cost', 3) == (False, None)
+    assert cache.get(2, 'what does the annual plan cost', 5) == (False, None)
+    assert cache.get(1, 'what does the annual plan cost', 5, scope='pdf') == (False, None)
+    assert normalize_query('Price, please!') == 'price please'
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = SearchCache(max_entries=3)
+    for query in ('first', 'second', 'third'):
+        cache.set(1, query, 5, query)
+    assert cache.get(1, 'first', 5) == (True, 'first')
+    cache.set(1, 'fourth', 5, 'fourth')
+    
+    assert cache.get(1, 'second', 5) == (False, None)
+    assert all(cache.get(1, query, 5)[0] for query in ('first', 'third', 'fourth'))
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_are_bounded_by_bytes():
+    cache = SearchCache(max_bytes=4 * (ENTRY_OVERHEAD_BYTES + 2000))
+    for i in range(10):
+        cache.set(1, f'query {i}', 5, 'x' * 1900)
+    stats = cache.stats()
+    assert 0 < stats['entries'] < 10 and stats['bytes'] <= stats['max_bytes']
+    
+    # A value larger than the whole cache is not stored and evicts nothing
+    cache.set(1, 'huge', 5, 'x' * stats['max_bytes'])
+    assert cache.get(1, 'huge', 5) == (False, None) and cache.stats()['entries'] == stats['entries']
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(search_cache_module.time, 'monotonic', clock)
+    cache = SearchCache(ttl_seconds=60)
+    cache.set(1, 'price', 5, 'reply')
+    
+    clock.now += 59
+    assert cache.get(1, 'price', 5) == (True, 'reply')
+    clock.now += 2
+    assert cache.get(1, 'price', 5) == (False, None)
+    assert cache.stats()['expirations'] == 1 and cache.stats()['entries'] == 0
+
+
+def test_invalidation_drops_only_the_bots_entries_and_stale_results():
+    cache = SearchCache()
+    cache.set(1, 'price', 5, 'first bot')
+    cache.set(2, 'price', 5, 'second bot')
+    version = cache.version(1)
+    
+    assert cache.invalidate_bot(1) == 1
+    assert cache.get(1, 'price', 5) == (False, None)
+    assert cache.get(2, 'price', 5) == (True, 'second bot')
+    
+    # A search that started before the invalidation cannot store its result
+    cache.set(1, 'price', 5, 'stale', version=version)
+    assert cache.get(1, 'price', 5) == (False, None)
+    cache.set(1, 'price', 5, 'fresh', version=cache.version(1))
+    assert cache.get(1, 'price', 5) == (True, 'fresh')
+
+
+@pytest.mark.parametrize('change', ['add', 'delete'])
+def test_ingest_and_delete_invalidate_cached_replies(make_corpus, service, change):
+    corpus = make_corpus(documents=2)
+    queries = [query for query in corpus.queries(20, seed=7) if service.search_knowledge_base(corpus.bot_id, query)]
+    assert queries and all(search_cache.get(corpus.bot_id, query, 5)[0] for query in queries)
+    version = search_cache.version(corpus.bot_id)
+    
+    if change == 'add':
+        corpus.add_document(corpus.kb_ids[0], sentences=60)
+    else:
+        corpus.delete_document(corpus.document_ids[0])
+    
+    assert search_cache.version(corpus.bot_id) > version
+    assert not any(search_cache.get(corpus.bot_id, query, 5)[0] for query in queries)
+    
+    # Replies after the change are those of the changed corpus
+    replies = [service.search_knowledge_base(corpus.bot_id, query) for query in queries]
+    search_cache.invalidate_bot(corpus.bot_id)
+    assert replies == [service.search_knowledge_base(corpus.bot_id, query) for query in queries]
@@ -0,0 +1,133 @@
+import random
+from datetime import date, datetime, timedelta
+import pytest
+from src.models.bot import db, Document, TextChunk
+from src.services.bitmaps import Bitmap
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.search_filters import SearchFilter
+
+FILE_TYPES = ['txt', 'pdf', 'docx']
+FIRST_UPLOAD = datetime(2024, 3, 1, 9, 30)
+
+
+def random_values(rng):
+    """Sparse, clustered or dense values across several 16-bit containers"""
+    kind = rng.choice(['sparse', 'clustered', 'dense'])
+    if kind == 'sparse':
+        return rng.sample(range(300000), rng.randint(0, 500))
+    if kind == 'clustered':
+        start = rng.randrange(200000)
+        return rng.sample(range(start, start + 10000), rng.randint(1, 6000))
+    return rng.sample(range(70000), rng.randint(10000, 20000))
+
+
+@pytest.fixture
+def filtered_corpus(make_corpus):
+    """A corpus whose documents have different file types and were uploaded on different days"""
+    corpus = make_corpus(documents=9)
+    for i, document_id in enumerate(corpus.document_ids):
+        document = db.session.get(Document, document_id)
+        document.file_type = FILE_TYPES[i % 3]
+        document.created_at = FIRST_UPLOAD + timedelta(days=i // 2, hours=i)
+    db.session.commit()
+    corpus_snapshots._rebuild(corpus.bot_id)
+    return corpus
+
+
+def filters(corpus):
+    days = [FIRST_UPLOAD.date() + timedelta(days=offset) for offset in range(-1, 6)]
+    rng = random.Random(16)
+    search_filters = [
+        SearchFilter(file_types=['pdf']),
+        SearchFilter(file_types=['.DOCX', 'txt']),
+        SearchFilter(file_types=['rtf']),
+        SearchFilter(kb_ids=corpus.kb_ids[:1], file_types=['txt']),
+        SearchFilter(uploaded_after=days[2]),
+        SearchFilter(uploaded_before=days[3]),
+        SearchFilter(uploaded_after=days[1], uploaded_before=days[3]),
+        SearchFilter(uploaded_after=days[3], uploaded_before=days[4]),
+    ]
+    for _ in range(12):
+        first, last = sorted(rng.sample(days, 2))
+        search_filters.append(SearchFilter(rng.choice([None, corpus.kb_ids[1:]]), rng.sample(FILE_TYPES, 2), first, last))
+    return search_filters
+
+
+def allowed_documents(search_filter, kb_ids):
+    """Ids of the documents a filter allows, checked one by one"""
+    first, last = search_filter.day_range()
+    return {
+        document.id for document in Document.query.filter(Document.knowledge_base_id.in_(search_filter.narrow(kb_ids)))
+        if (search_filter.file_types is None or document.file_type in search_filter.file_types)
+        and first <= document.created_at.date().toordinal() <= last
+    }
+
+
+def test_bitmaps_behave_like_sets():
+    rng = random.Random(0)
+    for _ in range(30):
+        first, second = set(random_values(rng)), set(random_values(rng))
+        first_bitmap, second_bitmap = Bitmap(first), Bitmap(second)
+        assert list(first_bitmap) == sorted(first) and len(first_bitmap) == len(first)
+        assert list(first_bitmap & second_bitmap) == sorted(first & second)
+        assert list(first_bitmap | second_bitmap) == sorted(first | second)
+        assert list(Bitmap.union_all([first_bitmap, second_bitmap, Bitmap()])) == sorted(first | second)
+        
+        values = sorted(set(random_values(rng)))
+        assert first_bitmap.select(values) == [i for i, value in enumerate(values) if value in first]
+        assert all((value in first_bitmap) == (value in first) for value in values[:200])
+
+
+def test_filters_are_parsed_and_validated():
+    assert SearchFilter.from_dict(None) is None and SearchFilter.from_dict({'file_types': []}) is None
+    search_filter = SearchFilter.from_dict({'kb_ids': ['3'], 'file_types': ['.PDF'], 'uploaded_after': '2024-03-01',
+                                            'uploaded_before': '2024-03-05T12:00:00'})
+    assert search_filter.to_dict() == {'kb_ids': [3], 'file_types': ['pdf'], 'uploaded_after': '2024-03-01',
+                                       'uploaded_before': '2024-03-05'}
+    assert search_filter.day_range() == (date(2024, 3, 2).toordinal(), date(2024, 3, 4).toordinal())
+    assert SearchFilter.from_json('{"file_types": ["pdf"]}').cache_key() == ((), ('pdf',), None, None)
+    
+    for invalid in ({'kb': [1]}, {'kb_ids': 'x'}, {'file_types': 'pdf'}, {'uploaded_after': 'March'}, ['pdf']):
+        with pytest.raises(ValueError):
+            SearchFilter.from_dict(invalid)
+
+
+def test_snapshot_bitmaps_filter_postings_like_the_database(filtered_corpus, service):
+    corpus = filtered_corpus
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    terms = set(corpus.words[:30] + corpus.words[-30:])
+    document_of = dict(db.session.query(TextChunk.id, TextChunk.document_id).join(Document).filter(
+        Document.knowledge_base_id.in_(corpus.kb_ids)
+    ).all())
+    
+    for search_filter in filters(corpus):
+        kb_ids = search_filter.narrow(corpus.kb_ids)
+        from_database = sorted(tuple(row) for row in service.search_index.find_postings(kb_ids, terms, search_filter))
+        from_snapshot = sorted(
+            (snapshot.chunk_id(position), term, frequency, length)
+            for position, term, frequency, length in snapshot.find_postings(kb_ids, terms, search_filter)
+        )
+        assert from_snapshot == from_database, search_filter.to_dict()
+        assert {document_of[row[0]] for row in from_database} <= allowed_documents(search_filter, corpus.kb_ids)
+
+
+@pytest.mark.parametrize('pruning', [False, True])
+def test_filtered_searches_rank_alike_and_only_return_allowed_documents(filtered_corpus, service, pruning):
+    corpus = filtered_corpus
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    service.dynamic_pruning = pruning
+    for search_filter in filters(corpus):
+        kb_ids = search_filter.narrow(corpus.kb_ids)
+        allowed = allowed_documents(search_filter, corpus.kb_ids)
+        for query in corpus.queries(10, seed=17):
+            from_snapshot = service._search_chunks(kb_ids, query, 5, source=snapshot, search_filter=search_filter)
+            from_database = service._search_chunks(kb_ids, query, 5, search_filter=search_filter)
+            assert [chunk.id for chunk in from_snapshot] == [chunk.id for chunk in from_database], query
+            assert all(chunk.document_id in allowed for chunk in from_database), query
+
+
+def test_search_route_rejects_invalid_filters(client, corpus):
+    url = f'/api/knowledge-bases/{corpus.kb_ids[0]}/search'
+    response = client.post(url, json={'query': corpus.words[0], 'filters': {'uploaded_after': 'yesterday'}})
+    assert response.status_code == 400 and 'uploaded_after' in response.get_json()['error']
+    assert client.post(url, json={'query': corpus.words[0], 'filters': {'file_types': ['txt']}}).status_code == 200
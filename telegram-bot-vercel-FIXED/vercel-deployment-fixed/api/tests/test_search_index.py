@@ -0,0 +1,64 @@
+from collections import Counter
+from src.models.bot import db, Document, TermPosting, TextChunk
+from src.services.search_index import SearchIndex
+
+
+def chunks_of(kb_ids):
+    return TextChunk.query.join(Document).filter(Document.knowledge_base_id.in_(kb_ids)).all()
+
+
+def postings_of(kb_ids):
+    """Every stored posting of the knowledge bases as (chunk id, term) -> (term frequency, positions)"""
+    rows = db.session.query(
+        TermPosting.chunk_id, TermPosting.term, TermPosting.term_frequency, TermPosting.positions
+    ).filter(TermPosting.knowledge_base_id.in_(kb_ids)).all()
+    return {(chunk_id, term): (frequency, positions) for chunk_id, term, frequency, positions in rows}
+
+
+def test_postings_count_each_chunks_keywords(corpus):
+    postings = postings_of(corpus.kb_ids)
+    expected = {
+        (chunk.id, term): frequency
+        for chunk in chunks_of(corpus.kb_ids)
+        for term, frequency in Counter(chunk.keywords.split()).items()
+    }
+    assert {key: frequency for key, (frequency, _) in postings.items()} == expected
+
+
+def test_postings_find_every_chunk_containing_a_term(corpus, service):
+    chunks = chunks_of(corpus.kb_ids)
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[1:]):
+        for word in corpus.words[:40] + corpus.words[-20:] + ['zzyzx']:
+            expected = {
+                chunk.id for chunk in chunks
+                if chunk.document.knowledge_base_id in kb_ids and word in chunk.keywords.split()
+            }
+            assert {row[0] for row in service.search_index.find_postings(kb_ids, {word})} == expected, word
+
+
+def test_search_results_contain_a_searched_term(corpus, service):
+    for query in corpus.queries(40, seed=6):
+        # The query words, their corrections and their partial matches
+        terms = set()
+        for chunk in service._search_chunks(corpus.kb_ids, query, 10, matched_terms=terms):
+            assert terms & set(chunk.keywords.split()), query
+
+
+def test_deleted_documents_leave_no_postings(make_corpus):
+    corpus = make_corpus(documents=3)
+    document_id = corpus.document_ids[0]
+    assert TermPosting.query.filter_by(document_id=document_id).count()
+    
+    corpus.delete_document(document_id)
+    assert not TermPosting.query.filter_by(document_id=document_id).count()
+    assert all(key[0] in {chunk.id for chunk in chunks_of(corpus.kb_ids)} for key in postings_of(corpus.kb_ids))
+
+
+def test_reindex_rebuilds_the_postings_written_at_ingest(make_corpus):
+    corpus = make_corpus(documents=4)
+    corpus.delete_document(corpus.document_ids[1])
+    ingested = postings_of(corpus.kb_ids)
+    
+    for kb_id in corpus.kb_ids:
+        SearchIndex().reindex_knowledge_base(kb_id)
+    assert postings_of(corpus.kb_ids) == ingested
@@ -0,0 +1,79 @@
+import time
+import flask
+import pytest
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.search_budget import SearchDeadline
+from src.services.sharded_search import ShardedSearch
+
+
+@pytest.fixture
+def sharded():
+    # Every segment is large enough to go to a worker
+    sharded = ShardedSearch(workers=2, min_shard_chunks=1)
+    yield sharded
+    sharded.shutdown()
+
+
+@pytest.fixture(scope='module')
+def segmented(processor):
+    """A snapshot of several segments: the first build, then one per document added since"""
+    from conftest import Corpus
+    corpus = Corpus(processor, seed=50, documents=2)
+    corpus_snapshots._rebuild(corpus.bot_id)
+    for i in range(4):
+        corpus.add_document(corpus.kb_ids[i % 2])
+    corpus.delete_document(corpus.document_ids[0])
+    return corpus
+
+
+def rankings(service, corpus, queries, **options):
+    snapshot = corpus_snapshots.get(corpus.bot_id)
+    assert len(snapshot.segments) > 1
+    return [
+        [chunk.id for chunk in service._search_chunks(kb_ids, query, 5, source=snapshot, **options)]
+        for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1])
+        for query in queries
+    ]
+
+
+def test_workers_rank_like_the_request_thread(segmented, service, sharded):
+    queries = segmented.queries(30) + [f'"{segmented.words[0]} {segmented.words[1]}"']
+    in_process = rankings(service, segmented, queries)
+    service.sharded_search = sharded
+    assert rankings(service, segmented, queries) == in_process
+    assert sharded._executors and all(sharded._loaded)
+
+
+def test_workers_start_without_the_application(segmented, service, sharded):
+    service.sharded_search = sharded
+    rankings(service, segmented, segmented.queries(1))
+    for executor in sharded._executors:
+        assert executor._mp_context.get_start_method() in ('forkserver', 'spawn')
+        assert executor.submit(flask.has_app_context).result(30) is False
+
+
+def test_busy_workers_are_replaced(sharded):
+    executors = list(sharded._get_executors())
+    executors[0].submit(time.sleep, 60)
+    process = next(iter(executors[0]._processes.values()))
+    assert process.is_alive()
+    
+    sharded._recycle(0)
+    process.join(10)
+    assert not process.is_alive()
+    assert sharded._executors[0] is not executors[0] and sharded._executors[1] is executors[1]
+    assert sharded._executors[0].submit(sum, [1, 2]).result(30) == 3
+
+
+def test_searches_past_the_deadline_leave_no_busy_workers(segmented, service, sharded):
+    queries = segmented.queries(10, seed=1)
+    expected = rankings(service, segmented, queries)
+    service.sharded_search = sharded
+    
+    deadline = SearchDeadline(0.001)
+    time.sleep(0.01)
+    snapshot = corpus_snapshots.get(segmented.bot_id)
+    service._search_chunks(segmented.kb_ids, queries[0], 5, source=snapshot, deadline=deadline)
+    assert deadline.partial
+    assert not any(executor._pending_work_items for executor in sharded._executors)
+    assert rankings(service, segmented, queries) == expected
@@ -0,0 +1,77 @@
+import io
+import os
+import pytest
+from src.services.corpus_snapshot import corpus_snapshots
+from src.services.index_files import MappedSegment
+from src.services.search_index import SearchIndex
+from src.services.snapshot_archive import archive_name, pull_snapshot
+
+
+def export(corpus):
+    archive = io.BytesIO()
+    summary = corpus_snapshots.export(corpus.bot_id, archive)
+    return summary, archive.getvalue()
+
+
+def test_export_import_round_trip(make_corpus, service, new_instance, tmp_path):
+    corpus = make_corpus(documents=4)
+    summary, archive = export(corpus)
+    
+    registry = new_instance(str(tmp_path))
+    result = registry.import_archive(io.BytesIO(archive))
+    assert result['adopted'] and result['bot_id'] == corpus.bot_id and result['chunks'] == summary['chunks']
+    
+    snapshot = registry.get(corpus.bot_id)
+    assert all(isinstance(segment, MappedSegment) for segment in snapshot.segments)
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
+
+
+def test_import_catches_up_with_changes_since_the_export(make_corpus, service, new_instance, tmp_path):
+    corpus = make_corpus(documents=4)
+    _, archive = export(corpus)
+    added = corpus.add_document(corpus.kb_ids[0])
+    deleted = corpus.document_ids[1]
+    corpus.delete_document(deleted)
+    
+    registry = new_instance(str(tmp_path))
+    assert registry.import_archive(io.BytesIO(archive))['adopted']
+    
+    snapshot = registry.get(corpus.bot_id)
+    assert snapshot.contains_document(added) and not snapshot.contains_document(deleted)
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
+
+
+def test_corrupt_archive_is_rejected(make_corpus, new_instance, tmp_path):
+    corpus = make_corpus(documents=2)
+    _, archive = export(corpus)
+    corrupt = bytearray(archive)
+    corrupt[len(corrupt) // 2] ^= 0xff
+    
+    registry = new_instance(str(tmp_path))
+    with pytest.raises(ValueError):
+        registry.import_archive(io.BytesIO(bytes(corrupt)))
+    assert registry.get(corpus.bot_id) is None
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+
+def test_archive_is_not_adopted_after_a_reindex(make_corpus, new_instance, tmp_path):
+    corpus = make_corpus(documents=2)
+    _, archive = export(corpus)
+    SearchIndex().reindex_knowledge_base(corpus.kb_ids[0])
+    
+    registry = new_instance(str(tmp_path))
+    assert not registry.import_archive(io.BytesIO(archive))['adopted']
+
+
+def test_new_instance_pulls_the_published_archive(make_corpus, service, new_instance, tmp_path):
+    corpus = make_corpus(documents=3)
+    _, archive = export(corpus)
+    source = tmp_path / 'published'
+    source.mkdir()
+    (source / archive_name(corpus.bot_id)).write_bytes(archive)
+    
+    registry = new_instance(str(tmp_path / 'index'))
+    assert pull_snapshot(corpus.bot_id, str(source))
+    snapshot = registry.open_stored(corpus.bot_id)
+    assert snapshot is not None
+    corpus.assert_ranks_like_the_database_index(service, snapshot)
@@ -0,0 +1,99 @@
+import html
+import random
+import re
+from contextlib import contextmanager
+from sqlalchemy import event
+from src.models.bot import db, Document, TextChunk
+from src.services.snippets import SNIPPET_LENGTH, make_snippet, match_pattern
+
+
+@contextmanager
+def counted_queries():
+    """Count the SQL statements run inside the block"""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def most_matches_in_a_window(content, pattern, length):
+    """Brute force: the most matches that fit together in any window of the given length"""
+    matches = [(match.start(), match.end()) for match in pattern.finditer(content)]
+    return max(
+        (sum(1 for start, end in matches[i:] if end - matches[i][0] <= length) for i in range(len(matches))),
+        default=0
+    )
+
+
+def visible_text(snippet):
+    return html.unescape(re.sub(r'</?b>', '', snippet))
+
+
+def test_chunks_and_documents_load_in_one_query_in_ranking_order(corpus, service):
+    chunk_ids = [row[0] for row in db.session.query(TextChunk.id).join(Document).filter(
+        Document.knowledge_base_id.in_(corpus.kb_ids)
+    ).all()]
+    ranking = random.Random(0).sample(chunk_ids, 10) + [max(chunk_ids) + 1000]
+    db.session.expire_all()
+    
+    with counted_queries() as statements:
+        chunks = service.search_index.load_chunks(ranking)
+        filenames = [chunk.document.original_filename for chunk in chunks]
+    assert [chunk.id for chunk in chunks] == ranking[:-1]
+    assert all(filenames) and len(statements) == 1
+    assert service.search_index.load_chunks([]) == []
+
+
+def test_snippets_show_the_window_with_the_most_matches():
+    rng = random.Random(1)
+    words = ['annual', 'plan', 'price', 'renewal', 'monthly', 'discount', 'invoice', 'support', 'team', 'refund']
+    for _ in range(300):
+        content = ' '.join(rng.choice(words) for _ in range(rng.randint(5, 150)))
+        pattern = match_pattern(rng.sample(words, rng.randint(1, 3)))
+        snippet = make_snippet(content, pattern)
+        shown = visible_text(snippet).strip('.')
+        
+        assert len(shown) <= SNIPPET_LENGTH and shown in content
+        assert snippet.count('<b>') == most_matches_in_a_window(content, pattern, SNIPPET_LENGTH), content
+        assert all(pattern.fullmatch(word) for word in re.findall(r'<b>(.*?)</b>', snippet))
+        
+        # Cut at word boundaries, with ellipses where text is left out
+        start = content.index(shown)
+        assert start == 0 or content[start - 1] == ' '
+        assert snippet.startswith('...') == (start > 0)
+        assert snippet.endswith('...') == (start + len(shown) < len(content))
+
+
+def test_snippets_escape_chunk_text():
+    content = 'Plans <script>alert(1)</script> & "annual" prices'
+    snippet = make_snippet(content, match_pattern(['annual']))
+    assert '<script>' not in snippet and '&amp;' in snippet
+    assert '<b>annual</b>' in snippet and visible_text(snippet) == content
+    
+    # Without matches the snippet is the start of the chunk
+    long_content = ' '.join(['plan'] * 200)
+    assert make_snippet(long_content, None).endswith('...')
+    assert make_snippet(long_content, match_pattern(['zzyzx'])) == make_snippet(long_content, None)
+
+
+def test_replies_show_each_result_with_its_filename_and_highlighted_matches(corpus, service):
+    replies = 0
+    for query in corpus.queries(30, seed=9):
+        terms = set()
+        chunks = service._search_chunks(corpus.kb_ids, query, 5, matched_terms=terms)
+        if not chunks:
+            continue
+        reply = service._format_response(chunks, query, terms=terms)
+        assert reply.count('📄 From ') == min(len(chunks), 3), query
+        for chunk in chunks[:3]:
+            assert f'📄 From {chunk.document.original_filename}:' in reply
+            assert make_snippet(chunk.content, match_pattern(terms)) in reply
+        assert '<b>' in reply, query
+        replies += 1
+    assert replies
@@ -0,0 +1,48 @@
+import pytest
+from src.services import sparse_search
+
+
+def ranking(service, kb_ids, query, max_results, backend):
+    return [chunk.id for chunk in service.search_chunks(kb_ids, query, max_results, backend)]
+
+
+@pytest.mark.parametrize('max_results', [1, 5, 30])
+def test_sparse_backend_ranks_like_keyword_search(corpus, service, max_results):
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[1:]):
+        for query in corpus.queries(60, seed=max_results):
+            expected = ranking(service, kb_ids, query, max_results, 'keyword')
+            assert ranking(service, kb_ids, query, max_results, 'sparse') == expected, query
+
+
+def test_scores_match_keyword_scoring(corpus, service):
+    matrix = service.sparse_backend._get_matrix(corpus.kb_ids)
+    for query in corpus.queries(30, seed=7):
+        query_plan, search_terms = service._build_query_plan(corpus.kb_ids, query)
+        total_chunks, total_tokens, document_frequencies = service.search_index.get_collection_stats(
+            corpus.kb_ids, search_terms
+        )
+        stats = service.scorer.collection_stats(total_chunks, total_tokens, document_frequencies)
+        ranked = matrix.search_many([query_plan], 10, service.min_score_threshold)[0]
+        term_frequencies = service.search_index.get_term_frequencies([chunk_id for chunk_id, _ in ranked], search_terms)
+        for chunk_id, score in ranked:
+            frequencies, length = term_frequencies[chunk_id]
+            expected, _ = service._calculate_relevance_score(frequencies, length, query_plan, stats)
+            assert score == pytest.approx(expected), query
+
+
+def test_term_matrix_follows_ingests_and_deletions(make_corpus, service):
+    corpus = make_corpus(documents=3)
+    queries = corpus.queries(20, seed=8)
+    matrix = service.sparse_backend._get_matrix(corpus.kb_ids)
+    
+    corpus.add_document(corpus.kb_ids[1])
+    corpus.delete_document(corpus.document_ids[0])
+    for query in queries:
+        assert ranking(service, corpus.kb_ids, query, 5, 'sparse') == ranking(service, corpus.kb_ids, query, 5, 'keyword')
+    assert service.sparse_backend._get_matrix(corpus.kb_ids) is not matrix
+
+
+def test_missing_scipy_falls_back_to_keyword_search(corpus, service, monkeypatch):
+    monkeypatch.setattr(sparse_search, 'sparse', None)
+    for query in corpus.queries(10, seed=9):
+        assert ranking(service, corpus.kb_ids, query, 5, 'sparse') == ranking(service, corpus.kb_ids, query, 5, 'keyword')
@@ -0,0 +1,121 @@
+import random
+import pytest
+from src.services.search_index import closest_term
+from src.services.spelling import SymSpellDictionary, edit_distance
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def misspell(rng, word, edits):
+    """Apply random deletions, insertions, substitutions and adjacent transpositions"""
+    for _ in range(edits):
+        i = rng.randrange(len(word))
+        kind = rng.choice(['delete', 'insert', 'substitute', 'transpose'])
+        if kind == 'delete' and len(word) > 3:
+            word = word[:i] + word[i + 1:]
+        elif kind == 'insert':
+            word = word[:i] + rng.choice(LETTERS) + word[i:]
+        elif kind == 'transpose' and i < len(word) - 1:
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        else:
+            word = word[:i] + rng.choice(LETTERS) + word[i + 1:]
+    return word
+
+
+def reference_distance(first, second):
+    """Optimal string alignment distance, uncapped"""
+    d = [[i + j if i * j == 0 else 0 for j in range(len(second) + 1)] for i in range(len(first) + 1)]
+    for i in range(1, len(first) + 1):
+        for j in range(1, len(second) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (first[i - 1] != second[j - 1]))
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[-1][-1]
+
+
+def misspellings(corpus, count, seed=0):
+    rng = random.Random(seed)
+    return [misspell(rng, rng.choice(corpus.words), rng.randint(1, 2)) for _ in range(count)]
+
+
+def test_edit_distance_matches_reference():
+    rng = random.Random(0)
+    for _ in range(2000):
+        first = misspell(rng, 'abcdefgh'[:rng.randint(3, 8)], rng.randint(0, 3))
+        second = misspell(rng, first, rng.randint(0, 3))
+        expected = reference_distance(first, second)
+        distance = edit_distance(first, second, 2)
+        assert distance == expected if expected <= 2 else distance > 2, (first, second)
+
+
+def test_lookup_finds_every_closest_term(corpus):
+    rng = random.Random(1)
+    frequencies = {word: rng.randint(1, 50) for word in corpus.words}
+    dictionary = SymSpellDictionary(frequencies)
+    for word in misspellings(corpus, 200):
+        max_distance = 1 if len(word) <= 4 else 2
+        distances = {term: reference_distance(word, term) for term in frequencies if abs(len(term) - len(word)) <= 2}
+        best = min(distances.values())
+        if best > max_distance:
+            assert dictionary.lookup(word) is None, word
+            continue
+        assert dictionary.lookup(word) == (best, {term for term, distance in distances.items() if distance == best}), word
+        assert dictionary.correct(word) == min(
+            (term for term, distance in distances.items() if distance == best),
+            key=lambda term: (-frequencies[term], term)
+        )
+
+
+def test_closest_term_breaks_ties_by_total_frequency():
+    # Closest in both knowledge bases, but the most frequent in neither
+    first = SymSpellDictionary({'nogeri': 3, 'nuri': 2})
+    second = SymSpellDictionary({'nuri': 2, 'nugeri': 3})
+    assert closest_term([first, second], 'nomuri') == 'nuri'
+    assert closest_term([first], 'nomuri') == 'nogeri'
+    assert closest_term([first, second], 'nuri') == 'nuri'
+    assert closest_term([first, second], 'zzyzx') is None
+
+
+def test_snapshot_corrects_like_the_database_index(corpus, service, snapshot):
+    words = misspellings(corpus, 300, seed=2)
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1], corpus.kb_ids[1:]):
+        for word in words:
+            assert snapshot.correct_term(kb_ids, word) == service.search_index.correct_term(kb_ids, word), (kb_ids, word)
+
+
+def test_corrections_only_use_the_searched_knowledge_bases(corpus, service, snapshot):
+    vocabularies = {
+        kb_id: set(service.search_index.get_collection_stats([kb_id], corpus.words)[2]) for kb_id in corpus.kb_ids
+    }
+    for word in misspellings(corpus, 300, seed=3):
+        for kb_id in corpus.kb_ids:
+            for source in (snapshot, service.search_index):
+                corrected = source.correct_term([kb_id], word)
+                assert corrected is None or corrected in vocabularies[kb_id], (kb_id, word, corrected)
+
+
+@pytest.mark.parametrize('pruning', [False, True])
+def test_misspelt_queries_find_the_corrected_results(corpus, service, snapshot, pruning):
+    service.dynamic_pruning = pruning
+    for word in misspellings(corpus, 60, seed=4):
+        for source in (snapshot, None):
+            corrected = (source or service.search_index).correct_term(corpus.kb_ids, word)
+            if corrected is None or corrected == word:
+                continue
+            misspelt = [chunk.id for chunk in service._search_chunks(corpus.kb_ids, word, 5, source=source)]
+            expected = [chunk.id for chunk in service._search_chunks(corpus.kb_ids, corrected, 5, source=source)]
+            assert misspelt == expected, (word, corrected)
+
+
+def test_replies_to_misspelt_questions_highlight_the_corrected_words(corpus, service, snapshot):
+    replies = 0
+    for word in misspellings(corpus, 60, seed=5):
+        corrected = snapshot.correct_term(corpus.kb_ids, word)
+        if corrected is None or corrected == word:
+            continue
+        reply = service.search_knowledge_base(corpus.bot_id, word)
+        assert reply == service.search_knowledge_base(corpus.bot_id, corrected), (word, corrected)
+        if reply is not None:
+            assert f'<b>{corrected}</b>' in reply.lower(), (word, corrected)
+            replies += 1
+    assert replies
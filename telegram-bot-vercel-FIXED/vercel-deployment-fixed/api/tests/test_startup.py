@@ -0,0 +1,34 @@
+import importlib
+import sys
+from sqlalchemy import inspect
+from src.models.user import db
+from src.services import filename_search
+from src.services.corpus_snapshot import corpus_snapshots
+
+
+def start_deployed_app(monkeypatch, tmp_path):
+    """Import api/app.py, the entry point vercel.json routes every request to, over a fresh database"""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'deployed.db'}")
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    try:
+        return importlib.import_module('app').app
+    finally:
+        sys.modules.pop('app', None)
+
+
+def test_deployed_entry_point_warm_starts_snapshots(app, monkeypatch, tmp_path):
+    warm_starts = []
+    monkeypatch.setattr(corpus_snapshots, 'warm_start', lambda: warm_starts.append(True))
+    deployed = start_deployed_app(monkeypatch, tmp_path)
+    assert warm_starts == [True]
+    
+    with deployed.app_context():
+        assert {'bot', 'knowledge_base', 'document', 'text_chunk', 'term_posting'} <= set(inspect(db.engine).get_table_names())
+        db.engine.dispose()
+
+
+def test_deployed_entry_point_installs_filename_search(app, monkeypatch, tmp_path):
+    installed = []
+    monkeypatch.setattr(filename_search, 'install_filename_search', lambda engine: installed.append(engine.dialect.name))
+    start_deployed_app(monkeypatch, tmp_path)
+    assert installed == ['sqlite']
@@ -0,0 +1,98 @@
+import random
+from collections import Counter
+import pytest
+from src.models.bot import Document, TextChunk
+from src.services import suggestions
+from src.services.suggestions import MAX_SUGGESTIONS, CompletionTrie, SuggestionIndex, suggestion_index
+
+
+def chunk_frequencies(kb_ids):
+    """Chunks of the knowledge bases' processed documents containing each term, counted from the chunks"""
+    return Counter(
+        term
+        for chunk in TextChunk.query.join(Document).filter(
+            Document.knowledge_base_id.in_(kb_ids), Document.processed == True
+        )
+        for term in set(chunk.keywords.split())
+    )
+
+
+def brute_force_completions(frequencies, prefix, limit=MAX_SUGGESTIONS):
+    matches = [(term, frequency) for term, frequency in frequencies.items() if term.startswith(prefix)]
+    return sorted(matches, key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+
+def prefixes(words, count, seed=0):
+    rng = random.Random(seed)
+    return [word[:rng.randint(1, len(word))] for word in rng.choices(words, k=count)] + ['zz', 'q']
+
+
+@pytest.mark.parametrize('scan_terms', [4, 64])
+def test_trie_completes_like_brute_force(monkeypatch, scan_terms):
+    # Small scan limits make most prefixes answer from stored node completions
+    monkeypatch.setattr(suggestions, 'MAX_SCAN_TERMS', scan_terms)
+    rng = random.Random(scan_terms)
+    words = {''.join(rng.choice('abcd') for _ in range(rng.randint(1, 7))) for _ in range(3000)}
+    frequencies = {word: rng.randint(1, 40) for word in words}
+    trie = CompletionTrie(frequencies)
+    for prefix in prefixes(sorted(words), 400) + ['a', 'ab', 'abcd']:
+        for limit in (1, 3, MAX_SUGGESTIONS):
+            assert trie.complete(prefix, limit) == brute_force_completions(frequencies, prefix, limit), prefix
+    assert trie.complete('') == [] and trie.weight('zz') == 0
+
+
+def test_suggestions_follow_the_chunk_frequencies_of_a_knowledge_base(corpus):
+    kb_id = corpus.kb_ids[0]
+    frequencies = chunk_frequencies([kb_id])
+    for prefix in prefixes(corpus.words, 100, seed=1):
+        word, completions = suggestion_index.suggest([kb_id], f'how much is the {prefix.upper()}', 5)
+        assert word == prefix
+        assert [(term, frequency) for term, frequency, _ in completions] == brute_force_completions(frequencies, prefix, 5)
+        assert all(text == f'how much is the {term}' for term, _, text in completions)
+
+
+def test_bot_suggestions_sum_frequencies_over_its_knowledge_bases(corpus):
+    frequencies = chunk_frequencies(corpus.kb_ids)
+    for prefix in prefixes(corpus.words, 100, seed=2):
+        _, completions = suggestion_index.suggest(corpus.kb_ids, prefix)
+        ranked = [(term, frequency) for term, frequency, _ in completions]
+        assert all(term.startswith(prefix) and frequency == frequencies[term] for term, frequency in ranked), prefix
+        assert ranked == sorted(ranked, key=lambda pair: (-pair[1], pair[0]))
+        assert len(ranked) == min(MAX_SUGGESTIONS, len(brute_force_completions(frequencies, prefix, 1000)))
+
+
+def test_typed_text_without_a_word_being_typed(corpus):
+    assert suggestion_index.suggest(corpus.kb_ids, 'annual plans ') == ('', [])
+    assert suggestion_index.suggest(corpus.kb_ids, '') == ('', [])
+    assert suggestion_index.suggest([999999], 'plan') is None
+
+
+def test_suggestions_follow_ingest_and_other_instances(make_corpus):
+    corpus = make_corpus(documents=2)
+    other_instance = SuggestionIndex(recheck_seconds=0)
+    query_prefixes = prefixes(corpus.words, 40, seed=3)
+    for index in (suggestion_index, other_instance):
+        index.suggest(corpus.kb_ids, 'warm up')
+    
+    corpus.add_document(corpus.kb_ids[0], sentences=80)
+    corpus.delete_document(corpus.document_ids[1])
+    frequencies = chunk_frequencies(corpus.kb_ids[:1])
+    for index in (suggestion_index, other_instance):
+        for prefix in query_prefixes:
+            _, completions = index.suggest(corpus.kb_ids[:1], prefix)
+            assert [(term, frequency) for term, frequency, _ in completions] == brute_force_completions(frequencies, prefix)
+
+
+def test_suggest_routes(client, corpus):
+    prefix = corpus.words[0][:2]
+    kb_response = client.get(f'/api/knowledge-bases/{corpus.kb_ids[0]}/suggest', query_string={'q': prefix, 'limit': 3})
+    data = kb_response.get_json()['data']
+    assert data['word'] == prefix and len(data['suggestions']) <= 3
+    assert [item['term'] for item in data['suggestions']] == [
+        term for term, _ in brute_force_completions(chunk_frequencies(corpus.kb_ids[:1]), prefix, 3)
+    ]
+    
+    bot_response = client.get(f'/api/bots/{corpus.bot_id}/suggest', query_string={'q': f'price {prefix}'})
+    assert all(item['text'] == f"price {item['term']}" for item in bot_response.get_json()['data']['suggestions'])
+    assert client.get('/api/knowledge-bases/999999/suggest', query_string={'q': prefix}).status_code == 404
+    assert client.get('/api/bots/999999/suggest', query_string={'q': prefix}).status_code == 404
@@ -0,0 +1,94 @@
+import random
+import pytest
+from src.services.top_k import PostingCursor, max_score_top_k
+
+
+def make_postings(rng, chunks, terms):
+    """Random posting lists of rare to common terms: (cursors, {position: {term: frequency}}, term weights)"""
+    cursors = []
+    postings = {}
+    weights = {}
+    for t in range(terms):
+        term = f'term{t}'
+        weights[term] = rng.uniform(0.5, 4.0)
+        positions = sorted(rng.sample(range(chunks), max(1, int(chunks * rng.choice([0.005, 0.05, 0.3])))))
+        frequencies = [rng.randint(1, 6) for _ in positions]
+        for position, frequency in zip(positions, frequencies):
+            postings.setdefault(position, {})[term] = frequency
+        cursors.append(PostingCursor(term, positions, frequencies, weights[term] * max(frequencies)))
+    return cursors, postings, weights
+
+
+def scoring(weights):
+    """contribution() and score() of a linear model where every seventh chunk does not qualify"""
+    def contribution(term, frequency, position):
+        return weights[term] * frequency
+    
+    def score(position, term_frequencies):
+        if position % 7 == 0:
+            return None
+        return sum(weights[term] * frequency for term, frequency in sorted(term_frequencies.items()))
+    
+    return contribution, score
+
+
+def exhaustive_top_k(postings, k, score):
+    scored = [(score(position, term_frequencies), position) for position, term_frequencies in postings.items()]
+    scored = [(value, position) for value, position in scored if value is not None]
+    return sorted(scored, key=lambda entry: (-entry[0], entry[1]))[:k]
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('k', [1, 5, 50])
+def test_max_score_matches_exhaustive_ranking(seed, k):
+    rng = random.Random(seed)
+    cursors, postings, weights = make_postings(rng, chunks=3000, terms=rng.randint(1, 5))
+    contribution, score = scoring(weights)
+    
+    ranked, scored = max_score_top_k(cursors, k, contribution, score)
+    expected = exhaustive_top_k(postings, k, score)
+    assert [position for _, position in ranked] == [position for _, position in expected]
+    assert [value for value, _ in ranked] == pytest.approx([value for value, _ in expected])
+    assert scored <= len(postings)
+
+
+def test_max_score_without_postings():
+    assert max_score_top_k([], 5, None, None) == ([], 0)
+
+
+@pytest.mark.parametrize('k', [1, 5, 20])
+def test_pruned_search_ranks_like_exhaustive_search(corpus, service, snapshot, k):
+    for kb_ids in (corpus.kb_ids, corpus.kb_ids[:1]):
+        for query in corpus.queries(40, seed=k):
+            service.dynamic_pruning = True
+            pruned = [chunk.id for chunk in service._search_chunks(kb_ids, query, k, source=snapshot)]
+            service.dynamic_pruning = False
+            exhaustive = [chunk.id for chunk in service._search_chunks(kb_ids, query, k, source=snapshot)]
+            assert pruned == exhaustive, query
+
+
+class SpentDeadline:
+    """A deadline whose budget ran out before the search started"""
+    
+    partial = False
+    
+    def expired(self):
+        self.partial = True
+        return True
+
+
+def test_max_score_past_the_deadline_returns_the_most_promising_chunks():
+    # A common term in every chunk, and a rare one near the end of the posting lists
+    common = list(range(10000))
+    rare = list(range(9000, 9010))
+    cursors = [PostingCursor('common', common, [1] * len(common), 1.0),
+               PostingCursor('rare', rare, [1, 2, 3, 4, 5, 5, 4, 3, 2, 1], 15.0)]
+    postings = {position: {'common': 1} for position in common}
+    for position, frequency in zip(rare, cursors[1].frequencies):
+        postings[position]['rare'] = frequency
+    contribution, score = scoring({'common': 1.0, 'rare': 3.0})
+    
+    # The rare term's chunks are scored first, so the search is right however early it stops
+    ranked, scored = max_score_top_k(cursors, 3, contribution, score, SpentDeadline())
+    assert ranked == exhaustive_top_k(postings, 3, score)
+    assert scored < len(postings)
@@ -0,0 +1,70 @@
+import random
+import numpy as np
+from src.models.bot import db, Bot, Document, TextChunk
+from src.services.vector_search import HNSWIndex, decode_vector, encode_vector, get_embedder
+
+
+def embeddings(kb_ids):
+    """Stored vectors of the chunks with keywords (the others have nothing to embed)"""
+    return dict(db.session.query(TextChunk.id, TextChunk.embedding).join(Document).filter(
+        Document.knowledge_base_id.in_(kb_ids), TextChunk.token_count > 0
+    ).all())
+
+
+def use_backend(corpus, backend):
+    db.session.get(Bot, corpus.bot_id).search_backend = backend
+    db.session.commit()
+
+
+def test_vectors_round_trip_within_quantisation_error():
+    rng = random.Random(0)
+    vector = [rng.uniform(-1, 1) for _ in range(64)]
+    scale, values = decode_vector(encode_vector(vector))
+    assert max(abs(value * scale - expected) for value, expected in zip(values, vector)) <= scale / 2 + 1e-3
+    assert encode_vector([0.0] * 8) is None
+
+
+def test_hnsw_finds_the_exact_nearest_neighbours():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 32))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = HNSWIndex(32)
+    blobs = [encode_vector(vector.tolist()) for vector in vectors]
+    for item_id, blob in enumerate(blobs):
+        index.add(item_id, blob)
+    quantised = np.array([[value * scale for value in values] for scale, values in map(decode_vector, blobs)])
+    
+    found = 0
+    queries = rng.normal(size=(50, 32))
+    for query in queries:
+        exact = set(np.argsort(-(quantised @ query))[:10].tolist())
+        found += len(exact & {item_id for item_id, _ in index.search(query, 10)})
+    assert found >= 0.95 * 10 * len(queries)
+    
+    for item_id in range(0, 2000, 2):
+        index.remove(item_id)
+    assert all(item_id % 2 for query in queries for item_id, _ in index.search(query, 10))
+
+
+def test_only_vector_bots_embed_chunks_at_ingest(make_corpus):
+    keyword = make_corpus(documents=2)
+    assert not any(embeddings(keyword.kb_ids).values())
+    
+    vector = make_corpus(documents=0)
+    use_backend(vector, 'vector')
+    vector.add_document(vector.kb_ids[0])
+    stored = embeddings(vector.kb_ids)
+    assert stored and all(stored.values())
+
+
+def test_switching_to_vector_search_embeds_the_existing_chunks(make_corpus, service):
+    corpus = make_corpus(documents=4)
+    use_backend(corpus, 'vector')
+    
+    chunk = TextChunk.query.join(Document).filter(Document.knowledge_base_id == corpus.kb_ids[0]).first()
+    results = service.search_chunks(corpus.kb_ids, chunk.content, 5, 'vector')
+    assert results and results[0].id == chunk.id
+    
+    stored = embeddings(corpus.kb_ids)
+    assert stored and all(stored.values())
+    assert stored[chunk.id] == encode_vector(get_embedder().embed(chunk.content))